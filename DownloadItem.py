@@ -1,147 +1,170 @@
 import gi
 gi.require_version("Gtk", "4.0")
-from gi.repository import Gtk, GObject, GLib
-from ytdlp_tasks import TaskGetMeta, TaskGetFile
+from gi.repository import Gdk, GObject, GLib
+from ytdlp_tasks import format_options, persist, remove_partial_files
+from process_backend import task_types
+from thumbnails import texture_from_file
+from task_scheduler import TaskScheduler, host_of
+from compact_meta import CompactMeta
 from pathlib import Path
-import copy
+from collections import ChainMap
 
-class DownloadItem(Gtk.Box):
+def _format_bytes(num: float) -> str:
     """
-    Layout of the interface for single download item
+    human readable size, e.g. 3.82MiB
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num < 1024.0:
+            return f"{num:.2f}{unit}"
+        num /= 1024.0
+    return f"{num:.2f}TiB"
+
+def _format_seconds(secs: float) -> str:
+    """
+    duration in [HH:]MM:SS
+    """
+    mins, secs = divmod(int(secs), 60)
+    hours, mins = divmod(mins, 60)
+    return f"{hours:d}:{mins:02d}:{secs:02d}" if hours else f"{mins:02d}:{secs:02d}"
+
+
+_default_thumbnail = None
+
+def default_thumbnail() -> Gdk.Texture:
+    """
+    the placeholder image shared by all items without a thumbnail
+    """
+    global _default_thumbnail
+    if _default_thumbnail is None:
+        _default_thumbnail = texture_from_file(
+            str(Path(__file__).parent.joinpath("assets/pygyt_wink.png")))
+    return _default_thumbnail
+
+
+class DownloadItem(GObject.Object):
+    """
+    The model of a single download item.
+    Items are plain objects kept in the Gio.ListStore of the window, the widgets
+    showing them are DownloadRow instances recycled by the list view.
     """
     __gsignals__ = {
-        "meta_ready": (GObject.SignalFlags.RUN_FIRST, None, (str,))
+        "meta_ready": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        # "started" when the download task gets a worker slot and "ended" when it is done
+        "download_state": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        # a batch of entries (list of dict) found in a playlist, and whether the playlist is complete
+        "entries_found": (GObject.SignalFlags.RUN_FIRST, None, (object, bool))
     }
 
-    def __init__(self, config: dict, url: str, **kwargs):
-        super().__init__(orientation=Gtk.Orientation.HORIZONTAL, **kwargs)
-        # every new item receives a copy of the system-wise default configuration,
-        # but later turns into an item specific configuration when metadata is retrieved.
-        self.config = copy.deepcopy(config)
-        self.set_spacing(12)
-
-        # vbox layout for title and download options
-        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        # Title and progress
-        self.title = Gtk.Entry()
-        self.title.set_text("retrieving metadata ...")
-        self.title.set_hexpand(True)
-        self.title.set_editable(False)
-        self.title.set_has_frame(False)
-        vbox.append(self.title)
-
-        # grid layout for all download options
-        grid_dlopts = Gtk.Grid()
-        grid_dlopts.set_column_spacing(12)
-        # Audio only & format
-        box_aformat = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        self.audionly_opts = Gtk.CheckButton.new_with_label(" Audio Only  ")
-        box_aformat.append(self.audionly_opts)
-        self.aformat = Gtk.StringList()
-        self.aformat.append("wav")
-        self.aformat_opts = Gtk.DropDown.new(self.aformat, None)
-        self.aformat_opts.set_halign(Gtk.Align.END)
-        box_aformat.append(self.aformat_opts)
-        grid_dlopts.attach(box_aformat, 0, 0, 1, 1)
-
-        grid_dlopts.attach(Gtk.Separator(), 1, 0, 1, 1)
-
-        # Resolution selection
-        box_resolution = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        label_resolution = Gtk.Label(label="Resolution  ")
-        box_resolution.append(label_resolution)
-        self.resolutions = Gtk.StringList()
-        self.resolutions.append("best")
-        self.resolution_opts = Gtk.DropDown.new(self.resolutions, None)
-        self.resolution_opts.set_halign(Gtk.Align.END)
-        box_resolution.append(self.resolution_opts)
-        grid_dlopts.attach(box_resolution, 2, 0, 1, 1)
-
-        grid_dlopts.attach(Gtk.Separator(), 3, 0, 1, 1)
-
-        # Video format selection
-        box_vformat = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        label_vformat = Gtk.Label(label="Video Format  ")
-        box_vformat.append(label_vformat)
-        self.vformat = Gtk.StringList()
-        self.vformat.append("best")
-        self.vformat_opts = Gtk.DropDown.new(self.vformat, None)
-        self.vformat_opts.set_halign(Gtk.Align.END)
-        box_vformat.append(self.vformat_opts)
-        grid_dlopts.attach(box_vformat, 4, 0, 1, 1)
-
-        vbox.append(grid_dlopts)
-        self.append(vbox)
-
-        # Thumbnail (read temporary image file)
-        self.thumbnail = Gtk.Picture.new_for_filename(str(Path(__file__).parent.joinpath("assets/pygyt_wink.png")))
-        self.thumbnail.set_keep_aspect_ratio(True)
-        self.append(self.thumbnail)
-
-        # initialize states of controls
-        self.audionly_opts.connect("toggled", self.on_toggle_audio_only)
-        self.audionly_opts.set_active(True)
-
-        self.task_get_meta = TaskGetMeta(
-            config=self.config,
-            url=url,
-            on_done_callback=self.on_get_meta_task_done
-        )
-        self.meta = None
+    # properties shown by the row widget
+    title = GObject.Property(type=str, default="retrieving metadata ...")
+    status = GObject.Property(type=str, default="")
+    tooltip = GObject.Property(type=str, default="")
+    progress = GObject.Property(type=float, default=0.0)
+    # metadata task is running, the row pulses its progress
+    pulsing = GObject.Property(type=bool, default=False)
+    thumbnail = GObject.Property(type=Gdk.Paintable)
+    # download options chosen in the row widget
+    audio_only = GObject.Property(type=bool, default=True)
+    aformat_selected = GObject.Property(type=int, default=0)
+    resolution_selected = GObject.Property(type=int, default=0)
+    vformat_selected = GObject.Property(type=int, default=0)
+    # choices of the options, lists of strings replaced as a whole
+    aformats = GObject.Property(type=object)
+    resolutions = GObject.Property(type=object)
+    vformats = GObject.Property(type=object)
 
-    def on_toggle_audio_only(self, check_obj):
-        """
-        toggle audio only controls on or off
-        """
-        if check_obj.props.active:
-            self.aformat_opts.set_sensitive(True)
-            self.resolution_opts.set_sensitive(False)
-            self.vformat_opts.set_sensitive(False)
-        else:
-            self.aformat_opts.set_sensitive(False)
-            self.resolution_opts.set_sensitive(True)
-            self.vformat_opts.set_sensitive(True)
+    def __init__(self, config: dict, url: str, scheduler: TaskScheduler,
+                 meta_scheduler: TaskScheduler, **kwargs):
+        super().__init__(**kwargs)
+        # every new item reads the system-wise configuration through a layer of its own,
+        # item specific values are set in the layer when metadata is retrieved.
+        # Values are never modified in place, so the configuration is not copied.
+        self.config = ChainMap(dict(), config)
+        # yt-dlp options given by the user, before any item specific option is added
+        self.additional_options = list(config["additional-options"] or [])
+
+        self.aformats = ["wav"]
+        self.resolutions = ["best"]
+        self.vformats = ["best"]
+        self.thumbnail = default_thumbnail()
 
-    def get_meta(self):
+        # the target URL
+        self.url = url
+        # the compact metadata, the full info is loaded again only when downloading
+        self.meta = None
+        # the metadata task runs only once
+        self.meta_requested = False
+        # start downloading once metadata is ready
+        self.download_requested = False
+        # number of entries expanded from this item if it turns out to be a playlist,
+        # and the error if the expansion failed
+        self.expanded = 0
+        self.expand_error = None
+        # the queue journal and the row of this item in it, set by the window
+        self.journal = None
+        self.journal_id = None
+        # format choices restored from the journal, selected once the choices are known
+        self.restored_choices = None
+        # the schedulers shared by all items to run metadata and downloading tasks
+        self.meta_scheduler = meta_scheduler
+        self.scheduler = scheduler
+        self.task_get_file = None
+        # priority of the download, a higher one preempts a running download of a lower one
+        self.priority = 0
+        # state of the download: None, "queued", "downloading", "paused", "done" or "failed"
+        self.state = None
+        self.shown_progress = None
+
+    def get_meta(self, priority: int = 0):
         """
-        Starting a task thread to extract meta info of the download item.
-        Expecting to be called once this item is added to the download list
-        and must be called before proceeding audio/video file downloading.
+        Submitting a task to the metadata scheduler to extract meta info of the download item.
+        Expecting to be called once this item is added to the download list, or once the
+        entry of a playlist gets visible or selected, and must be called before proceeding
+        audio/video file downloading.
         """
-        # don't run the task again if metadata is ready
-        if self.meta is not None: return
-        # start threading task
-        self.task_get_meta.start()
-        self.title.set_progress_pulse_step(0.2)
-        self.title.progress_pulse()
-        self.timer_pulse = GLib.timeout_add(50, self.on_pulse_timeout)
+        # don't run the task again if metadata is ready or the task is already queued
+        if self.meta is not None or self.meta_requested: return
+        self.meta_requested = True
+        self.status = "queued"
+        TaskGetMeta, _ = task_types(self.config)
+        task_get_meta = TaskGetMeta(
+            config=self.config,
+            url=self.url,
+            on_done_callback=self.on_get_meta_task_done,
+            on_entries_callback=self.on_get_entries
+        )
+        self.meta_scheduler.submit(
+            task_get_meta,
+            priority=priority,
+            host=host_of(self.url),
+            on_start=lambda: GLib.idle_add(self.on_get_meta_started)
+        )
 
-    def on_pulse_timeout(self):
+    def on_get_meta_started(self):
         """
-        timer timeout event specifically for the activity of getting meta only
+        callback when the queued metadata task gets a worker slot
         """
-        self.title.progress_pulse()
-        # return True for periodically get called
-        return True
+        self.status = ""
+        self.pulsing = True
 
-    def on_get_meta_task_done(self, meta: dict, file_name:str, strerr: str):
-        # stop the activity timer
-        if self.timer_pulse:
-            GLib.source_remove(self.timer_pulse)
-            self.timer_pulse = None
-            self.title.set_progress_pulse_step(0.0)
-        self.title.set_progress_fraction(1.0)
+    def on_get_meta_task_done(self, meta: CompactMeta, file_name:str, thumbnail: Gdk.Texture, strerr: str):
+        # stop the activity
+        self.pulsing = False
 
         if meta is None:
-            self.set_tooltip_text(f"Error: {strerr}")
-            self.title.set_progress_fraction(0.0)
-            self.title.set_text("retrieving metadata failed.")
-            self.emit("meta_ready", self.title.props.text)
+            self.tooltip = f"Error: {strerr}"
+            self.progress = 0.0
+            self.title = "retrieving metadata failed."
+            self.emit("meta_ready", self.title)
             # TODO: also change the thumbnail to indicate error status
             return
 
+        if meta.archived:
+            self.on_archived(meta, file_name, thumbnail)
+            return
+
         self.meta = meta
-        self.title.set_text(file_name)
+        self.title = file_name
 
         # update configuration for later task to download file
         self.config["file_name"] = file_name
@@ -149,102 +172,257 @@ class DownloadItem(Gtk.Box):
         # info jaon file should also be available by design
         self.config["info_json"] = f"{self.config['download-folder']}/{file_name}.json"
 
-        formats = meta.get("formats")
-
-        # get all available video resolutions
-        resolutionset = {f["resolution"] for f in formats
-            if (f.get("video_ext") is not None and f["video_ext"] != "none")
-            and (f.get("width") is not None and f["width"] != "none")}
-        for r in resolutionset:
-            self.resolutions.append(r)
-
-        # get all available video extensions
-        videoset = {f["video_ext"] for f in formats
-            if f.get("video_ext") is not None and f["video_ext"] != "none"}
-        for v in videoset:
-            self.vformat.append(v)
-
-        # get all available audio extensions
-        audioset = {f["audio_ext"] for f in formats
-            if f.get("audio_ext") is not None and f["audio_ext"] != "none"}
-        for a in audioset:
-            self.aformat.append(a)
-        # stop the progress
-        self.title.set_progress_fraction(0.0)
-        # update the image
-        self.thumbnail.set_filename(f"{self.config['download-folder']}/{file_name}.png")
+        # all available video resolutions, video and audio extensions,
+        # indexed by the task in the worker thread
+        self.resolutions = self.resolutions + meta.resolutions
+        self.vformats = self.vformats + meta.video_exts
+        self.aformats = self.aformats + meta.audio_exts
+        if self.restored_choices is not None:
+            self.restore_choices(self.restored_choices)
+            self.restored_choices = None
+        # stop the progress, a restored item may have been downloaded already
+        self.progress = 1.0 if "done" == self.state else 0.0
+        # update the image, already downscaled to the row size by the task
+        if thumbnail is not None:
+            self.thumbnail = thumbnail
         # update tooltip
-        self.set_tooltip_text(f"Ready to download: {self.config['download-folder']}")
+        self.tooltip = f"Ready to download: {self.config['download-folder']}"
+        self.save(title=file_name, file_name=file_name, info_json=self.config["info_json"],
+                  state=self.state or "ready")
         # item is ready for download
-        self.emit("meta_ready", self.title.props.text)
+        self.emit("meta_ready", self.title)
+        if self.download_requested:
+            self.get_file()
+
+    def on_archived(self, meta: CompactMeta, file_name: str | None, thumbnail: Gdk.Texture):
+        """
+        the video is in the download archive, the item is done without downloading it again
+        """
+        self.meta = meta
+        self.title = file_name or meta.title or self.url
+        self.download_requested = False
+        self.state = self.status = "done"
+        self.progress = 1.0
+        if thumbnail is not None:
+            self.thumbnail = thumbnail
+        self.tooltip = "Already downloaded, found in the download archive"
+        self.save(title=self.title, state=self.state)
+        self.emit("meta_ready", self.title)
+
+    def on_get_entries(self, entries: list, finished: bool, strerr: str):
+        """
+        callback when the item turns out to be a playlist, with the entries found so far
+        """
+        if finished:
+            self.pulsing = False
+            if strerr:
+                self.expand_error = strerr
+                self.tooltip = f"Error: {strerr}"
+                self.title = f"expanding playlist failed after {self.expanded + len(entries)} entries."
+        else:
+            self.status = f"{self.expanded + len(entries)} entries"
+        self.emit("entries_found", entries, finished)
 
     def get_file(self):
         """
-        Starting a task thread to download file.
+        Submitting a task to the download scheduler to download file.
         Expecting to be called after get_meta(), i.e. json file of metadata is ready.
         """
-        # ignore if metadata is not ready
+        # metadata of a playlist entry is retrieved on demand, download right after it
         if self.meta is None:
-            self.set_tooltip_text("Warning: no metadata, not ready to download")
+            self.download_requested = True
+            self.get_meta(priority=1)
             return
-        # ignore if file is downloaded
-        if 1.0 == self.title.props.progress_fraction:
+        # ignore if file is downloaded, or download is already queued
+        if not self.is_ready_for_download():
             return
 
-        # append additional audio/video options
-        if self.config["additional-options"] is None:
-            self.config["additional-options"] = list()
-        # Audio/Video options
-        if self.audionly_opts.props.active:
-            # Audio only options
-            self.config["additional-options"].append("--extract-audio")
-            self.config["additional-options"].append("--audio-quality=0")
-            selected_format = self.aformat_opts.get_selected_item()
-            self.config["additional-options"].append(f"--audio-format={selected_format.props.string}")
-        else:
-            # Video preference options
-            format_sort = "" 
-            res_str = self.resolution_opts.get_selected_item().props.string
-            ext_str = self.vformat_opts.get_selected_item().props.string
-            if "best" != res_str:
-                format_sort = f"res:{res_str.rsplit(sep='x')[-1]}"
-            if "best" != ext_str:
-                format_sort += f",ext:{ext_str}"
-            if len(format_sort) > 0:
-                self.config["additional-options"].append(f"--format-sort={format_sort}")
-            # otherwise, use the default -f "bv*+ba/b"
+        # append additional audio/video options, always start over from the user's
+        # options since a failed download can be submitted again
+        self.config["additional-options"] = self.additional_options + format_options(
+            self.audio_only,
+            self.aformats[self.aformat_selected],
+            self.resolutions[self.resolution_selected],
+            self.vformats[self.vformat_selected]
+        )
 
         # construct threading task to download file
+        _, TaskGetFile = task_types(self.config)
         self.task_get_file = TaskGetFile(
             config=self.config,
-            url=self.meta["original_url"],
-            on_progress_callback=self.on_download_progress,
-            on_done_callback=self.on_get_file_task_done
+            url=self.meta.original_url or self.url,
+            on_done_callback=self.on_get_file_task_done,
+            info=self.meta
+        )
+        self.progress = 0.0
+        self.state = self.status = "queued"
+        self.tooltip = "Queued, waiting for a free download slot"
+        self.save(audio_only=self.audio_only,
+                  aformat=self.aformats[self.aformat_selected],
+                  resolution=self.resolutions[self.resolution_selected],
+                  vformat=self.vformats[self.vformat_selected],
+                  state=self.state)
+        self.submit_file_task()
+
+    def submit_file_task(self):
+        self.scheduler.submit(
+            self.task_get_file,
+            priority=self.priority,
+            host=host_of(self.meta.original_url or self.url),
+            on_start=lambda: GLib.idle_add(self.on_download_started)
         )
-        self.title.set_progress_fraction(0.0)
-        self.task_get_file.start()
+
+    def prioritize(self):
+        """
+        download this item before the others, a running download of a lower priority
+        is preempted if all download slots are taken, and resumes later
+        """
+        self.priority = 1
+        # a queued download keeps what is left of its retry backoff
+        if self.task_get_file is not None and self.scheduler.reprioritize(self.task_get_file, self.priority):
+            return
+        if self.state in (None, "failed", "paused"):
+            self.get_file()
+
+    def pause(self):
+        """
+        stop the download keeping its partial files, get_file() resumes from them
+        """
+        self.interrupt("paused")
+
+    def cancel(self):
+        """
+        stop the download and remove its partial files, e.g. when the item is removed
+        """
+        self.download_requested = False
+        if "paused" == self.state:
+            self.discard_partial_files()
+            self.state = self.status = "cancelled"
+            return
+        self.interrupt("cancelled")
+
+    def discard_partial_files(self):
+        """
+        remove the partial files of the download in the background, none can be found for
+        a paused item restored from the journal before its metadata (and so its file name)
+        is retrieved, its files are left then
+        """
+        if "file_name" in self.config:
+            persist(remove_partial_files, self.config["download-folder"], self.config["file_name"])
+
+    def interrupt(self, reason: str):
+        if self.state not in ("queued", "downloading"):
+            return
+        self.task_get_file.interrupt(reason)
+        if self.scheduler.remove(self.task_get_file):
+            # not running, e.g. still queued or waiting for a retry
+            if "cancelled" == reason:
+                self.discard_partial_files()
+            self.on_get_file_task_done(-1, reason)
+        else:
+            self.status = {"paused": "pausing ...", "cancelled": "cancelling ..."}[reason]
+
+    def on_download_started(self):
+        """
+        callback when the queued downloading task gets a worker slot
+        """
+        # the task has been interrupted before it got the slot
+        if self.task_get_file.interrupted in ("paused", "cancelled"):
+            return
+        self.state = self.status = "downloading"
+        self.tooltip = f"Downloading to: {self.config['download-folder']}"
+        self.save(state=self.state)
+        self.emit("download_state", "started")
     
-    def on_download_progress(self, status: str, percent: float):
+    def update_progress(self):
         """
-        callback for downloading task to update the progress
+        Show the latest progress published by the downloading task,
+        expected to be polled periodically by the main loop timer of the window.
         """
-        self.title.set_progress_fraction(percent)
-        self.set_tooltip_text(f"{status}: {percent}")
+        progress = self.task_get_file.progress
+        # nothing new since the last poll
+        if progress is None or progress is self.shown_progress:
+            return
+        self.shown_progress = progress
+        status, downloaded, total, speed, eta = progress
+        percent = downloaded / total if total else 0.0
+        self.progress = min(percent, 1.0)
+        if "downloading" == status:
+            text = f"{percent:.0%}" if total else _format_bytes(downloaded)
+            if speed is not None:
+                text += f"  {_format_bytes(speed)}/s"
+            if eta is not None:
+                text += f"  ETA {_format_seconds(eta)}"
+            self.status = text
+        else:
+            self.status = status
 
     def on_get_file_task_done(self, retcode: int, strerr: str):
         """
         callback when downloading task ended
         """
+        self.update_progress()
+        self.emit("download_state", "ended")
         if 0 == retcode:
-            self.set_tooltip_text(f"File 100% downloaded in: {self.config['download-folder']}")
+            self.state = self.status = "done"
+            self.progress = 1.0
+            self.tooltip = f"File 100% downloaded in: {self.config['download-folder']}"
+        elif "paused" == self.task_get_file.interrupted:
+            self.state = self.status = "paused"
+            self.tooltip = "Paused, resumes from the partial file"
+        elif "cancelled" == self.task_get_file.interrupted:
+            self.state = self.status = "cancelled"
+            self.progress = 0.0
+            self.tooltip = "Cancelled"
         else:
-            self.set_tooltip_text(f"Failed to download ({retcode}): {strerr}")
+            self.state = self.status = "failed"
+            self.tooltip = f"Failed to download ({retcode}): {strerr}"
             # TODO: also change the thumbnail to indicate error status
+        self.save(state=self.state)
     
+    def save(self, **values):
+        """
+        record the changes of this item in the queue journal
+        """
+        if self.journal is not None and self.journal_id is not None:
+            self.journal.update(self.journal_id, **values)
+
+    def restore(self, row):
+        """
+        Restore the item from its row in the queue journal. A download which was queued
+        or interrupted is requested again, and yt-dlp resumes it from its .part file.
+        """
+        self.audio_only = bool(row["audio_only"])
+        self.restored_choices = {"aformat": row["aformat"], "resolution": row["resolution"],
+                                 "vformat": row["vformat"]}
+        if row["state"] in ("queued", "downloading"):
+            self.download_requested = True
+            self.status = "interrupted"
+        elif row["state"] in ("done", "failed", "paused"):
+            self.state = self.status = row["state"]
+            self.progress = 1.0 if "done" == row["state"] else 0.0
+
+    def restore_choices(self, choices: dict):
+        """
+        select the recorded format choices, if they are still available
+        """
+        for prop, values, value in (("aformat-selected", self.aformats, choices["aformat"]),
+                                    ("resolution-selected", self.resolutions, choices["resolution"]),
+                                    ("vformat-selected", self.vformats, choices["vformat"])):
+            if value in values:
+                self.set_property(prop, values.index(value))
+
+    def set_bandwidth_weight(self, weight: float):
+        """
+        the weight of this item in sharing the global bandwidth, a running download
+        follows it without restarting
+        """
+        self.config["bandwidth-weight"] = weight
+        if self.task_get_file is not None and self.task_get_file.bandwidth_lease is not None:
+            self.task_get_file.bandwidth_lease.set_weight(weight)
+
     def is_ready_for_download(self) -> bool:
         """
+        metadata is ready, and the file is neither downloaded nor queued/being downloaded
         """
-        if self.meta is None or 1.0 == self.title.props.progress_fraction:
-            return False
-        else:
-            return True
+        return self.meta is not None and self.state in (None, "failed", "paused")
@@ -0,0 +1,180 @@
+import gi
+gi.require_version("Gtk", "4.0")
+from gi.repository import Gtk, GObject, GLib
+from DownloadItem import DownloadItem
+
+class DownloadRow(Gtk.Box):
+    """
+    Layout of the interface for single download item.
+    Rows are created by the list view only for the visible part of the list,
+    and are recycled by binding them to different DownloadItem objects.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(orientation=Gtk.Orientation.HORIZONTAL, **kwargs)
+        self.set_spacing(12)
+        self.set_hexpand(True)
+
+        # vbox layout for title and download options
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        # Title and progress
+        self.title = Gtk.Entry()
+        self.title.set_hexpand(True)
+        self.title.set_editable(False)
+        self.title.set_has_frame(False)
+        vbox.append(self.title)
+
+        # grid layout for all download options
+        grid_dlopts = Gtk.Grid()
+        grid_dlopts.set_column_spacing(12)
+        # Audio only & format
+        box_aformat = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.audionly_opts = Gtk.CheckButton.new_with_label(" Audio Only  ")
+        box_aformat.append(self.audionly_opts)
+        self.aformat_opts = Gtk.DropDown.new(None, None)
+        self.aformat_opts.set_halign(Gtk.Align.END)
+        box_aformat.append(self.aformat_opts)
+        grid_dlopts.attach(box_aformat, 0, 0, 1, 1)
+
+        grid_dlopts.attach(Gtk.Separator(), 1, 0, 1, 1)
+
+        # Resolution selection
+        box_resolution = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        label_resolution = Gtk.Label(label="Resolution  ")
+        box_resolution.append(label_resolution)
+        self.resolution_opts = Gtk.DropDown.new(None, None)
+        self.resolution_opts.set_halign(Gtk.Align.END)
+        box_resolution.append(self.resolution_opts)
+        grid_dlopts.attach(box_resolution, 2, 0, 1, 1)
+
+        grid_dlopts.attach(Gtk.Separator(), 3, 0, 1, 1)
+
+        # Video format selection
+        box_vformat = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        label_vformat = Gtk.Label(label="Video Format  ")
+        box_vformat.append(label_vformat)
+        self.vformat_opts = Gtk.DropDown.new(None, None)
+        self.vformat_opts.set_halign(Gtk.Align.END)
+        box_vformat.append(self.vformat_opts)
+        grid_dlopts.attach(box_vformat, 4, 0, 1, 1)
+
+        grid_dlopts.attach(Gtk.Separator(), 5, 0, 1, 1)
+
+        # Download state
+        self.status = Gtk.Label()
+        self.status.set_halign(Gtk.Align.START)
+        grid_dlopts.attach(self.status, 6, 0, 1, 1)
+
+        vbox.append(grid_dlopts)
+        self.append(vbox)
+
+        # Thumbnail, a small fixed size icon of the row
+        self.thumbnail = Gtk.Picture()
+        self.thumbnail.set_keep_aspect_ratio(True)
+        self.thumbnail.set_can_shrink(True)
+        self.thumbnail.set_size_request(96, 54)
+        self.append(self.thumbnail)
+
+        self.audionly_opts.connect("toggled", self.on_toggle_audio_only)
+
+        # the item currently shown, with its property bindings and signal handlers
+        self.item = None
+        self.bindings = []
+        self.handlers = []
+        self.timer_pulse = None
+
+    def bind(self, item: DownloadItem):
+        """
+        show the item in this row, called by the list item factory
+        """
+        self.item = item
+        # the choices go first, the selected positions are only valid for them
+        for prop in ("aformats", "resolutions", "vformats"):
+            self.on_choices_changed(item, None, prop)
+            self.handlers.append(item.connect(f"notify::{prop}", self.on_choices_changed, prop))
+        self.handlers.append(item.connect("notify::pulsing", self.on_pulsing_changed))
+        self.on_pulsing_changed(item)
+
+        flags = GObject.BindingFlags.SYNC_CREATE
+        self.bindings = [
+            item.bind_property("title", self.title, "text", flags),
+            item.bind_property("progress", self.title, "progress-fraction", flags),
+            item.bind_property("status", self.status, "label", flags),
+            item.bind_property("tooltip", self, "tooltip-text", flags),
+            item.bind_property("thumbnail", self.thumbnail, "paintable", flags),
+        ]
+        # options chosen in this row are written back to the item
+        flags |= GObject.BindingFlags.BIDIRECTIONAL
+        self.bindings += [
+            item.bind_property("audio-only", self.audionly_opts, "active", flags),
+            item.bind_property("aformat-selected", self.aformat_opts, "selected", flags),
+            item.bind_property("resolution-selected", self.resolution_opts, "selected", flags),
+            item.bind_property("vformat-selected", self.vformat_opts, "selected", flags),
+        ]
+        self.on_toggle_audio_only(self.audionly_opts)
+
+    def unbind(self):
+        """
+        release the item before this row is recycled for another one
+        """
+        for binding in self.bindings:
+            binding.unbind()
+        for handler in self.handlers:
+            self.item.disconnect(handler)
+        self.bindings = []
+        self.handlers = []
+        self.stop_pulse()
+        self.item = None
+
+    def on_choices_changed(self, item, pspec, prop: str):
+        """
+        rebuild the drop-down model when the item gets its format choices
+        """
+        dropdown = {"aformats": self.aformat_opts,
+                    "resolutions": self.resolution_opts,
+                    "vformats": self.vformat_opts}[prop]
+        selected = {"aformats": "aformat-selected",
+                    "resolutions": "resolution-selected",
+                    "vformats": "vformat-selected"}[prop]
+        # keep the item's choice, replacing the model resets the selection
+        position = item.get_property(selected)
+        dropdown.set_model(Gtk.StringList.new(item.get_property(prop)))
+        dropdown.set_selected(position)
+        item.set_property(selected, position)
+
+    def on_toggle_audio_only(self, check_obj):
+        """
+        toggle audio only controls on or off
+        """
+        if check_obj.props.active:
+            self.aformat_opts.set_sensitive(True)
+            self.resolution_opts.set_sensitive(False)
+            self.vformat_opts.set_sensitive(False)
+        else:
+            self.aformat_opts.set_sensitive(False)
+            self.resolution_opts.set_sensitive(True)
+            self.vformat_opts.set_sensitive(True)
+
+    def on_pulsing_changed(self, item, pspec=None):
+        if item.pulsing and self.timer_pulse is None:
+            self.title.set_progress_pulse_step(0.2)
+            self.title.progress_pulse()
+            self.timer_pulse = GLib.timeout_add(50, self.on_pulse_timeout)
+        elif not item.pulsing:
+            self.stop_pulse()
+
+    def stop_pulse(self):
+        if self.timer_pulse is not None:
+            GLib.source_remove(self.timer_pulse)
+            self.timer_pulse = None
+            self.title.set_progress_pulse_step(0.0)
+            if self.item is not None:
+                self.title.set_progress_fraction(self.item.progress)
+
+    def on_pulse_timeout(self):
+        """
+        timer timeout event specifically for the activity of getting meta only,
+        only the rows on screen are animated
+        """
+        self.title.progress_pulse()
+        # return True for periodically get called
+        return True
@@ -2,6 +2,15 @@ import gi
 gi.require_version("Gtk", "4.0")
 from gi.repository import Gtk, Gio, GLib
 from DownloadItem import DownloadItem
+from DownloadRow import DownloadRow
+from StatsPane import StatsPane
+from task_scheduler import TaskScheduler
+from queue_journal import QueueJournal
+from pygyt_config import configure_bandwidth
+from metrics import shared_metrics
+from retries import shared_breaker
+from pathlib import Path
+import sqlite3
 
 class PygytWin(Gtk.ApplicationWindow):
     """
@@ -13,11 +22,34 @@ class PygytWin(Gtk.ApplicationWindow):
         self.config = config
         self.set_default_size(800, 600)
 
+        # all download items share a scheduler to bound the concurrent downloads
+        self.download_scheduler = TaskScheduler(
+            limit=config["max-downloads"],
+            host_limit=config["max-host-downloads"],
+            name="pygyt-download",
+            # no new task to a host while its breaker is open
+            gate=shared_breaker().delay
+        )
+        # items being downloaded, their progress is polled by a single main loop timer
+        self.active_items = set()
+        # items by URL and by the archive key of their video, a duplicate is never added
+        # as an item of its own, or is attached to the existing item once its key is known
+        self.items_by_url = dict()
+        self.items_by_key = dict()
+        self.timer_progress = None
+        # metadata of many added URLs are extracted in parallel by a separate pool
+        self.meta_scheduler = TaskScheduler(
+            limit=config["max-extractions"],
+            name="pygyt-meta",
+            gate=shared_breaker().delay
+        )
+
         header_bar = Gtk.HeaderBar()
         header_bar.set_show_title_buttons(True)
         self.set_titlebar(header_bar)
 
         menu = Gio.Menu()
+        menu.append_item(Gio.MenuItem.new("Statistics", "win.stats"))
         menu.append_item(Gio.MenuItem.new("About", "app.about"))
         menu.append_item(Gio.MenuItem.new("Quit", "app.quit"))
 
@@ -36,23 +68,45 @@ class PygytWin(Gtk.ApplicationWindow):
         remove_button.connect("clicked", self.on_remove_clicked)
         remove_button.set_tooltip_text("remove download item")
         self.action_bar.pack_start(remove_button)
+        open_button = Gtk.Button.new_from_icon_name("document-open-symbolic")
+        open_button.connect("clicked", self.on_open_clicked)
+        open_button.set_tooltip_text("add download items from a list of URLs in a text file")
+        self.action_bar.pack_start(open_button)
 
         self.url_entry = Gtk.Entry()
         self.url_entry.set_hexpand(True)
+        self.url_entry.set_placeholder_text("URLs separated by spaces or new lines")
+        self.url_entry.connect("activate", self.on_add_clicked)
         self.action_bar.set_center_widget(self.url_entry)
 
         download_button = Gtk.Button.new_from_icon_name("folder-download-symbolic")
         download_button.connect("clicked", self.on_download_clicked)
         download_button.set_tooltip_text("download selected/all")
         self.action_bar.pack_end(download_button)
-        preference_button = Gtk.Button.new_from_icon_name("preferences-other-symbolic")
-        preference_button.connect("clicked", self.on_preference_clicked)
-        preference_button.set_tooltip_text("preference settings (NOT implemented)")
-        self.action_bar.pack_end(preference_button)
-
-        # Download list
-        self.download_list = Gtk.ListBox()
-        self.download_list.set_selection_mode(Gtk.SelectionMode.MULTIPLE)
+        pause_button = Gtk.Button.new_from_icon_name("media-playback-pause-symbolic")
+        pause_button.connect("clicked", self.on_pause_clicked)
+        pause_button.set_tooltip_text("pause selected/all downloads, download again to resume")
+        self.action_bar.pack_end(pause_button)
+        first_button = Gtk.Button.new_from_icon_name("go-top-symbolic")
+        first_button.connect("clicked", self.on_first_clicked)
+        first_button.set_tooltip_text("download selected first")
+        self.action_bar.pack_end(first_button)
+        bandwidth_button = Gtk.MenuButton()
+        bandwidth_button.set_icon_name("preferences-other-symbolic")
+        bandwidth_button.set_tooltip_text("bandwidth settings")
+        bandwidth_button.set_popover(self.create_bandwidth_popover())
+        self.action_bar.pack_end(bandwidth_button)
+
+        # Download list, items are kept in a list model and only the visible ones
+        # are rendered with row widgets recycled by the list view
+        self.download_store = Gio.ListStore.new(DownloadItem)
+        self.selection = Gtk.MultiSelection.new(self.download_store)
+        self.selection.connect("selection-changed", self.on_selection_changed)
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.on_row_setup)
+        factory.connect("bind", self.on_row_bind)
+        factory.connect("unbind", self.on_row_unbind)
+        self.download_list = Gtk.ListView.new(self.selection, factory)
         self.download_list.set_show_separators(True)
         self.download_list.set_hexpand(True)
         self.download_list.set_vexpand(True)
@@ -60,55 +114,337 @@ class PygytWin(Gtk.ApplicationWindow):
         list_win.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
         list_win.set_child(self.download_list)
 
+        # optional pane of the task metrics at the bottom, toggled from the menu
+        self.stats_revealer = Gtk.Revealer()
+        self.stats_revealer.set_child(StatsPane(shared_metrics()))
+        action_stats = Gio.SimpleAction.new_stateful("stats", None, GLib.Variant.new_boolean(False))
+        action_stats.connect("change-state", self.on_stats_toggled)
+        self.add_action(action_stats)
+
         vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         vbox.append(self.action_bar)
         vbox.append(list_win)
+        vbox.append(self.stats_revealer)
 
         self.set_child(vbox)
 
-    def on_add_clicked(self, button):
+        # the metrics are exported periodically, and once more when the window is closed
+        if config["metrics-file"] is not None:
+            GLib.timeout_add_seconds(10, self.on_metrics_timeout)
+            self.connect("close-request", self.on_metrics_close)
+
+        # the queue is journaled in the download folder and restored on startup
+        self.journal = None
+        if config["journal"]:
+            try:
+                self.journal = QueueJournal(str(Path(config["download-folder"], ".pygyt-queue.sqlite3")))
+            except sqlite3.Error as err:
+                print(f"queue journal is not available: {err}")
+            else:
+                self.restore_queue()
+
+    def on_add_clicked(self, widget):
         # don't bother to do further if entry is empty
         if 0 == self.url_entry.get_text_length(): return
-        # add a new list row
+        # multiple URLs may have been pasted at once
+        self.add_urls(self.url_entry.get_text().split())
+        self.url_entry.set_text("")
+
+    def add_urls(self, urls: list) -> int:
+        """
+        add a new list row for each URL, metadata of all of them are extracted
+        concurrently by the metadata scheduler and rows are filled in as results arrive,
+        returns the number of rows added
+        """
+        newitems = [self.new_item(url) for url in self.unique_urls(urls)]
+        self.journal_items(newitems)
+        # a single change notification of the model for all new items
+        self.download_store.splice(self.download_store.get_n_items(), 0, newitems)
+        for newitem in newitems:
+            newitem.get_meta()
+        return len(newitems)
+
+    def restore_queue(self):
+        """
+        Restore the items recorded in the queue journal. Metadata are retrieved on demand
+        as for playlist entries (mostly from the metadata cache), except for the items
+        whose download was interrupted, they are resumed right away.
+        """
+        newitems = list()
+        for row in self.journal.load():
+            newitem = self.new_item(row["url"], title=row["title"] or row["url"])
+            newitem.journal = self.journal
+            newitem.journal_id = row["id"]
+            newitem.restore(row)
+            newitems.append(newitem)
+        self.download_store.splice(self.download_store.get_n_items(), 0, newitems)
+        for newitem in newitems:
+            if newitem.download_requested:
+                newitem.get_meta()
+
+    def journal_items(self, items: list, parent: DownloadItem | None = None):
+        """
+        record new items in the queue journal, entries of a playlist take its position
+        """
+        if self.journal is None:
+            return
+        position = None
+        if parent is not None and parent.journal_id is not None:
+            position = self.journal.position_of(parent.journal_id)
+        ids = self.journal.add_many([(item.url, item.title) for item in items], position)
+        for item, item_id in zip(items, ids):
+            item.journal = self.journal
+            item.journal_id = item_id
+
+    def unjournal_items(self, items: list):
+        if self.journal is None:
+            return
+        self.journal.remove_many([item.journal_id for item in items if item.journal_id is not None])
+
+    def new_item(self, url: str, **kwargs) -> DownloadItem:
         newitem = DownloadItem(
             config=self.config,
-            url=self.url_entry.get_text()
+            url=url,
+            scheduler=self.download_scheduler,
+            meta_scheduler=self.meta_scheduler,
+            **kwargs
         )
         newitem.connect("meta_ready", self.on_meta_ready)
-        newitem.set_hexpand(True)
-        self.download_list.append(newitem)
-        # disable actions
-        self.action_bar.set_sensitive(False)
-        newitem.get_meta()
-
-    def on_meta_ready(self, obj, title):
-        #print(f"item {title} is ready")
-        self.url_entry.set_text("")
-        self.action_bar.set_sensitive(True)
+        newitem.connect("download_state", self.on_download_state)
+        newitem.connect("entries_found", self.on_entries_found)
+        self.items_by_url.setdefault(url, newitem)
+        return newitem
+
+    def unique_urls(self, urls: list) -> list:
+        """
+        the URLs of the list not in the download list yet, without repeats
+        """
+        return [url for url in dict.fromkeys(urls) if url not in self.items_by_url]
+
+    def forget_items(self, items: list):
+        """
+        drop the items removed from the list model from the lookup of duplicates
+        """
+        for item in items:
+            if self.items_by_url.get(item.url) is item:
+                del self.items_by_url[item.url]
+            if item.meta is not None and self.items_by_key.get(item.meta.key) is item:
+                del self.items_by_key[item.meta.key]
+
+    def on_meta_ready(self, item, title: str):
+        """
+        An item whose video turns out to be in the list already, e.g. added by another URL,
+        is attached to the existing item: it is removed, and a download requested for it
+        is requested of the existing item.
+        """
+        if item.meta is None: return
+        existing = self.items_by_key.setdefault(item.meta.key, item)
+        if existing is item: return
+        found, position = self.download_store.find(item)
+        if found:
+            self.forget_items([item])
+            self.unjournal_items([item])
+            self.active_items.discard(item)
+            self.download_store.remove(position)
+        if item.download_requested:
+            # not downloaded by the duplicate, the signal is emitted right before
+            item.download_requested = False
+            existing.get_file()
+
+    def on_entries_found(self, item, entries: list, finished: bool):
+        """
+        Insert the entries found in a playlist after the playlist item. Metadata of the
+        entries are not retrieved until they get visible or selected.
+        """
+        found, position = self.download_store.find(item)
+        # the playlist item has been removed
+        if not found: return
+        titles = {entry["url"]: entry["title"] or entry["url"] for entry in entries}
+        newitems = [self.new_item(url, title=titles[url]) for url in self.unique_urls(list(titles))]
+        self.journal_items(newitems, parent=item)
+        self.download_store.splice(position + 1 + item.expanded, 0, newitems)
+        item.expanded += len(newitems)
+        # the playlist item is replaced by its entries, unless it has failed to show the error
+        if finished and item.expand_error is None:
+            self.forget_items([item])
+            self.unjournal_items([item])
+            self.download_store.remove(position)
+
+    def on_row_setup(self, factory, list_item):
+        list_item.set_child(DownloadRow())
+
+    def on_row_bind(self, factory, list_item):
+        item = list_item.get_item()
+        list_item.get_child().bind(item)
+        # metadata of playlist entries are retrieved once they are visible
+        item.get_meta(priority=1)
+
+    def on_row_unbind(self, factory, list_item):
+        list_item.get_child().unbind()
+
+    def on_selection_changed(self, selection, position: int, n_items: int):
+        # metadata of playlist entries are also retrieved once they are selected
+        for i in range(position, position + n_items):
+            if selection.is_selected(i):
+                self.download_store.get_item(i).get_meta()
+
+    def selected_positions(self) -> list:
+        """
+        positions of the selected items in the list model
+        """
+        bitset = self.selection.get_selection()
+        return [bitset.get_nth(i) for i in range(bitset.get_size())]
+
+    def on_open_clicked(self, button):
+        # keep a reference of the native dialog until it is responded
+        self.url_file_chooser = Gtk.FileChooserNative.new(
+            "Open a list of URLs", self, Gtk.FileChooserAction.OPEN, "_Open", "_Cancel")
+        self.url_file_chooser.connect("response", self.on_url_file_response)
+        self.url_file_chooser.show()
+
+    def on_url_file_response(self, dialog, response):
+        if Gtk.ResponseType.ACCEPT == response:
+            dialog.get_file().load_contents_async(None, self.on_url_file_loaded)
+        self.url_file_chooser = None
+
+    def on_url_file_loaded(self, file, result):
+        try:
+            _, contents, _ = file.load_contents_finish(result)
+        except GLib.Error as err:
+            print(f"failed to load {file.get_path()}: {err.message}")
+            return
+        # one URL per line, blank lines and comments are ignored as in yt-dlp's batch file
+        lines = contents.decode("utf-8", errors="replace").splitlines()
+        self.add_urls([line.strip() for line in lines
+                       if line.strip() and not line.lstrip().startswith(("#", ";", "]"))])
 
     def on_remove_clicked(self, button):
-        row_list = self.download_list.get_selected_rows()
-        #if len(row_list) == 0:
+        positions = self.selected_positions()
+        #if len(positions) == 0:
         # TODO: ask before delete all
-        if len(row_list) > 0:
-            for row in row_list:
-                if row is not None:
-                    self.download_list.remove(row)
+        items = [self.download_store.get_item(p) for p in positions]
+        # a queued or running download is cancelled, its slot, bandwidth and partial files freed
+        for item in items:
+            item.cancel()
+        self.forget_items(items)
+        self.unjournal_items(items)
+        # remove from the end, positions before are not shifted
+        for position in reversed(positions):
+            self.active_items.discard(self.download_store.get_item(position))
+            self.download_store.remove(position)
 
     def on_download_clicked(self, button):
-        row_list = self.download_list.get_selected_rows()
-        if len(row_list) == 0:
-            # select all automatically
-            self.download_list.select_all()
-            # get the list again
-            row_list = self.download_list.get_selected_rows()
+        positions = self.selected_positions()
+        if len(positions) == 0:
+            # all items if nothing is selected
+            positions = range(self.download_store.get_n_items())
+        self.selection.unselect_all()
         # invoke download method if item is ready
-        if len(row_list) > 0:
-            for row in row_list:
-                self.download_list.unselect_row(row)
-                item = row.get_child()
-                if item is not None:
-                    item.get_file()
-
-    def on_preference_clicked(self, button):
-        print("preference clicked")
\ No newline at end of file
+        for position in positions:
+            self.download_store.get_item(position).get_file()
+
+    def on_pause_clicked(self, button):
+        positions = self.selected_positions()
+        if len(positions) == 0:
+            positions = range(self.download_store.get_n_items())
+        self.selection.unselect_all()
+        for position in positions:
+            self.download_store.get_item(position).pause()
+
+    def on_first_clicked(self, button):
+        positions = self.selected_positions()
+        self.selection.unselect_all()
+        for position in positions:
+            self.download_store.get_item(position).prioritize()
+
+    def on_download_state(self, item, state: str):
+        if "started" == state:
+            self.active_items.add(item)
+            if self.timer_progress is None:
+                self.timer_progress = GLib.timeout_add(
+                    1000 // max(1, self.config["progress-rate"]), self.on_progress_timeout)
+        else:
+            self.active_items.discard(item)
+
+    def on_progress_timeout(self):
+        """
+        timer timeout event to update the progress of all items being downloaded
+        """
+        for item in self.active_items:
+            item.update_progress()
+        if not self.active_items:
+            # no need to wake up the main loop when nothing is downloading
+            self.timer_progress = None
+            return False
+        return True
+
+    def create_bandwidth_popover(self) -> Gtk.Popover:
+        """
+        settings of the global rate limit, its schedule, and the weight of the selected
+        items in sharing it, all applied to the running downloads right away
+        """
+        grid = Gtk.Grid()
+        grid.set_row_spacing(6)
+        grid.set_column_spacing(12)
+        grid.attach(Gtk.Label(label="Rate limit", halign=Gtk.Align.START), 0, 0, 1, 1)
+        self.rate_entry = Gtk.Entry()
+        self.rate_entry.set_text(self.config["limit-rate"])
+        self.rate_entry.set_placeholder_text("e.g. 500K or 2M, 0 for no limit")
+        self.rate_entry.connect("activate", self.on_bandwidth_activate)
+        grid.attach(self.rate_entry, 1, 0, 2, 1)
+        grid.attach(Gtk.Label(label="Schedule", halign=Gtk.Align.START), 0, 1, 1, 1)
+        self.schedule_entry = Gtk.Entry()
+        self.schedule_entry.set_text(self.config["bandwidth-schedule"])
+        self.schedule_entry.set_placeholder_text("e.g. 08:00-18:00=500K,18:00-23:00=2M")
+        self.schedule_entry.connect("activate", self.on_bandwidth_activate)
+        grid.attach(self.schedule_entry, 1, 1, 2, 1)
+        grid.attach(Gtk.Label(label="Weight of selected", halign=Gtk.Align.START), 0, 2, 1, 1)
+        self.weight_spin = Gtk.SpinButton.new_with_range(0.1, 10.0, 0.5)
+        self.weight_spin.set_value(1.0)
+        grid.attach(self.weight_spin, 1, 2, 1, 1)
+        weight_button = Gtk.Button(label="Apply")
+        weight_button.connect("clicked", self.on_weight_clicked)
+        grid.attach(weight_button, 2, 2, 1, 1)
+        popover = Gtk.Popover()
+        popover.set_child(grid)
+        return popover
+
+    def on_bandwidth_activate(self, entry):
+        rate, schedule = self.config["limit-rate"], self.config["bandwidth-schedule"]
+        self.config["limit-rate"] = self.rate_entry.get_text().strip() or "0"
+        self.config["bandwidth-schedule"] = self.schedule_entry.get_text().strip()
+        try:
+            configure_bandwidth(self.config)
+        except ValueError as err:
+            # keep the settings in effect
+            self.config["limit-rate"], self.config["bandwidth-schedule"] = rate, schedule
+            entry.add_css_class("error")
+            entry.set_tooltip_text(str(err))
+        else:
+            for e in (self.rate_entry, self.schedule_entry):
+                e.remove_css_class("error")
+                e.set_tooltip_text(None)
+
+    def on_weight_clicked(self, button):
+        for position in self.selected_positions():
+            self.download_store.get_item(position).set_bandwidth_weight(self.weight_spin.get_value())
+
+    def on_stats_toggled(self, action, value):
+        action.set_state(value)
+        self.stats_revealer.set_reveal_child(value.get_boolean())
+
+    def export_metrics(self):
+        try:
+            shared_metrics().write(self.config["metrics-file"])
+        except OSError as err:
+            print(f"failed to export metrics: {err}")
+
+    def on_metrics_timeout(self):
+        self.export_metrics()
+        # return True for periodically get called
+        return True
+
+    def on_metrics_close(self, window):
+        self.export_metrics()
+        # let the window close
+        return False
@@ -0,0 +1,50 @@
+import gi
+gi.require_version("Gtk", "4.0")
+from gi.repository import Gtk, GLib
+from metrics import Metrics
+
+class StatsPane(Gtk.ScrolledWindow):
+    """
+    A pane of the task metrics, the counters and the p50/p95/p99 of every phase per extractor.
+    It is refreshed once a second only while it is shown.
+    """
+    def __init__(self, metrics: Metrics, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        self.set_min_content_height(160)
+        self.label = Gtk.Label()
+        self.label.set_selectable(True)
+        self.label.set_halign(Gtk.Align.START)
+        self.label.set_valign(Gtk.Align.START)
+        self.label.add_css_class("monospace")
+        self.set_child(self.label)
+        self.timer_refresh = None
+        self.connect("map", self.on_map)
+        self.connect("unmap", self.on_unmap)
+
+    def on_map(self, widget):
+        self.refresh()
+        if self.timer_refresh is None:
+            self.timer_refresh = GLib.timeout_add_seconds(1, self.refresh)
+
+    def on_unmap(self, widget):
+        if self.timer_refresh is not None:
+            GLib.source_remove(self.timer_refresh)
+            self.timer_refresh = None
+
+    def refresh(self):
+        snapshot = self.metrics.snapshot()
+        lines = [f"{'task':6} {'phase':20} {'extractor':16} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8}"]
+        for h in snapshot["histograms"]:
+            labels = h["labels"]
+            quantiles = (f"{h[p]:8.2f}" if h[p] is not None else f"{'-':>8}" for p in ("p50", "p95", "p99"))
+            lines.append(f"{labels.get('task', ''):6} {labels.get('phase', 'total'):20} "
+                         f"{labels.get('extractor', ''):16} {h['count']:6} {' '.join(quantiles)}")
+        lines.append("")
+        for c in snapshot["counters"]:
+            labels = ", ".join(f"{k}={v}" for k, v in c["labels"].items())
+            lines.append(f"{c['name']} {{{labels}}} {c['value']:g}")
+        self.label.set_text("\n".join(lines))
+        # return True for periodically get called
+        return True
@@ -0,0 +1,169 @@
+import threading, time, re
+
+# a lease is active if it has consumed bandwidth within this many seconds,
+# idle leases do not take a share of the global rate
+ACTIVE_WINDOW = 2.0
+# the bucket of a lease holds at most this many seconds of its share
+BURST_SECONDS = 1.0
+
+_rate_pattern = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?\s*$", re.IGNORECASE)
+_time_pattern = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*$")
+
+def parse_rate(text: str) -> float:
+    """
+    bytes per second of a rate like "500K", "1.5M" or "2G" (binary multiples),
+    0 means no limit
+    """
+    match = _rate_pattern.match(text)
+    if match is None:
+        raise ValueError(f"invalid rate: {text!r}")
+    number, unit = match.groups()
+    return float(number) * 1024 ** " kmg".index(unit.lower() or " ")
+
+def parse_schedule(text: str) -> list:
+    """
+    Time-of-day schedule like "08:00-18:00=500K,22:00-06:00=0" into a list of
+    (start minute, end minute, rate). A range may wrap over midnight.
+    Raises ValueError on a malformed period or a time out of 00:00-23:59.
+    """
+    schedule = list()
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        period, _, rate = part.partition("=")
+        start, _, end = period.partition("-")
+        minutes = list()
+        for t in (start, end):
+            match = _time_pattern.match(t)
+            if match is None:
+                raise ValueError(f"invalid time {t.strip()!r} in {part!r}")
+            hours, mins = int(match.group(1)), int(match.group(2) or 0)
+            if hours > 23 or mins > 59:
+                raise ValueError(f"time out of range {t.strip()!r} in {part!r}")
+            minutes.append(hours * 60 + mins)
+        schedule.append((minutes[0], minutes[1], parse_rate(rate)))
+    return schedule
+
+
+class BandwidthLease:
+    """
+    The share of a single download, with a token bucket refilled at
+    (global rate x weight / sum of weights of the active leases).
+    """
+    def __init__(self, manager: "BandwidthManager", weight: float):
+        self.manager = manager
+        self.weight = weight
+        self.tokens = 0.0
+        self.refilled = time.monotonic()
+        self.last_active = 0.0
+        # yt-dlp params of the download, its ratelimit follows the share
+        self.params = None
+        self.user_ratelimit = None
+
+    def bind(self, params: dict):
+        """
+        Follow the share with the `ratelimit` of the YoutubeDL params as well, which
+        keeps the read blocks of yt-dlp small and the transfer smooth. The user's own
+        ratelimit is kept as an upper bound and restored by release().
+        """
+        self.params = params
+        self.user_ratelimit = params.get("ratelimit")
+
+    def set_weight(self, weight: float):
+        """
+        change the weight, applied to the running download from its next chunk
+        """
+        self.weight = max(0.01, weight)
+
+    def consume(self, nbytes: int):
+        """
+        Take the bytes out of the bucket, and sleep off the debt if the bucket runs dry.
+        Called from the progress hook, blocking here throttles the downloader thread.
+        """
+        share = self.manager.share(self)
+        if self.params is not None:
+            limits = [r for r in (share, self.user_ratelimit) if r]
+            if limits:
+                self.params["ratelimit"] = min(limits)
+            else:
+                self.params.pop("ratelimit", None)
+        if not share:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.refilled) * share, share * BURST_SECONDS)
+        self.refilled = now
+        self.tokens -= nbytes
+        if self.tokens < 0:
+            time.sleep(-self.tokens / share)
+
+    def release(self):
+        self.manager.release(self)
+        if self.params is not None:
+            if self.user_ratelimit is None:
+                self.params.pop("ratelimit", None)
+            else:
+                self.params["ratelimit"] = self.user_ratelimit
+            self.params = None
+
+
+class BandwidthManager:
+    """
+    A bandwidth manager shared by all concurrent downloads.
+    The global rate (or the rate of the current period of the time-of-day schedule)
+    is shared fairly among the downloads actively transferring, in proportion to their
+    weights. Changes of the rate, the schedule and the weights are picked up by the
+    running downloads without restarting them.
+    """
+    def __init__(self, rate: float = 0, schedule: list | None = None):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._schedule = schedule or []
+        self._leases = set()
+
+    def configure(self, rate: float | None = None, schedule: list | None = None):
+        with self._lock:
+            if rate is not None:
+                self._rate = rate
+            if schedule is not None:
+                self._schedule = schedule
+
+    def current_rate(self) -> float:
+        """
+        the global rate in effect now, 0 for no limit
+        """
+        local = time.localtime()
+        minute = local.tm_hour * 60 + local.tm_min
+        for start, end, rate in self._schedule:
+            if (start <= minute < end if start <= end else (minute >= start or minute < end)):
+                return rate
+        return self._rate
+
+    def lease(self, weight: float = 1.0) -> BandwidthLease:
+        lease = BandwidthLease(self, max(0.01, weight))
+        with self._lock:
+            self._leases.add(lease)
+        return lease
+
+    def release(self, lease: BandwidthLease):
+        with self._lock:
+            self._leases.discard(lease)
+
+    def share(self, lease: BandwidthLease) -> float:
+        """
+        the rate of the lease now, 0 for no limit
+        """
+        rate = self.current_rate()
+        if not rate:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            lease.last_active = now
+            total = sum(l.weight for l in self._leases if now - l.last_active < ACTIVE_WINDOW)
+        return rate * lease.weight / total
+
+
+_manager = BandwidthManager()
+
+def shared_manager() -> BandwidthManager:
+    """
+    the process-wide bandwidth manager of all downloads
+    """
+    return _manager
@@ -0,0 +1,56 @@
+"""
+Microbenchmark of the yt-dlp option parsing cost paid by every TaskGetMeta/TaskGetFile constructor.
+
+    $ python3 benchmarks/bench_parse_options.py -n 200 -a "--format-sort=res:720" -a "--extract-audio"
+
+"before" is the unmemoized path (two full parses and a diff per task),
+"after" is ytdl_parse_options() with the memoized defaults and argv diff.
+"""
+import sys, argparse, timeit
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ytdlp_tasks
+
+def parse_unmemoized(ydl_argv: list) -> dict:
+    """
+    the per-task work done by ytdl_parse_options() before memoization
+    """
+    default_opts = ytdlp_tasks.parse_patched_options([]).ydl_opts
+    opts = ytdlp_tasks.parse_patched_options(ydl_argv).ydl_opts
+    diff = {k: v for k, v in opts.items() if default_opts[k] != v}
+    if "postprocessors" in diff:
+        diff["postprocessors"] = [pp for pp in diff["postprocessors"]
+                                  if pp not in default_opts["postprocessors"]]
+    return diff
+
+def per_call(func, number: int) -> float:
+    """
+    the best of 3 runs, in microseconds per call
+    """
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=200, help="calls per run")
+    parser.add_argument("-a", "--additional-options", action="append", default=[],
+                        help="yt-dlp option to parse, can be given multiple times")
+    args = parser.parse_args()
+    argv = args.additional_options or ["--format-sort=res:720,ext:mp4"]
+
+    # the memoized results must equal to the unmemoized ones
+    assert ytdlp_tasks.ytdl_parse_options(argv) == parse_unmemoized(argv)
+
+    before = per_call(lambda: parse_unmemoized(argv), max(1, args.number // 10))
+    after = per_call(lambda: ytdlp_tasks.ytdl_parse_options(argv), args.number)
+    config = {"additional-options": argv, "download-folder": "/tmp"}
+    task = per_call(lambda: ytdlp_tasks.TaskGetMeta(config, "https://example.com/v", None).opts, args.number)
+
+    print(f"argv: {argv}")
+    print(f"before (unmemoized):       {before:10.1f} us/task")
+    print(f"after  (memoized):         {after:10.1f} us/task")
+    print(f"TaskGetMeta options:       {task:10.1f} us/task")
+    print(f"speedup: {before / after:.0f}x")
+
+if __name__ == "__main__":
+    main()
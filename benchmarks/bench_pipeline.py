@@ -0,0 +1,202 @@
+"""
+Throughput and responsiveness benchmark of the metadata-then-download pipeline, offline.
+
+A local media server (see media_server.py) serves synthetic progressive, HLS and DASH media,
+which are extracted by yt-dlp's generic extractor and downloaded by TaskGetMeta/TaskGetFile.
+
+    $ python3 benchmarks/bench_pipeline.py --mode tasks --items 1 10 100 1000
+    $ xvfb-run python3 benchmarks/bench_pipeline.py --mode gui --media hls --items 100
+    $ python3 benchmarks/bench_pipeline.py --compare benchmarks/results/OLD.json
+
+"tasks" drives the task schedulers as the headless mode does, "gui" drives the add/download
+flow of PygytWin and also measures the latency of the GTK main loop (a display is needed).
+Every run is done in a fresh process, so the peak RSS is of that run only.
+Results are saved as JSON in benchmarks/results/<commit>.json to compare across commits.
+"""
+import sys, argparse, json, time, tempfile, subprocess, resource, io
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from media_server import MediaServer, MediaSpec
+
+# the main loop is probed at this interval, the lateness of the probes is the latency
+PROBE_INTERVAL_MS = 10
+
+def bench_config(folder: str) -> dict:
+    """
+    the default configuration in a temporary folder, without caches, the journal and the archive,
+    so every run extracts and downloads everything
+    """
+    from pygyt_config import default_config
+    config = default_config()
+    config.update({
+        "download-folder": f"{folder}/downloads",
+        "cache-folder": f"{folder}/cache",
+        "meta-cache-ttl": 0,
+        "journal": False,
+        "download-archive": "",
+    })
+    Path(config["download-folder"]).mkdir(parents=True)
+    return config
+
+def quantiles(samples: list) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50": None, "p99": None, "max": None}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": pick(0.5), "p99": pick(0.99), "max": ordered[-1]}
+
+def run_tasks(config: dict, urls: list) -> dict:
+    """
+    run the URLs through the task schedulers of the headless mode
+    """
+    from pygyt_headless import HeadlessPipeline
+    from ytdlp_tasks import format_options
+    config["thumbnails"] = False
+    events = io.StringIO()
+    pipeline = HeadlessPipeline(config, format_options(False, None), output=events)
+    failures = pipeline.run(io.StringIO("\n".join(urls) + "\n"))
+    return {"failures": failures, "main_loop_latency_ms": None}
+
+def run_gui(config: dict, urls: list) -> dict:
+    """
+    add the URLs to the main window, and download all once every metadata has arrived
+    """
+    import gi
+    gi.require_version("Gtk", "4.0")
+    from gi.repository import GLib
+    from PygytWin import PygytWin
+
+    window = PygytWin(config=config, title="Pygyt benchmark")
+    window.present()
+    context = GLib.MainContext.default()
+    latencies = list()
+    expected = [time.monotonic() + PROBE_INTERVAL_MS / 1000]
+
+    def on_probe():
+        now = time.monotonic()
+        latencies.append(max(0.0, (now - expected[0]) * 1000))
+        expected[0] = now + PROBE_INTERVAL_MS / 1000
+        return True
+
+    GLib.timeout_add(PROBE_INTERVAL_MS, on_probe)
+    counts = {"meta": 0, "ended": 0}
+    def on_meta_ready(item, title):
+        counts["meta"] += 1
+    def on_download_state(item, state):
+        if "ended" == state:
+            counts["ended"] += 1
+
+    start = window.download_store.get_n_items()
+    window.add_urls(urls)
+    items = [window.download_store.get_item(p)
+             for p in range(start, window.download_store.get_n_items())]
+    for item in items:
+        item.connect("meta_ready", on_meta_ready)
+        item.connect("download_state", on_download_state)
+    while counts["meta"] < len(items):
+        context.iteration(True)
+    for item in items:
+        # the synthetic media can not be converted to audio
+        item.audio_only = False
+    window.on_download_clicked(None)
+    downloading = [item for item in items if item.state == "queued"]
+    while counts["ended"] < len(downloading):
+        context.iteration(True)
+    window.destroy()
+    return {"failures": sum(1 for item in items if item.state != "done"),
+            "main_loop_latency_ms": quantiles(latencies)}
+
+def run_one(mode: str, media: str, items: int, spec: MediaSpec) -> dict:
+    with tempfile.TemporaryDirectory(prefix="pygyt-bench-") as folder, MediaServer(spec) as server:
+        config = bench_config(folder)
+        urls = [server.url(media, f"item{i}") for i in range(items)]
+        start = time.monotonic()
+        result = (run_gui if "gui" == mode else run_tasks)(config, urls)
+        seconds = time.monotonic() - start
+    megabytes = items * spec.total_bytes(media) / (1 << 20)
+    result.update({
+        "mode": mode,
+        "media": media,
+        "items": items,
+        "seconds": seconds,
+        "items_per_sec": items / seconds,
+        "mb_per_sec": megabytes / seconds,
+        # kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+    return result
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(old_path: str, new: dict):
+    """
+    print the ratios of the new results to the old ones of the same runs
+    """
+    with open(old_path) as f:
+        old = {(r["mode"], r["media"], r["items"]): r for r in json.load(f)["results"]}
+    print(f"{'run':28} {'items/s':>10} {'MB/s':>10} {'RSS':>10}")
+    for r in new["results"]:
+        o = old.get((r["mode"], r["media"], r["items"]))
+        if o is None:
+            continue
+        name = f"{r['mode']}/{r['media']}/{r['items']}"
+        print(f"{name:28} {r['items_per_sec'] / o['items_per_sec']:9.2f}x "
+              f"{r['mb_per_sec'] / o['mb_per_sec']:9.2f}x {r['peak_rss_mb'] / o['peak_rss_mb']:9.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=("tasks", "gui"), default="tasks")
+    parser.add_argument("--media", nargs="+", choices=("progressive", "hls", "dash"),
+                        default=["progressive", "hls", "dash"])
+    parser.add_argument("--items", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument("--file-size", type=int, default=1 << 20, help="bytes of a progressive file")
+    parser.add_argument("--fragments", type=int, default=8, help="fragments of an HLS/DASH item")
+    parser.add_argument("--fragment-size", type=int, default=128 << 10, help="bytes of a fragment")
+    parser.add_argument("-o", "--output", help="JSON file of the results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", metavar="OLD_JSON", help="compare with the results of an earlier run")
+    parser.add_argument("--run-one", nargs=3, metavar=("MODE", "MEDIA", "ITEMS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    spec = MediaSpec(args.file_size, args.fragments, args.fragment_size)
+
+    if args.run_one:
+        mode, media, items = args.run_one
+        print(json.dumps(run_one(mode, media, int(items), spec)))
+        return
+
+    commit = git_commit()
+    results = list()
+    for media in args.media:
+        for items in args.items:
+            argv = [sys.executable, __file__, "--file-size", str(spec.file_size),
+                    "--fragments", str(spec.fragments), "--fragment-size", str(spec.fragment_size),
+                    "--run-one", args.mode, media, str(items)]
+            out = subprocess.run(argv, capture_output=True, text=True)
+            if out.returncode != 0:
+                print(f"{args.mode}/{media}/{items} failed:\n{out.stderr}", file=sys.stderr)
+                continue
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            results.append(result)
+            latency = result["main_loop_latency_ms"]
+            print(f"{args.mode}/{media}/{items}: {result['items_per_sec']:.2f} items/s, "
+                  f"{result['mb_per_sec']:.2f} MB/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+                  f"failures {result['failures']}"
+                  + (f", main loop latency p99 {latency['p99']:.1f} ms" if latency else ""))
+
+    report = {"commit": commit, "time": time.time(), "python": sys.version.split()[0], "results": results}
+    output = Path(args.output or Path(__file__).resolve().parent.joinpath("results", f"{commit}.json"))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"results saved in {output}")
+    if args.compare:
+        compare(args.compare, report)
+
+if __name__ == "__main__":
+    main()
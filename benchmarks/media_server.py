@@ -0,0 +1,170 @@
+"""
+A local stand-in of a media site for the benchmarks, no network is needed.
+
+Synthetic media are generated on the fly and recognized by yt-dlp's generic extractor:
+    /progressive/<name>.mp4     a single file (Range requests are supported)
+    /hls/<name>.m3u8            an HLS media playlist of .ts fragments
+    /dash/<name>.mpd            a DASH manifest of a single representation with fragments
+The payload bytes are not decodable media, so no postprocessing should be asked for.
+
+    $ python3 benchmarks/media_server.py --port 8000
+"""
+import argparse, re, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class MediaSpec:
+    """
+    sizes of the synthetic media
+    """
+    def __init__(self, file_size: int = 1 << 20, fragments: int = 8, fragment_size: int = 128 << 10):
+        self.file_size = file_size
+        self.fragments = fragments
+        self.fragment_size = fragment_size
+
+    def total_bytes(self, media: str) -> int:
+        return self.file_size if "progressive" == media else self.fragments * self.fragment_size
+
+
+# a block of pseudo random bytes, payloads are built by repeating it
+_BLOCK = bytes((i * 7919 + 13) % 251 for i in range(64 << 10))
+
+def payload(size: int, offset: int = 0):
+    """
+    the bytes of a synthetic payload from the offset, in blocks
+    """
+    position = offset
+    while position < size:
+        start = position % len(_BLOCK)
+        chunk = _BLOCK[start:start + min(len(_BLOCK) - start, size - position)]
+        position += len(chunk)
+        yield chunk
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    spec = MediaSpec()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def respond(self, head: bool):
+        path = self.path.split("?")[0]
+        spec = self.spec
+        try:
+            if m := re.fullmatch(r"/progressive/([\w-]+)\.mp4", path):
+                self.send_payload("video/mp4", spec.file_size, head)
+            elif m := re.fullmatch(r"/hls/([\w-]+)\.m3u8", path):
+                duration = 4
+                lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{duration}",
+                         "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD"]
+                for i in range(spec.fragments):
+                    lines += [f"#EXTINF:{duration}.0,", f"/hls/{m.group(1)}/{i}.ts"]
+                lines.append("#EXT-X-ENDLIST")
+                self.send_text("application/vnd.apple.mpegurl", "\n".join(lines) + "\n", head)
+            elif re.fullmatch(r"/hls/[\w-]+/\d+\.ts", path):
+                self.send_payload("video/mp2t", spec.fragment_size, head)
+            elif m := re.fullmatch(r"/dash/([\w-]+)\.mpd", path):
+                duration = 4 * spec.fragments
+                manifest = f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}S" minBufferTime="PT2S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+      <Representation id="1" codecs="avc1.64001f,mp4a.40.2" width="1280" height="720" bandwidth="{spec.fragment_size * 2}">
+        <SegmentTemplate timescale="1" duration="4" initialization="/dash/{m.group(1)}/init.mp4" media="/dash/{m.group(1)}/$Number$.m4s" startNumber="1"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+                self.send_text("application/dash+xml", manifest, head)
+            elif re.fullmatch(r"/dash/[\w-]+/init\.mp4", path):
+                self.send_payload("video/mp4", 1024, head)
+            elif re.fullmatch(r"/dash/[\w-]+/\d+\.m4s", path):
+                self.send_payload("video/iso.segment", spec.fragment_size, head)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            # the generic extractor closes the connection after sniffing the content type
+            self.close_connection = True
+
+    def send_text(self, content_type: str, text: str, head: bool):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_payload(self, content_type: str, size: int, head: bool):
+        start, end = 0, size - 1
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and match.group(1):
+            start = int(match.group(1))
+            end = min(end, int(match.group(2))) if match.group(2) else end
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not head:
+            for chunk in payload(end + 1, start):
+                self.wfile.write(chunk)
+
+
+class MediaServer:
+    """
+    The media server running in a daemon thread, at a free port of localhost by default
+    """
+    def __init__(self, spec: MediaSpec | None = None, port: int = 0):
+        handler = type("Handler", (MediaHandler,), {"spec": spec or MediaSpec()})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, media: str, name: str) -> str:
+        """
+        the URL of a synthetic item, media is one of "progressive", "hls" or "dash"
+        """
+        suffix = {"progressive": "mp4", "hls": "m3u8", "dash": "mpd"}[media]
+        return f"{self.base_url}/{media}/{name}.{suffix}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    with MediaServer(port=args.port) as server:
+        print(f"serving synthetic media at {server.base_url}, e.g. {server.url('hls', 'item0')}")
+        server.thread.join()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from array import array
+from collections import OrderedDict
+import threading, json
+
+# full infos of the latest items are kept in memory, to hand them over to the download
+# right away, the older ones are loaded again from their info json files
+INFO_CACHE_ITEMS = 32
+
+class FormatIndex:
+    """
+    The format choices of an item, every format is 3 codes into a table of strings:
+    its resolution, video extension and audio extension, 0 (the empty string) if
+    the format has none of it
+    """
+    __slots__ = ("strings", "codes")
+    RESOLUTION, VIDEO_EXT, AUDIO_EXT = range(3)
+
+    def __init__(self, formats: list):
+        table = {"": 0}
+        codes = array("H")
+        for f in formats:
+            video_ext = f.get("video_ext")
+            has_video = video_ext is not None and video_ext != "none"
+            has_size = f.get("width") is not None and f["width"] != "none"
+            audio_ext = f.get("audio_ext")
+            has_audio = audio_ext is not None and audio_ext != "none"
+            for value in (f.get("resolution") if has_video and has_size else "",
+                          video_ext if has_video else "",
+                          audio_ext if has_audio else ""):
+                codes.append(table.setdefault(value or "", len(table)))
+        self.strings = tuple(table)
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes) // 3
+
+    def choices(self, column: int) -> list:
+        """
+        the distinct values of a column, in the order of the formats
+        """
+        return [self.strings[c] for c in dict.fromkeys(self.codes[column::3]) if c]
+
+
+class CompactMeta:
+    """
+    The few fields of the extracted info used by a download item, with an index of its
+    formats. The full info is in memory only for the latest items, and is loaded again
+    from the info json file when needed.
+    """
+    __slots__ = ("id", "title", "extractor_key", "original_url", "duration",
+                 "file_name", "key", "info_json", "formats", "archived")
+
+    def __init__(self, info: dict, file_name: str | None, key: str, info_json: str | None,
+                 archived: bool = False):
+        self.id = info.get("id")
+        self.title = info.get("title")
+        self.extractor_key = info.get("extractor_key")
+        self.original_url = info.get("original_url") or info.get("webpage_url")
+        self.duration = info.get("duration")
+        self.file_name = file_name
+        self.key = key
+        self.info_json = info_json
+        self.formats = FormatIndex(info.get("formats") or [])
+        # found in the download archive, the item is not downloaded again
+        self.archived = archived
+        if not archived:
+            remember_info(key, info)
+
+    @property
+    def resolutions(self) -> list:
+        return self.formats.choices(FormatIndex.RESOLUTION)
+
+    @property
+    def video_exts(self) -> list:
+        return self.formats.choices(FormatIndex.VIDEO_EXT)
+
+    @property
+    def audio_exts(self) -> list:
+        return self.formats.choices(FormatIndex.AUDIO_EXT)
+
+    def full_info(self) -> dict | None:
+        """
+        the full info from memory or from the info json file, None if neither has it,
+        called in the worker thread of the download
+        """
+        with _infos_lock:
+            info = _infos.get(self.key)
+            if info is not None:
+                _infos.move_to_end(self.key)
+                return info
+        if self.info_json is None:
+            return None
+        try:
+            with open(self.info_json) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+_infos = OrderedDict()
+_infos_lock = threading.Lock()
+
+def remember_info(key: str, info: dict):
+    with _infos_lock:
+        _infos[key] = info
+        _infos.move_to_end(key)
+        while len(_infos) > INFO_CACHE_ITEMS:
+            _infos.popitem(last=False)
@@ -0,0 +1,83 @@
+import threading, os
+
+class DownloadArchive:
+    """
+    The keys "<extractor> <video id>" of the finished downloads, in a text file of one
+    key per line, the same format as the download archive of yt-dlp (--download-archive),
+    so either file can be used by both.
+    All keys are kept in a set, a lookup is a hash and no network access. The file is
+    only appended to, lines appended by other processes (e.g. the worker processes, or
+    yt-dlp itself) are read on the next lookup once the file has grown.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys = set()
+        # bytes of the file read into the set so far
+        self._offset = 0
+
+    def _refresh(self):
+        """
+        read the lines appended since the last read, must be called with the lock held
+        """
+        try:
+            if os.stat(self.path).st_size <= self._offset:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        # a partial last line is read again once it is complete
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        self._keys.update(line.strip() for line in data[:end].decode("utf-8", errors="replace").splitlines()
+                          if line.strip())
+
+    def __contains__(self, key: str | None) -> bool:
+        if key is None:
+            return False
+        with self._lock:
+            self._refresh()
+            return key in self._keys
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._keys)
+
+    def add(self, key: str | None):
+        """
+        record a finished download, a single appended line per key
+        """
+        if key is None:
+            return
+        with self._lock:
+            self._refresh()
+            if key in self._keys:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(f"{key}\n")
+            except OSError as err:
+                print(f"failed to record {key} in the download archive: {err}")
+                return
+            # the line is read again by the next refresh, the set simply ignores it
+            self._keys.add(key)
+
+
+_archives = dict()
+_archives_lock = threading.Lock()
+
+def shared_archive(config: dict) -> DownloadArchive | None:
+    """
+    the process-wide archive of the configured file, None if the archive is disabled
+    """
+    path = config.get("download-archive")
+    if not path:
+        return None
+    with _archives_lock:
+        archive = _archives.get(path)
+        if archive is None:
+            archive = _archives[path] = DownloadArchive(path)
+        return archive
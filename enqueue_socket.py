@@ -0,0 +1,102 @@
+"""
+Local Unix socket to add URLs to the download list of the running pygyt, enabled with
+--enqueue-socket. Every request is a line of JSON, either a single URL string or an
+object {"urls": [...]}, answered by a line {"added": N, "received": M}, where the URLs
+not added were in the list already. A connection may send any number of requests.
+
+    $ printf '{"urls": ["https://...", "https://..."]}\\n' | nc -NU ~/.cache/pygyt/enqueue.sock
+"""
+from gi.repository import GLib
+from collections.abc import Callable
+from pathlib import Path
+import socketserver, concurrent.futures, threading, json, os, socket, stat
+
+# seconds to wait for the main loop to add the URLs of a request
+REPLY_TIMEOUT = 30.0
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                urls = [request] if isinstance(request, str) else request["urls"]
+                if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                    raise ValueError("urls must be a list of strings")
+                reply = {"added": self.server.enqueue(urls), "received": len(urls)}
+            except (ValueError, KeyError, TypeError) as err:
+                reply = {"error": f"bad request: {err}"}
+            except concurrent.futures.TimeoutError:
+                reply = {"error": "timed out waiting for the application"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+
+class EnqueueServer(socketserver.ThreadingUnixStreamServer):
+    """
+    The socket server, in a thread of its own. The URLs of a request are added by the
+    callback in the main loop, all at once, and the count it returns is the reply.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str, on_urls_callback: Callable[[list], int]):
+        self.path = Path(path)
+        self.on_urls_cb = on_urls_callback
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.remove_stale()
+        super().__init__(str(self.path), _Handler)
+        self.thread = threading.Thread(target=self.serve_forever, name="pygyt-enqueue-socket", daemon=True)
+        self.thread.start()
+
+    def server_bind(self):
+        super().server_bind()
+        # only the user may connect, the umask of the process is shared by all its threads
+        # and is left alone, the socket listens only once the server is activated
+        os.chmod(self.server_address, 0o600)
+
+    def remove_stale(self):
+        """
+        Remove the socket left over by an instance that did not exit cleanly. Raises OSError
+        if the path is not a socket, or if another instance still listens on it.
+        """
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise OSError(f"{self.path} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(self.path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            # nobody listens on it any more
+            self.path.unlink(missing_ok=True)
+            return
+        finally:
+            probe.close()
+        raise OSError(f"{self.path} is in use by another instance")
+
+    def enqueue(self, urls: list) -> int:
+        """
+        add the URLs in the main loop and wait for the number added, called in a handler thread
+        """
+        urls = [url.strip() for url in urls if url.strip()]
+        if not urls:
+            return 0
+        future = concurrent.futures.Future()
+
+        def add():
+            try:
+                future.set_result(self.on_urls_cb(urls))
+            except Exception as err:
+                future.set_exception(err)
+            return False
+        GLib.idle_add(add)
+        return future.result(timeout=REPLY_TIMEOUT)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,118 @@
+import threading, json, os, tempfile
+from pathlib import Path
+
+# concurrency of the first fragmented download of an extractor, within the bounds
+START_CONCURRENCY = 4
+# weight of a new measurement in the moving average of the throughput
+EWMA_WEIGHT = 0.3
+# a higher concurrency is only chosen if it is this much faster than a lower one,
+# fewer connections are gentler on the host for about the same throughput
+MIN_GAIN = 1.1
+# the throughput of a file measured while the host was throttling counts this much
+THROTTLED_PENALTY = 0.5
+
+class FragmentTuning:
+    """
+    The concurrent fragment downloads of HLS/DASH learned per extractor.
+    The average throughput of every concurrency tried is kept, and the smallest one
+    within MIN_GAIN of the fastest is chosen, after trying the next higher and lower
+    concurrency once. Persisted in a JSON file of {extractor: {concurrency: bytes/s}},
+    so later downloads start from the learned setting.
+    """
+    def __init__(self, path: str, low: int, high: int):
+        self.path = Path(path)
+        self.low = low
+        self.high = high
+        self._lock = threading.Lock()
+        self._rates = None
+        self._mtime = None
+
+    def _load(self):
+        """
+        (re)load the file if it has been written since, e.g. by a worker process,
+        must be called with the lock held
+        """
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            if self._rates is None:
+                self._rates = dict()
+            return
+        if self._rates is not None and mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as f:
+                self._rates = json.load(f)
+        except (OSError, ValueError):
+            self._rates = dict()
+        self._mtime = mtime
+
+    def _clamp(self, concurrency: int) -> int:
+        return max(self.low, min(self.high, concurrency))
+
+    def choose(self, extractor: str | None) -> int:
+        """
+        the concurrency of the next fragmented download of the extractor
+        """
+        with self._lock:
+            self._load()
+            rates = {int(c): r for c, r in self._rates.get(extractor or "unknown", {}).items()
+                     if self.low <= int(c) <= self.high}
+        if not rates:
+            return self._clamp(START_CONCURRENCY)
+        fastest = max(rates.values())
+        best = min(c for c, r in rates.items() if r * MIN_GAIN >= fastest)
+        # explore the neighbours of the best once, up first
+        for candidate in (self._clamp(best * 2), self._clamp(best // 2)):
+            if candidate not in rates:
+                return candidate
+        return best
+
+    def record(self, extractor: str | None, concurrency: int, throughput: float, throttled: bool):
+        """
+        Fold the throughput of a fragmented file into the average of its concurrency.
+        The file is read again and only the entry of the extractor is replaced, the other
+        processes writing it lose no more than a measurement.
+        """
+        extractor = extractor or "unknown"
+        if throttled:
+            throughput *= THROTTLED_PENALTY
+        with self._lock:
+            self._load()
+            rates = self._rates.setdefault(extractor, dict())
+            previous = rates.get(str(concurrency))
+            rates[str(concurrency)] = (throughput if previous is None
+                                       else previous + EWMA_WEIGHT * (throughput - previous))
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # a temporary file of its own, other processes may be writing theirs
+                with tempfile.NamedTemporaryFile("w", dir=self.path.parent, prefix=f".{self.path.name}.",
+                                                 suffix=".tmp", delete=False) as f:
+                    json.dump(self._rates, f)
+                try:
+                    os.replace(f.name, self.path)
+                except OSError:
+                    os.unlink(f.name)
+                    raise
+                self._mtime = self.path.stat().st_mtime
+            except OSError as err:
+                print(f"failed to save the fragment tuning: {err}")
+
+
+_tunings = dict()
+_tunings_lock = threading.Lock()
+
+def shared_tuning(config: dict) -> FragmentTuning:
+    """
+    the process-wide fragment tuning of the cache folder, with the configured bounds
+    """
+    path = f"{config['cache-folder']}/fragments.json"
+    low = max(1, config.get("min-concurrent-fragments", 1))
+    high = max(low, config.get("max-concurrent-fragments", 8))
+    with _tunings_lock:
+        tuning = _tunings.get(path)
+        if tuning is None:
+            tuning = _tunings[path] = FragmentTuning(path, low, high)
+        tuning.low = low
+        tuning.high = high
+        return tuning
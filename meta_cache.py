@@ -0,0 +1,158 @@
+import threading, json, time, os, re, hashlib
+from pathlib import Path
+
+# assumed lifetime of format URLs that carry no expiry of their own
+FORMAT_URL_LIFETIME = 6 * 3600
+# expiry timestamps embedded in media URLs, e.g. "...&expire=1700000000&..." or ".../expire/1700000000/..."
+_expire_pattern = re.compile(r"[?&/]expire[=/](\d+)")
+
+def formats_expired(info: dict, margin: float = 300) -> bool:
+    """
+    whether the format URLs in the info dict are about to expire and need re-extraction
+    """
+    now = time.time()
+    for f in info.get("formats") or [info]:
+        match = _expire_pattern.search(f.get("url") or "")
+        if match is not None and int(match.group(1)) - margin < now:
+            return True
+    epoch = info.get("epoch")
+    return epoch is not None and now - epoch > FORMAT_URL_LIFETIME - margin
+
+
+# seconds between scans of the cache folder for the entries written by other processes,
+# e.g. the worker processes, so the size bound is kept across all of them
+RESCAN_INTERVAL = 60.0
+
+class MetaCache:
+    """
+    On-disk cache of extracted metadata.
+    Entries are indexed by the archive key of yt-dlp, i.e. "<extractor> <video id>",
+    each entry is a json file named after the hash of the key. Entries older than
+    `ttl` seconds are treated as missing, and the least recently used entries are
+    removed once the total size of the cache exceeds `max_bytes`.
+    """
+    def __init__(self, folder: str, ttl: float, max_bytes: int):
+        self.folder = Path(folder)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # path -> [size, last access time], loaded on first use
+        self._index = None
+        self._scanned = 0.0
+
+    def _path(self, key: str) -> Path:
+        return self.folder.joinpath(f"{hashlib.sha1(key.encode()).hexdigest()}.json")
+
+    def _load_index(self, rescan: bool = False):
+        """
+        scan the cache folder once, or again if asked to and RESCAN_INTERVAL has passed,
+        must be called with the lock held
+        """
+        if self._index is not None and not (rescan and time.monotonic() - self._scanned > RESCAN_INTERVAL):
+            return
+        self._scanned = time.monotonic()
+        self._index = dict()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        for p in self.folder.glob("*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            self._index[p] = [st.st_size, st.st_mtime]
+
+    def get(self, key: str) -> dict | None:
+        """
+        The cached entry of the key, a dict with "info" and "file_name",
+        None if the key is not cached or the entry has expired.
+        """
+        path = self._path(key)
+        with self._lock:
+            self._load_index()
+            if path not in self._index:
+                # maybe written by another process since the folder was scanned
+                try:
+                    st = path.stat()
+                except OSError:
+                    return None
+                self._index[path] = [st.st_size, st.st_mtime]
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(path)
+                return None
+            if time.time() - entry.get("time", 0) > self.ttl:
+                self._remove(path)
+                return None
+            # the modification time records the last access for eviction
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            self._index[path][1] = now
+            return entry
+
+    def put(self, keys: list, info: dict, file_name: str):
+        """
+        Store the (sanitized) info under one or more keys, e.g. the key derived from
+        the URL before extraction and the key from the extracted info.
+        """
+        data = json.dumps({"time": time.time(), "file_name": file_name, "info": info})
+        with self._lock:
+            # the access times on disk are shared by all processes, a scan counts their entries
+            self._load_index(rescan=True)
+            for key in dict.fromkeys(keys):
+                if key is None:
+                    continue
+                path = self._path(key)
+                tmp_path = path.with_suffix(".tmp")
+                try:
+                    with open(tmp_path, "w") as f:
+                        f.write(data)
+                    # replace atomically, readers never see a partial entry
+                    os.replace(tmp_path, path)
+                except OSError:
+                    continue
+                self._index[path] = [len(data), time.time()]
+            self._evict()
+
+    def _remove(self, path: Path):
+        """
+        must be called with the lock held
+        """
+        self._index.pop(path, None)
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        remove the least recently used entries until the cache fits its size,
+        must be called with the lock held
+        """
+        total = sum(size for size, _ in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for path, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            self._remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+def shared_cache(folder: str, ttl: float, max_bytes: int) -> MetaCache:
+    """
+    the process-wide cache instance of the folder, shared by all tasks
+    """
+    with _caches_lock:
+        cache = _caches.get(folder)
+        if cache is None:
+            cache = _caches[folder] = MetaCache(folder, ttl, max_bytes)
+        cache.ttl = ttl
+        cache.max_bytes = max_bytes
+        return cache
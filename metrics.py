@@ -0,0 +1,197 @@
+import threading, time, json, os, contextlib
+from collections import deque
+from pathlib import Path
+
+# quantiles are computed over this many of the latest samples of a histogram
+HISTOGRAM_SAMPLES = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    """
+    Count and sum of all observations, with the latest samples kept for quantiles
+    """
+    __slots__ = ("count", "sum", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=HISTOGRAM_SAMPLES)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantiles(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: None for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+class Metrics:
+    """
+    Counters and histograms of the tasks, keyed by a metric name and its labels.
+    Safe to update from the worker threads, exported as a JSON snapshot or in the
+    Prometheus text format (histograms as summaries with p50/p95/p99).
+    """
+    def __init__(self, prefix: str = "pygyt"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def drain(self) -> tuple:
+        """
+        Take the counters and histograms gathered since the last drain, they are cleared.
+        Used to hand the metrics of a worker process over to the main process.
+        """
+        with self._lock:
+            counters, self._counters = self._counters, dict()
+            histograms, self._histograms = self._histograms, dict()
+        return counters, {key: (h.count, h.sum, list(h.samples)) for key, h in histograms.items()}
+
+    def merge(self, drained: tuple):
+        """
+        add the metrics taken by drain() of another instance
+        """
+        counters, histograms = drained
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (count, total, samples) in histograms.items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+                histogram.count += count
+                histogram.sum += total
+                histogram.samples.extend(samples)
+
+    def snapshot(self) -> dict:
+        """
+        all metrics as plain data, e.g.
+            {"counters": [{"name": ..., "labels": {...}, "value": ...}],
+             "histograms": [{"name": ..., "labels": {...}, "count": ..., "sum": ...,
+                             "p50": ..., "p95": ..., "p99": ...}]}
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = list()
+            for (name, labels), h in sorted(self._histograms.items()):
+                entry = {"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum}
+                entry.update({f"p{int(q * 100)}": v for q, v in h.quantiles().items()})
+                histograms.append(entry)
+        return {"time": time.time(), "counters": counters, "histograms": histograms}
+
+    def prometheus(self) -> str:
+        """
+        the metrics in the Prometheus text exposition format
+        """
+        def labels_str(labels: dict, **extra) -> str:
+            pairs = {**labels, **extra}
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                       for v in pairs.values())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in zip(pairs, escaped)) + "}"
+
+        snapshot = self.snapshot()
+        lines = list()
+        typed = set()
+        for c in snapshot["counters"]:
+            name = f"{self.prefix}_{c['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{labels_str(c['labels'])} {c['value']}")
+        for h in snapshot["histograms"]:
+            name = f"{self.prefix}_{h['name']}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} summary")
+            for q in QUANTILES:
+                value = h[f"p{int(q * 100)}"]
+                if value is not None:
+                    lines.append(f"{name}{labels_str(h['labels'], quantile=q)} {value}")
+            lines.append(f"{name}_sum{labels_str(h['labels'])} {h['sum']}")
+            lines.append(f"{name}_count{labels_str(h['labels'])} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Export to the file, a JSON snapshot if the file name ends with .json, the Prometheus
+        text format otherwise (e.g. for the textfile collector of node_exporter).
+        The file is replaced atomically, a reader never sees a partial export.
+        """
+        path = Path(path)
+        text = (json.dumps(self.snapshot(), indent=1) if ".json" == path.suffix
+                else self.prometheus())
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+class Timings:
+    """
+    Monotonic timings of the phases of a single task, recorded into the metrics at the
+    end of the task, when the extractor of the item is known.
+    """
+    def __init__(self, metrics: Metrics, task: str):
+        self.metrics = metrics
+        self.task = task
+        self.phases = list()
+        self.started = time.monotonic()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.monotonic() - start))
+
+    def add(self, name: str, seconds: float):
+        """
+        a phase timed elsewhere, e.g. from the progress hooks of yt-dlp
+        """
+        self.phases.append((name, seconds))
+
+    def record(self, extractor: str | None, result: str, downloaded_bytes: int = 0, retries: int = 0):
+        extractor = extractor or "unknown"
+        for name, seconds in self.phases:
+            self.metrics.observe("phase_seconds", seconds, task=self.task, phase=name, extractor=extractor)
+        self.metrics.observe("task_seconds", time.monotonic() - self.started,
+                             task=self.task, extractor=extractor)
+        self.metrics.inc("tasks_total", task=self.task, result=result, extractor=extractor)
+        if downloaded_bytes:
+            self.metrics.inc("downloaded_bytes_total", downloaded_bytes, extractor=extractor)
+        if retries:
+            self.metrics.inc("retries_total", retries, task=self.task, extractor=extractor)
+
+
+_metrics = Metrics()
+
+def shared_metrics() -> Metrics:
+    """
+    the process-wide metrics of all tasks
+    """
+    return _metrics
@@ -0,0 +1,376 @@
+"""
+Optional backend running the TaskGetMeta/TaskGetFile work in a pool of worker processes.
+
+The extractors of yt-dlp are heavy on regex and JSON and hold the GIL, in worker processes
+they neither compete with the GTK main loop nor with each other, and scale across cores.
+The tasks submitted to the schedulers are proxies with the interface of the thread tasks,
+a scheduler worker thread just waits for the process to finish its task, so the concurrency
+limits are kept. Callbacks, progress and metrics come back over a single queue (a pipe),
+read by a listener thread of the main process.
+"""
+import gi
+gi.require_version("Gdk", "4.0")
+from gi.repository import GLib, Gdk
+from collections.abc import Callable
+import multiprocessing, multiprocessing.util, concurrent.futures, threading, itertools, time, abc
+from concurrent.futures.process import BrokenProcessPool
+import ytdlp_tasks, bandwidth, retries
+from metrics import shared_metrics
+from task_scheduler import RetryLater
+from compact_meta import CompactMeta, remember_info
+
+# interruptions of a download, by their code in the shared signals (0 for none)
+INTERRUPTS = ("paused", "cancelled", "preempted")
+# seconds to wait for the callback message of a task once its worker process has returned
+DONE_TIMEOUT = 60.0
+
+# state of a worker process, set by the pool initializer
+_queue = None
+_rates = None
+_signals = None
+_slot = None
+
+def _init_worker(queue, rates, signals, counter):
+    """
+    Every worker process takes a slot in the shared rates and signals, the main process
+    writes there the bandwidth share of the download running in the process, and the
+    interruption asked of it.
+    """
+    global _queue, _rates, _signals, _slot
+    _queue = queue
+    _rates = rates
+    _signals = signals
+    with counter.get_lock():
+        _slot = counter.value
+        counter.value += 1
+    # the breakers of the hosts gating the schedulers are in the main process
+    retries.shared_breaker().on_record = lambda host, failed: _queue.put((None, "breaker", (host, failed)))
+    # atexit is not run by a worker process, its finalizers are
+    multiprocessing.util.Finalize(None, ytdlp_tasks.close_pooled_ytdl, exitpriority=10)
+
+def _call(callback, *args):
+    callback(*args)
+    return 0
+
+def _run_task(kind: str, task_id: int, config: dict, url: str, playlists: bool, info: dict | None,
+              attempt: int):
+    """
+    Run a task in the worker process, its callbacks are sent to the main process
+    """
+    def send(event: str, *args):
+        _queue.put((task_id, event, args))
+
+    if "meta" == kind:
+        def on_done(meta, file_name, thumbnail, strerr):
+            # a texture can not be pickled, it goes over as png bytes
+            png = thumbnail.save_to_png_bytes().get_data() if thumbnail is not None else None
+            # the full info goes along, to be handed over to the download in memory
+            send("done", meta, file_name, png, strerr, meta.full_info() if meta is not None else None)
+        on_entries = (lambda *args: send("entries", *args)) if playlists else None
+        task = ytdlp_tasks.TaskGetMeta(config, url, on_done, dispatch=_call,
+                                       on_entries_callback=on_entries)
+    else:
+        # the process is taken until the callback, a postprocessing stage in it would
+        # not release the download slot
+        config["postprocess-stage"] = False
+        task = ytdlp_tasks.TaskGetFile(config, url, lambda *args: send("done", *args), dispatch=_call,
+                                       info=info)
+        # a retry raises RetryLater back to the scheduler of the main process
+        task.attempt = attempt
+        interval = 1.0 / max(1, config["progress-rate"])
+        last_sent = [0.0]
+
+        def follow_signal(pdict: dict):
+            # the hook of the task stops the download once it is interrupted
+            if _signals[_slot]:
+                task.interrupt(INTERRUPTS[_signals[_slot] - 1])
+
+        def follow_share(pdict: dict):
+            # the share of the global bandwidth given by the main process is the only
+            # limit of the bandwidth manager in this process
+            bandwidth.shared_manager().configure(rate=_rates[_slot])
+
+        def forward_progress(pdict: dict):
+            now = time.monotonic()
+            if "downloading" != pdict["status"] or now - last_sent[0] >= interval:
+                last_sent[0] = now
+                send("progress", _slot, task.progress)
+        # around the hook of the task, which takes the bytes out of the bandwidth lease
+        # and publishes the progress
+        task.opts["progress_hooks"][:0] = [follow_signal, follow_share]
+        task.opts["progress_hooks"].append(forward_progress)
+        _rates[_slot] = 0
+        _signals[_slot] = 0
+        send("started", _slot)
+    try:
+        task.run()
+    finally:
+        send("metrics", shared_metrics().drain())
+
+
+class ProcessPool:
+    """
+    The worker processes and the listener of the messages they send back
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ids = itertools.count()
+        self._tasks = dict()
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """
+        Start the executor of the worker processes, with the shared state they take their
+        slots in and the queue they send back over, all new as the processes of a broken
+        executor may have died in the middle of using them.
+        """
+        # fork is not safe in a process with the threads of GTK
+        context = multiprocessing.get_context("spawn")
+        self.queue = context.Queue()
+        self.rates = context.Array("d", self.workers)
+        self.signals = context.Array("i", self.workers)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.queue, self.rates, self.signals, context.Value("i", 0))
+        )
+        # a listener reads the queue of its executor, the one of a broken executor
+        # forwards what is left in it, then waits for good
+        self.listener = threading.Thread(target=self.listen, args=(self.queue,),
+                                         name="pygyt-process-listener", daemon=True)
+        self.listener.start()
+
+    def restart(self, broken: concurrent.futures.ProcessPoolExecutor) -> concurrent.futures.ProcessPoolExecutor:
+        """
+        Replace the executor broken by a worker process that died (e.g. killed or out of
+        memory), which fails every later submit. Called by every task that finds it broken,
+        only the first one replaces it.
+        """
+        with self._lock:
+            if self.executor is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self.start()
+            return self.executor
+
+    def run(self, task: "ProcessTask", kind: str):
+        """
+        run the task in a worker process and wait for it, called in a scheduler worker thread
+        """
+        with self._lock:
+            task_id = next(self._ids)
+            self._tasks[task_id] = task
+            executor = self.executor
+        args = (kind, task_id, task.config, task.url, task.playlists, task.info, task.attempt)
+        try:
+            try:
+                try:
+                    future = executor.submit(_run_task, *args)
+                except BrokenProcessPool:
+                    # broken by another task, this one has not run yet
+                    future = self.restart(executor).submit(_run_task, *args)
+                future.result()
+            except RetryLater:
+                # nothing has been reported, the task is queued again
+                raise
+            except BrokenProcessPool as err:
+                # the worker process died, e.g. killed or out of memory
+                self.restart(executor)
+                task.on_failed(f"the worker process died: {err}")
+            except Exception as err:
+                task.on_failed(str(err))
+            # the result comes back over another pipe than the messages, wait for the
+            # callback before the scheduler slot is released
+            if not task.finished.wait(DONE_TIMEOUT):
+                task.on_failed("the result of the worker process was lost")
+        finally:
+            with self._lock:
+                del self._tasks[task_id]
+
+    def listen(self, queue):
+        while True:
+            task_id, event, args = queue.get()
+            with self._lock:
+                task = self._tasks.get(task_id)
+            if "metrics" == event:
+                shared_metrics().merge(args[0])
+            elif "breaker" == event:
+                retries.shared_breaker().record(*args)
+            elif task is not None:
+                task.on_message(event, args)
+
+
+class ProcessTask(abc.ABC):
+    """
+    A proxy of a task run in the process pool, with the interface of the thread tasks
+    """
+    kind = None
+    playlists = False
+    info = None
+    attempt = 0
+
+    def __init__(self, config: dict, url: str, on_done_callback: Callable[..., bool],
+                 dispatch: Callable[..., object] = GLib.idle_add):
+        self.config = config
+        self.url = url
+        self.on_done_cb = on_done_callback
+        self.dispatch = dispatch
+        # set when the callback has been dispatched
+        self.finished = threading.Event()
+        self._finish_lock = threading.Lock()
+
+    def run(self):
+        shared_pool(self.config).run(self, self.kind)
+
+    def on_message(self, event: str, args: tuple):
+        if "done" == event:
+            self.finish(*self.done_args(*args))
+
+    def finish(self, *args):
+        """
+        dispatch the callback, once, either the result of the worker process or a failure
+        """
+        with self._finish_lock:
+            if self.finished.is_set():
+                return
+            self.finished.set()
+        self.dispatch(self.on_done_cb, *args)
+
+    def done_args(self, *args) -> tuple:
+        return args
+
+    @abc.abstractmethod
+    def on_failed(self, strerr: str):
+        """
+        report the task failed without a result of the worker process
+        """
+
+
+class ProcessTaskGetMeta(ProcessTask):
+    kind = "meta"
+
+    def __init__(self, config: dict, url: str, on_done_callback: Callable[..., bool],
+                 dispatch: Callable[..., object] = GLib.idle_add,
+                 on_entries_callback: Callable[[list, bool, str], bool] | None = None):
+        super().__init__(config, url, on_done_callback, dispatch)
+        self.on_entries_cb = on_entries_callback
+        # without the callback of entries, a playlist is an error in the worker process
+        self.playlists = on_entries_callback is not None
+
+    def on_message(self, event: str, args: tuple):
+        if "entries" == event:
+            entries, finished, strerr = args
+            self.dispatch(self.on_entries_cb, entries, finished, strerr)
+            if finished:
+                self.finished.set()
+        else:
+            super().on_message(event, args)
+
+    def done_args(self, meta, file_name, png, strerr, info=None) -> tuple:
+        if info is not None:
+            remember_info(meta.key, info)
+        thumbnail = Gdk.Texture.new_from_bytes(GLib.Bytes.new(png)) if png is not None else None
+        return meta, file_name, thumbnail, strerr
+
+    def on_failed(self, strerr: str):
+        self.finish(None, None, None, strerr)
+
+
+class ProcessTaskGetFile(ProcessTask):
+    kind = "file"
+
+    def __init__(self, config: dict, url: str, on_done_callback: Callable[[int, str], bool],
+                 dispatch: Callable[..., object] = GLib.idle_add, info: dict | None = None):
+        super().__init__(config, url, on_done_callback, dispatch)
+        # pickled to the worker process, still cheaper than the info json file
+        self.info = info
+        # the progress slot as of TaskGetFile, updated from the messages of the worker process
+        self.progress = None
+        # the share of the global bandwidth, managed in the main process and handed
+        # to the worker process through its slot of the shared rates
+        self.bandwidth_lease = None
+        self.slot = None
+        # messages of a worker process left over from a preempted or retried run are ignored
+        self.running = False
+        # "paused", "cancelled" or "preempted" once asked to be interrupted, see TaskGetFile
+        self.interrupted = None
+
+    def interrupt(self, reason: str):
+        self.interrupted = reason
+        slot = self.slot
+        if slot is not None:
+            shared_pool(self.config).signals[slot] = INTERRUPTS.index(reason) + 1
+
+    def run(self):
+        if "preempted" == self.interrupted:
+            self.interrupted = None
+        if self.interrupted is not None:
+            self.dispatch(self.on_done_cb, -1, self.interrupted)
+            return
+        # the full info is pickled to the worker process, from memory or from the info json file
+        if isinstance(self.info, CompactMeta):
+            self.info = self.info.full_info()
+        self.bandwidth_lease = bandwidth.shared_manager().lease(self.config.get("bandwidth-weight", 1.0))
+        self.running = True
+        try:
+            super().run()
+        except RetryLater:
+            if "preempted" == self.interrupted:
+                self.interrupted = None
+                status = "preempted"
+            else:
+                # the retries are counted here, a new task is made in the worker process every time
+                self.attempt += 1
+                status = "retrying"
+            if self.progress is not None:
+                _, downloaded, total, _, _ = self.progress
+                self.progress = (status, downloaded, total, None, None)
+            raise
+        finally:
+            self.running = False
+            self.slot = None
+            self.bandwidth_lease.release()
+
+    def on_message(self, event: str, args: tuple):
+        pool = shared_pool(self.config)
+        if event in ("started", "progress") and not self.running:
+            return
+        if "started" == event:
+            self.slot = args[0]
+            pool.rates[self.slot] = self.bandwidth_lease.manager.share(self.bandwidth_lease)
+            # interrupted before the worker process had the task
+            if self.interrupted is not None:
+                pool.signals[self.slot] = INTERRUPTS.index(self.interrupted) + 1
+        elif "progress" == event:
+            self.slot, progress = args
+            if progress is not None:
+                self.progress = progress
+            pool.rates[self.slot] = self.bandwidth_lease.manager.share(self.bandwidth_lease)
+        else:
+            super().on_message(event, args)
+
+    def on_failed(self, strerr: str):
+        self.finish(-1, strerr)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def shared_pool(config: dict) -> ProcessPool:
+    """
+    the process pool of all tasks, sized to run every task the schedulers allow at once
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPool(config["max-downloads"] + config["max-extractions"])
+        return _pool
+
+def task_types(config: dict) -> tuple:
+    """
+    the task classes of metadata and file of the configured backend
+    """
+    if "process" == config.get("backend"):
+        return ProcessTaskGetMeta, ProcessTaskGetFile
+    return ytdlp_tasks.TaskGetMeta, ytdlp_tasks.TaskGetFile
@@ -1,10 +1,15 @@
-import sys
+import startup_profile
+import sys, threading
 import gi
 gi.require_version("Gtk", "4.0")
 
 from gi.repository import GLib, Gio, Gtk
 from pathlib import Path
 from PygytWin import PygytWin
+from pygyt_config import default_config, check_download_folder, check_download_archive, configure_bandwidth
+import ytdlp_tasks
+from enqueue_socket import EnqueueServer
+startup_profile.mark("imports")
 
 class Pygyt(Gtk.Application):
     """
@@ -16,6 +21,9 @@ class Pygyt(Gtk.Application):
         GLib.set_application_name("Pygyt")
 
         self.mainwin = None
+        self.options = None
+        self.first_frame_handler = None
+        self.enqueue_server = None
 
         self.add_main_option(
             "download-folder",
@@ -32,6 +40,200 @@ class Pygyt(Gtk.Application):
             GLib.OptionArg.STRING_ARRAY,
             "Append additional options for yt-dlp, multiple uses of '-a' are allowed.",
             "'OPTION ARG(s)'")
+        self.add_main_option(
+            "max-downloads",
+            ord("j"),
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Maximum number of concurrent downloads. (default: 4)",
+            "N"
+        )
+        self.add_main_option(
+            "max-host-downloads",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Maximum number of concurrent downloads from the same host, 0 for no limit. (default: 2)",
+            "N"
+        )
+        self.add_main_option(
+            "max-extractions",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Maximum number of concurrent metadata extractions. (default: 4)",
+            "N"
+        )
+        self.add_main_option(
+            "meta-cache-ttl",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Seconds to keep extracted metadata in the cache, 0 to disable the cache. (default: 604800)",
+            "SECONDS"
+        )
+        self.add_main_option(
+            "meta-cache-size",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Maximum size of the metadata cache in MiB. (default: 256)",
+            "MiB"
+        )
+        self.add_main_option(
+            "progress-rate",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Updates per second of the download progress. (default: 10)",
+            "HZ"
+        )
+        self.add_main_option(
+            "thumbnail-cache-size",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Maximum number of thumbnails kept in memory. (default: 512)",
+            "N"
+        )
+        self.add_main_option(
+            "no-journal",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.NONE,
+            "Do not keep the queue journal in the download folder, the queue is not restored on the next start.",
+            None
+        )
+        self.add_main_option(
+            "limit-rate",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "Total download rate shared by all downloads, e.g. 500K or 2M, 0 for no limit. (default: 0)",
+            "RATE"
+        )
+        self.add_main_option(
+            "bandwidth-schedule",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "Total download rate by time of day, replacing --limit-rate within the periods, e.g. '08:00-18:00=500K,18:00-23:00=2M'",
+            "SCHEDULE"
+        )
+        self.add_main_option(
+            "metrics-file",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "Export timings and counters of the tasks to the file every 10 seconds, as JSON if it ends with .json, in the Prometheus text format otherwise.",
+            "FILE"
+        )
+        self.add_main_option(
+            "backend",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "Run the tasks in 'thread's of the GUI process, or in a pool of worker 'process'es to keep the GUI responsive and use all cores. (default: thread)",
+            "thread|process"
+        )
+        self.add_main_option(
+            "max-postprocesses",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Maximum number of concurrent postprocessings (merging, audio extraction) after the transfers, 0 for the number of cores. (default: 0)",
+            "N"
+        )
+        self.add_main_option(
+            "download-archive",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "File of the finished downloads, one '<extractor> <id>' per line as yt-dlp's --download-archive, they are skipped without any network access. (default: .pygyt-archive.txt in the download folder)",
+            "FILE"
+        )
+        self.add_main_option(
+            "no-download-archive",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.NONE,
+            "Neither skip nor record the finished downloads.",
+            None
+        )
+        self.add_main_option(
+            "retries",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Retries of a download failed by a transient error (429, 5xx, timeouts), resuming from the partial file. (default: 5)",
+            "N"
+        )
+        self.add_main_option(
+            "fragment-retries",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Retries of a fragment of HLS/DASH downloads, before the download fails. (default: 3)",
+            "N"
+        )
+        self.add_main_option(
+            "min-concurrent-fragments",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Lower bound of the concurrent fragment downloads of HLS/DASH, tuned per extractor. (default: 1)",
+            "N"
+        )
+        self.add_main_option(
+            "max-concurrent-fragments",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.INT,
+            "Upper bound of the concurrent fragment downloads of HLS/DASH, tuned per extractor. (default: 8)",
+            "N"
+        )
+        self.add_main_option(
+            "stream-audio",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.NONE,
+            "Extract audio by streaming the download into ffmpeg, transcoding along with the transfer and writing only the audio file.",
+            None
+        )
+        self.add_main_option(
+            "no-info-json",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.NONE,
+            "Do not write the info json file of the metadata along with the downloads.",
+            None
+        )
+        self.add_main_option(
+            "enqueue-socket",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING,
+            "Listen on a Unix socket at the path for URLs to add, as lines of JSON {\"urls\": [...]}.",
+            "PATH"
+        )
+        # the positional arguments are URLs, also of a second invocation,
+        # they are added to the download list of the running instance
+        self.add_main_option(
+            GLib.OPTION_REMAINING,
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.STRING_ARRAY,
+            "URLs to add to the download list",
+            "[URL...]"
+        )
+        self.add_main_option(
+            "profile-startup",
+            0,
+            GLib.OptionFlags.NONE,
+            GLib.OptionArg.NONE,
+            "Report the time spent in each step of the startup until the first frame, and of the yt-dlp warm-up.",
+            None
+        )
 
     def do_startup(self):
         Gtk.Application.do_startup(self)
@@ -44,50 +246,99 @@ class Pygyt(Gtk.Application):
         action_quit.connect("activate", self.on_quit)
         self.add_action(action_quit)
 
+        # add many URLs at once, e.g. over D-Bus with org.gtk.Actions.Activate
+        action_enqueue = Gio.SimpleAction.new("enqueue", GLib.VariantType.new("as"))
+        action_enqueue.connect("activate", self.on_enqueue)
+        self.add_action(action_enqueue)
+        startup_profile.mark("application startup")
+
     def do_activate(self):
+        # only allow a single window and raise any existing one, the configuration
+        # (e.g. the bandwidth changed from the toolbar) is kept
+        if self.mainwin:
+            self.mainwin.present()
+            return
         # setup default configuration
-        # TODO: should have a single configuration manager
-        #       instead of multiple copies in different module instances
-        config_opts = {
-            "download-folder": str(Path("~/Downloads").expanduser()),
-            "additional-options": None
-        }
+        config_opts = default_config()
         # update default configuration if option from command line is not None
         if self.options is not None:
             for key, value in config_opts.items():
                 if self.options.get(key) is not None and self.options.get(key) != value:
                     config_opts[key] = self.options.get(key)
+            if self.options.get("no-journal"):
+                config_opts["journal"] = False
+            if self.options.get("no-info-json"):
+                config_opts["write-info-json"] = False
+            if self.options.get("no-download-archive"):
+                config_opts["download-archive"] = ""
         self.config = config_opts
         # check and setup the download folder properly
-        self.check_download_folder()
+        check_download_folder(self.config)
+        check_download_archive(self.config)
+        try:
+            configure_bandwidth(self.config)
+        except ValueError as err:
+            print(f"bandwidth settings ignored: {err}")
 
-        # only allow a single window and raise any existing one
-        if not self.mainwin:
-            self.mainwin = PygytWin(config=self.config, application=self, title="Pygyt")
+        startup_profile.mark("configuration")
+        self.mainwin = PygytWin(config=self.config, application=self, title="Pygyt")
+        startup_profile.mark("window")
+        if self.config["enqueue-socket"]:
+            try:
+                self.enqueue_server = EnqueueServer(self.config["enqueue-socket"], self.enqueue)
+            except OSError as err:
+                print(f"enqueue socket not available: {err}")
         self.mainwin.present()
+        # yt-dlp is warmed up once the first frame is on screen
+        self.first_frame_handler = self.mainwin.get_frame_clock().connect(
+            "after-paint", self.on_first_frame)
+
+    def on_first_frame(self, frame_clock):
+        frame_clock.disconnect(self.first_frame_handler)
+        startup_profile.mark("first frame")
+        if self.options and self.options.get("profile-startup"):
+            startup_profile.report("time to first frame")
+        threading.Thread(target=self.warm_up, name="pygyt-warm-up", daemon=True).start()
+
+    def warm_up(self):
+        """
+        import yt_dlp and prepare what the first tasks need, in a background thread
+        """
+        steps = ytdlp_tasks.warm_up()
+        if self.options and self.options.get("profile-startup"):
+            startup_profile.report("yt-dlp warm-up in background", steps)
 
     def do_command_line(self, command_line):
         options = command_line.get_options_dict()
         # convert GVariantDict -> GVariant -> dict
-        self.options = options.end().unpack()
-
+        options = options.end().unpack()
+        urls = options.pop(GLib.OPTION_REMAINING, None) or []
+        # the options of a second invocation are ignored, the running instance keeps its own
+        if self.mainwin is None:
+            self.options = options
         self.activate()
+        if urls:
+            self.enqueue(urls)
         return 0
-    
-    def check_download_folder(self):
+
+    def do_shutdown(self):
+        if self.enqueue_server is not None:
+            self.enqueue_server.close()
+        # the cookie jars of the YoutubeDL instances are saved
+        ytdlp_tasks.close_pooled_ytdl()
+        Gtk.Application.do_shutdown(self)
+
+    def on_enqueue(self, action, param):
+        self.enqueue(param.unpack())
+
+    def enqueue(self, urls: list) -> int:
         """
-        Checking the download folder setting, rules and assumptions are:
-            - Default download folder is ~/Downloads/ and it is always available.
-            - Users can specify a preferred folder to replace the default setting.
-            - The folder specified by the user must be an existing one.
-            - If the folder specified by the user does not exist, the default folder is used.
+        add the URLs to the download list in one go, returns the number added
         """
-        default_path = Path("~/Downloads").expanduser()
-        config_path = Path(self.config["download-folder"])
-        if (str(config_path) != str(default_path) and
-            (not config_path.exists() or not config_path.is_dir())):
-            self.config["download-folder"] = str(default_path)
-
+        if self.mainwin is None:
+            self.activate()
+        return self.mainwin.add_urls([url.strip() for url in urls if url.strip()])
+    
     def on_about(self, action, param):
         about_dialog = Gtk.AboutDialog(transient_for=self.mainwin, modal=True)
         about_dialog.set_website("https://github.com/twMr7/pygyt")
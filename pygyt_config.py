@@ -0,0 +1,68 @@
+from gi.repository import GLib
+from pathlib import Path
+import bandwidth
+
+def default_config() -> dict:
+    """
+    The default configuration shared by the GUI application and the headless mode,
+    options from the command line replace the values of the same keys.
+    """
+    return {
+        "download-folder": str(Path("~/Downloads").expanduser()),
+        "additional-options": None,
+        "max-downloads": 4,
+        "max-host-downloads": 2,
+        "max-extractions": 4,
+        "cache-folder": str(Path(GLib.get_user_cache_dir(), "pygyt")),
+        "meta-cache-ttl": 7 * 24 * 3600,
+        "meta-cache-size": 256,
+        "progress-rate": 10,
+        "thumbnail-cache-size": 512,
+        "journal": True,
+        "limit-rate": "0",
+        "bandwidth-schedule": "",
+        "metrics-file": None,
+        "backend": "thread",
+        "max-postprocesses": 0,
+        "write-info-json": True,
+        "download-archive": None,
+        "retries": 5,
+        "fragment-retries": 3,
+        "min-concurrent-fragments": 1,
+        "max-concurrent-fragments": 8,
+        "stream-audio": False,
+        "enqueue-socket": None
+    }
+
+def configure_bandwidth(config: dict):
+    """
+    Apply the global rate limit and the time-of-day schedule of the configuration to
+    the shared bandwidth manager, running downloads follow from their next chunk.
+    Raises ValueError if any of them is malformed.
+    """
+    bandwidth.shared_manager().configure(
+        rate=bandwidth.parse_rate(config["limit-rate"]),
+        schedule=bandwidth.parse_schedule(config["bandwidth-schedule"])
+    )
+
+def check_download_folder(config: dict):
+    """
+    Checking the download folder setting, rules and assumptions are:
+        - Default download folder is ~/Downloads/ and it is always available.
+        - Users can specify a preferred folder to replace the default setting.
+        - The folder specified by the user must be an existing one.
+        - If the folder specified by the user does not exist, the default folder is used.
+    """
+    default_path = Path("~/Downloads").expanduser()
+    config_path = Path(config["download-folder"])
+    if (str(config_path) != str(default_path) and
+        (not config_path.exists() or not config_path.is_dir())):
+        config["download-folder"] = str(default_path)
+
+def check_download_archive(config: dict):
+    """
+    The download archive is in the download folder unless given, an empty path disables it.
+    Expected to be called once the download folder is checked.
+    """
+    if config["download-archive"] is None:
+        config["download-archive"] = str(Path(config["download-folder"], ".pygyt-archive.txt"))
@@ -0,0 +1,284 @@
+"""
+Headless batch mode of pygyt, no display is needed.
+
+URLs are streamed from a file or stdin (one per line), and run through the same
+metadata-then-download pipeline of the GUI with the bounded concurrency.
+Progress and results are written to stdout as JSON lines, e.g.
+
+    $ python3 pygyt_headless.py -d ~/Downloads urls.txt
+    $ cat urls.txt | python3 pygyt_headless.py --audio-only mp3 > results.jsonl
+"""
+import sys, argparse, json, threading, time
+from ytdlp_tasks import format_options, close_pooled_ytdl
+from process_backend import task_types
+from compact_meta import CompactMeta
+from task_scheduler import TaskScheduler, host_of
+from pygyt_config import default_config, check_download_folder, check_download_archive, configure_bandwidth
+from metrics import shared_metrics
+from retries import shared_breaker
+
+class HeadlessItem:
+    """
+    A download item of the headless mode, the counterpart of DownloadItem without GUI.
+    The task callbacks are called directly in the worker threads.
+    """
+    def __init__(self, pipeline: "HeadlessPipeline", url: str):
+        self.pipeline = pipeline
+        self.url = url
+        self.config = dict(pipeline.config)
+        self.task_get_file = None
+        self.shown_progress = None
+
+    def get_meta(self):
+        TaskGetMeta, _ = task_types(self.config)
+        task = TaskGetMeta(
+            config=self.config,
+            url=self.url,
+            on_done_callback=self.on_get_meta_task_done,
+            dispatch=self.pipeline.dispatch,
+            on_entries_callback=self.on_get_entries
+        )
+        self.pipeline.meta_scheduler.submit(task, host=host_of(self.url))
+
+    def on_get_entries(self, entries: list, finished: bool, strerr: str):
+        """
+        a playlist URL is replaced by its entries
+        """
+        for entry in entries:
+            self.pipeline.add(entry["url"])
+        if finished:
+            self.pipeline.emit("expanded", self.url, error=strerr or None)
+            self.pipeline.finish(self, not strerr)
+
+    def on_get_meta_task_done(self, meta: CompactMeta, file_name: str, thumbnail, strerr: str):
+        if meta is None:
+            self.pipeline.emit("meta", self.url, error=strerr)
+            self.pipeline.finish(self, False)
+            return
+        if meta.archived:
+            self.pipeline.emit("archived", self.url, id=meta.id, extractor=meta.extractor_key,
+                               title=meta.title, file_name=file_name)
+            self.pipeline.finish(self, True)
+            return
+        # another URL of a video already in the pipeline is not downloaded again
+        existing = self.pipeline.claim(meta.key, self)
+        if existing is not self:
+            self.pipeline.emit("duplicate", self.url, of=existing.url)
+            self.pipeline.finish(self, True)
+            return
+        self.pipeline.emit("meta", self.url, id=meta.id, extractor=meta.extractor_key,
+                           title=meta.title, file_name=file_name, duration=meta.duration)
+        # update configuration for later task to download file
+        self.config["file_name"] = file_name
+        self.config["download-folder"] += f"/{file_name}"
+        self.config["info_json"] = f"{self.config['download-folder']}/{file_name}.json"
+        self.config["additional-options"] = (list(self.config["additional-options"] or [])
+                                             + self.pipeline.format_options)
+        _, TaskGetFile = task_types(self.config)
+        self.task_get_file = TaskGetFile(
+            config=self.config,
+            url=meta.original_url or self.url,
+            on_done_callback=self.on_get_file_task_done,
+            dispatch=self.pipeline.dispatch,
+            info=meta
+        )
+        self.pipeline.download_scheduler.submit(
+            self.task_get_file,
+            host=host_of(self.url),
+            on_start=lambda: self.pipeline.start(self)
+        )
+
+    def update_progress(self):
+        progress = self.task_get_file.progress
+        if progress is None or progress is self.shown_progress:
+            return
+        self.shown_progress = progress
+        status, downloaded, total, speed, eta = progress
+        self.pipeline.emit("progress", self.url, status=status, downloaded_bytes=downloaded,
+                           total_bytes=total, speed=speed, eta=eta)
+
+    def on_get_file_task_done(self, retcode: int, strerr: str):
+        self.update_progress()
+        self.pipeline.emit("done", self.url, retcode=retcode, folder=self.config["download-folder"],
+                           error=strerr or None)
+        self.pipeline.finish(self, 0 == retcode)
+
+
+class HeadlessPipeline:
+    """
+    Feed URLs through the task schedulers and report in JSON lines
+    """
+    def __init__(self, config: dict, format_options: list, output=sys.stdout):
+        self.config = config
+        self.format_options = format_options
+        self.output = output
+        self.download_scheduler = TaskScheduler(
+            limit=config["max-downloads"],
+            host_limit=config["max-host-downloads"],
+            name="pygyt-download",
+            gate=shared_breaker().delay
+        )
+        self.meta_scheduler = TaskScheduler(limit=config["max-extractions"], name="pygyt-meta",
+                                            gate=shared_breaker().delay)
+        self._cond = threading.Condition()
+        self._outstanding = 0
+        self._active = set()
+        # the URLs added and the items by the archive key of their video, to skip duplicates
+        self._urls = set()
+        self._keys = dict()
+        self.failures = 0
+
+    @staticmethod
+    def dispatch(callback, *args):
+        """
+        invoke the task callback right away in the worker thread
+        """
+        callback(*args)
+        return 0
+
+    def emit(self, event: str, url: str, **fields):
+        line = json.dumps({"event": event, "url": url, "time": time.time(), **fields})
+        with self._cond:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def add(self, url: str):
+        with self._cond:
+            if url in self._urls:
+                duplicate = True
+            else:
+                duplicate = False
+                self._urls.add(url)
+                self._outstanding += 1
+        if duplicate:
+            self.emit("duplicate", url, of=url)
+            return
+        self.emit("queued", url)
+        HeadlessItem(self, url).get_meta()
+
+    def claim(self, key: str, item: HeadlessItem) -> HeadlessItem:
+        """
+        the item of the video of the key, the given item if it is the first one
+        """
+        with self._cond:
+            return self._keys.setdefault(key, item)
+
+    def start(self, item: HeadlessItem):
+        with self._cond:
+            self._active.add(item)
+        self.emit("started", item.url)
+
+    def finish(self, item: HeadlessItem, succeeded: bool):
+        with self._cond:
+            self._active.discard(item)
+            self._outstanding -= 1
+            if not succeeded:
+                self.failures += 1
+            self._cond.notify_all()
+
+    def feed(self, stream):
+        """
+        read URLs as they arrive, blank lines and comments are ignored as in yt-dlp's batch file
+        """
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith(("#", ";", "]")):
+                self.add(line)
+
+    def run(self, stream) -> int:
+        """
+        Process all URLs of the stream and wait for them, progress of the active
+        downloads is polled at the configured rate. Returns the number of failures.
+        """
+        reader = threading.Thread(target=self.feed, args=(stream,), daemon=True)
+        reader.start()
+        interval = 1.0 / max(1, self.config["progress-rate"])
+        with self._cond:
+            while reader.is_alive() or self._outstanding > 0:
+                self._cond.wait(interval)
+                for item in list(self._active):
+                    item.update_progress()
+        return self.failures
+
+
+def main(argv: list) -> int:
+    config = default_config()
+    parser = argparse.ArgumentParser(description="Headless batch mode of pygyt, progress and results in JSON lines.")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="file with one URL per line, '-' for stdin (default)")
+    parser.add_argument("-d", "--download-folder", default=config["download-folder"],
+                        help="The folder to store download files. (default: '~/Downloads')")
+    parser.add_argument("-a", "--additional-options", action="append", metavar="'OPTION ARG(s)'",
+                        help="Append additional options for yt-dlp, multiple uses of '-a' are allowed.")
+    parser.add_argument("-j", "--max-downloads", type=int, default=config["max-downloads"],
+                        help="Maximum number of concurrent downloads. (default: %(default)s)")
+    parser.add_argument("--max-host-downloads", type=int, default=config["max-host-downloads"],
+                        help="Maximum number of concurrent downloads from the same host, 0 for no limit. (default: %(default)s)")
+    parser.add_argument("--max-extractions", type=int, default=config["max-extractions"],
+                        help="Maximum number of concurrent metadata extractions. (default: %(default)s)")
+    parser.add_argument("--meta-cache-ttl", type=int, default=config["meta-cache-ttl"],
+                        help="Seconds to keep extracted metadata in the cache, 0 to disable the cache. (default: %(default)s)")
+    parser.add_argument("--progress-rate", type=int, default=config["progress-rate"],
+                        help="Progress lines per second of each download. (default: %(default)s)")
+    parser.add_argument("--limit-rate", default=config["limit-rate"], metavar="RATE",
+                        help="Total download rate shared by all downloads, e.g. 500K or 2M, 0 for no limit. (default: %(default)s)")
+    parser.add_argument("--bandwidth-schedule", default=config["bandwidth-schedule"], metavar="SCHEDULE",
+                        help="Total download rate by time of day, replacing --limit-rate within the periods, e.g. '08:00-18:00=500K,18:00-23:00=2M'")
+    parser.add_argument("--max-postprocesses", type=int, default=config["max-postprocesses"],
+                        help="Maximum number of concurrent postprocessings (merging, audio extraction) after the transfers, 0 for the number of cores. (default: %(default)s)")
+    parser.add_argument("--download-archive", metavar="FILE", default=config["download-archive"],
+                        help="File of the finished downloads, one '<extractor> <id>' per line as yt-dlp's --download-archive, they are skipped without any network access. (default: .pygyt-archive.txt in the download folder)")
+    parser.add_argument("--no-download-archive", action="store_true",
+                        help="Neither skip nor record the finished downloads.")
+    parser.add_argument("--retries", type=int, default=config["retries"],
+                        help="Retries of a download failed by a transient error (429, 5xx, timeouts), resuming from the partial file. (default: %(default)s)")
+    parser.add_argument("--fragment-retries", type=int, default=config["fragment-retries"],
+                        help="Retries of a fragment of HLS/DASH downloads, before the download fails. (default: %(default)s)")
+    parser.add_argument("--min-concurrent-fragments", type=int, default=config["min-concurrent-fragments"],
+                        help="Lower bound of the concurrent fragment downloads of HLS/DASH, tuned per extractor. (default: %(default)s)")
+    parser.add_argument("--max-concurrent-fragments", type=int, default=config["max-concurrent-fragments"],
+                        help="Upper bound of the concurrent fragment downloads of HLS/DASH, tuned per extractor. (default: %(default)s)")
+    parser.add_argument("--stream-audio", action="store_true",
+                        help="Extract audio by streaming the download into ffmpeg, transcoding along with the transfer and writing only the audio file.")
+    parser.add_argument("--no-info-json", action="store_true",
+                        help="Do not write the info json file of the metadata along with the downloads.")
+    parser.add_argument("--backend", choices=("thread", "process"), default=config["backend"],
+                        help="Run the tasks in threads, or in a pool of worker processes to use all cores. (default: %(default)s)")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="Export timings and counters of the tasks to the file at the end, as JSON if it ends with .json, in the Prometheus text format otherwise.")
+    parser.add_argument("--audio-only", metavar="FORMAT",
+                        help="Extract audio in the format, e.g. mp3, m4a, wav")
+    parser.add_argument("--resolution", default="best", help="Preferred video resolution, e.g. 1280x720")
+    parser.add_argument("--video-format", default="best", help="Preferred video extension, e.g. mp4")
+    args = parser.parse_args(argv[1:])
+
+    for key in ("download-folder", "additional-options", "max-downloads", "max-host-downloads",
+                "max-extractions", "meta-cache-ttl", "progress-rate", "limit-rate", "bandwidth-schedule", "backend", "max-postprocesses", "retries", "fragment-retries",
+                "min-concurrent-fragments", "max-concurrent-fragments", "stream-audio"):
+        config[key] = getattr(args, key.replace("-", "_"))
+    # thumbnails are only for display
+    config["thumbnails"] = False
+    config["write-info-json"] = not args.no_info_json
+    config["download-archive"] = "" if args.no_download_archive else args.download_archive
+    check_download_folder(config)
+    check_download_archive(config)
+    try:
+        configure_bandwidth(config)
+    except ValueError as err:
+        parser.error(str(err))
+
+    pipeline = HeadlessPipeline(config, format_options(
+        args.audio_only is not None, args.audio_only, args.resolution, args.video_format))
+    if "-" == args.input:
+        failures = pipeline.run(sys.stdin)
+    else:
+        with open(args.input) as stream:
+            failures = pipeline.run(stream)
+    close_pooled_ytdl()
+    if args.metrics_file is not None:
+        shared_metrics().write(args.metrics_file)
+    return 1 if failures > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
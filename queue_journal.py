@@ -0,0 +1,87 @@
+import sqlite3, time
+
+class QueueJournal:
+    """
+    A transactional journal of the download queue, kept in a SQLite database.
+    Every item records its URL, chosen formats, metadata location and state, so the
+    queue can be restored after the application is closed or crashed.
+    Rows are ordered by `position` and then by `id`, entries expanded from a
+    playlist share the position of the playlist and keep their order by id.
+    """
+    # columns an item is allowed to update
+    fields = ("title", "file_name", "info_json", "audio_only", "aformat",
+              "resolution", "vformat", "state")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # the write-ahead log keeps commits cheap and the database consistent after a crash
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    position INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    title TEXT,
+                    file_name TEXT,
+                    info_json TEXT,
+                    audio_only INTEGER NOT NULL DEFAULT 1,
+                    aformat TEXT,
+                    resolution TEXT,
+                    vformat TEXT,
+                    state TEXT NOT NULL DEFAULT 'new',
+                    updated REAL NOT NULL
+                )""")
+
+    def next_position(self) -> int:
+        row = self.conn.execute("SELECT MAX(position) FROM items").fetchone()
+        return (row[0] or 0) + 1
+
+    def add_many(self, entries: list, position: int | None = None) -> list:
+        """
+        Record new items of (url, title) in a single transaction, each at its own position
+        at the end of the queue, or all at the given position. Returns the ids of the new rows.
+        """
+        now = time.time()
+        ids = list()
+        with self.conn:
+            next_position = self.next_position()
+            for url, title in entries:
+                cursor = self.conn.execute(
+                    "INSERT INTO items (position, url, title, updated) VALUES (?, ?, ?, ?)",
+                    (next_position if position is None else position, url, title, now))
+                next_position += 1
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def update(self, item_id: int, **values):
+        """
+        update the recorded columns of an item
+        """
+        columns = [k for k in values if k in self.fields]
+        if not columns:
+            return
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE items SET {', '.join(f'{c} = ?' for c in columns)}, updated = ? WHERE id = ?",
+                [values[c] for c in columns] + [time.time(), item_id])
+
+    def remove_many(self, item_ids: list):
+        with self.conn:
+            self.conn.executemany("DELETE FROM items WHERE id = ?", [(i,) for i in item_ids])
+
+    def position_of(self, item_id: int) -> int | None:
+        row = self.conn.execute("SELECT position FROM items WHERE id = ?", (item_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def load(self) -> list:
+        """
+        all recorded items in queue order, as sqlite3.Row objects
+        """
+        return self.conn.execute("SELECT * FROM items ORDER BY position, id").fetchall()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,153 @@
+"""
+Retries of the downloads with backoff, and a circuit breaker of the hosts.
+
+A download failed by a transient error (throttling, a server error, a timeout) is
+queued again after an exponential backoff with jitter, and resumes from its partial
+files. A host failing repeatedly this way is paused: no new task to it is started
+until a cooldown has passed, then a single probe task is let through, which closes
+the breaker if it succeeds, or opens it again for twice as long.
+"""
+import threading, time, random, re
+from collections.abc import Callable
+from metrics import shared_metrics
+
+# backoff of the retries of a download, the first one waits about RETRY_BASE_DELAY
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 120.0
+# backoff of the retries of a fragment, done in place by yt-dlp
+FRAGMENT_BASE_DELAY = 0.5
+FRAGMENT_MAX_DELAY = 8.0
+# consecutive transient failures of a host opening its breaker, and the first cooldown
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 30.0
+BREAKER_MAX_COOLDOWN = 600.0
+# how soon a task waiting for the probe of a host checks the breaker again
+PROBE_RECHECK = 1.0
+# a probe not recorded within this many seconds is given up, and the next task probes,
+# some tasks let through never record an outcome (e.g. a metadata cache hit, an archived
+# URL, or an interrupted download)
+PROBE_TIMEOUT = 60.0
+
+_http_error = re.compile(r"HTTP Error (\d{3})")
+# messages of errors of the network rather than of the item
+_transient_messages = ("timed out", "Connection reset", "Connection aborted", "Connection refused",
+                       "Remote end closed", "IncompleteRead", "bytes read",
+                       "Temporary failure in name resolution", "giving up after")
+
+def transient_error(strerr: str) -> bool:
+    """
+    whether the error of a task is worth a retry: throttling (429), a server error (5xx),
+    a timeout or a broken connection, rather than e.g. a missing or private video
+    """
+    match = _http_error.search(strerr)
+    if match is not None:
+        status = int(match.group(1))
+        return status in (408, 425, 429) or 500 <= status < 600
+    return any(message in strerr for message in _transient_messages)
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """
+    seconds to wait before the retry of the attempt (0 for the first retry), exponential
+    with jitter, so that the downloads failed at once are not retried at once
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def fragment_backoff(n: int) -> float:
+    """
+    the retry sleep function of yt-dlp for the fragments
+    """
+    return backoff_delay(n, FRAGMENT_BASE_DELAY, FRAGMENT_MAX_DELAY)
+
+
+class _HostState:
+    __slots__ = ("failures", "opens", "open_until", "probing", "probe_until")
+
+    def __init__(self):
+        # consecutive transient failures while closed
+        self.failures = 0
+        # times the breaker has opened in a row, 0 while closed
+        self.opens = 0
+        self.open_until = 0.0
+        # a probe task is running while half-open
+        self.probing = False
+        self.probe_until = 0.0
+
+
+class HostBreaker:
+    """
+    The circuit breakers of the hosts, keyed by the host names used by the task schedulers
+    """
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        # only the hosts with failures have a state
+        self._hosts = dict()
+        # called with every outcome recorded, e.g. to forward it from a worker process
+        self.on_record: Callable[[str, bool], None] | None = None
+
+    def record(self, host: str, failed: bool):
+        """
+        record the outcome of a task of the host, failed if by a transient error
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._hosts.get(host)
+            if not failed:
+                # the host is responding, close the breaker
+                if state is not None:
+                    del self._hosts[host]
+            else:
+                if state is None:
+                    state = self._hosts[host] = _HostState()
+                if state.opens == 0:
+                    state.failures += 1
+                    if state.failures >= self.threshold:
+                        self._open(host, state, now)
+                elif state.open_until <= now:
+                    # the probe failed, or a task started before the breaker opened
+                    self._open(host, state, now)
+        if self.on_record is not None:
+            self.on_record(host, failed)
+
+    def _open(self, host: str, state: _HostState, now: float):
+        """
+        must be called with the lock held
+        """
+        state.open_until = now + min(self.max_cooldown, self.cooldown * 2 ** state.opens)
+        state.opens += 1
+        state.failures = 0
+        state.probing = False
+        shared_metrics().inc("breaker_open_total", host=host)
+
+    def delay(self, host: str) -> float:
+        """
+        Seconds until a new task of the host may start, 0 if it may start now.
+        Once the cooldown has passed, the caller getting 0 runs the probe task, until
+        it records an outcome or PROBE_TIMEOUT has passed, the gate of the schedulers.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state.opens == 0:
+                return 0.0
+            now = time.monotonic()
+            wait = state.open_until - now
+            if wait > 0:
+                return wait
+            if state.probing and state.probe_until > now:
+                return min(PROBE_RECHECK, state.probe_until - now)
+            state.probing = True
+            state.probe_until = now + PROBE_TIMEOUT
+            return 0.0
+
+
+_breaker = HostBreaker()
+
+def shared_breaker() -> HostBreaker:
+    """
+    the process-wide breakers of all tasks
+    """
+    return _breaker
@@ -0,0 +1,27 @@
+"""
+Timestamps of the startup of pygyt, reported with --profile-startup.
+Imported first by pygyt.py, so the time of this import is the start of the application.
+"""
+import sys, time
+
+_start = time.perf_counter()
+_marks = [("start", _start)]
+
+def mark(name: str):
+    """
+    the end of a startup step
+    """
+    _marks.append((name, time.perf_counter()))
+
+def report(title: str = "startup", steps: dict | None = None, file=sys.stderr):
+    """
+    print the time spent in every step since the previous one, or the given steps in seconds
+    """
+    print(f"{title}:", file=file)
+    if steps is None:
+        for (_, previous), (name, at) in zip(_marks, _marks[1:]):
+            print(f"  {name:24} {(at - previous) * 1000:8.1f} ms", file=file)
+        print(f"  {'total':24} {(_marks[-1][1] - _start) * 1000:8.1f} ms", file=file)
+    else:
+        for name, seconds in steps.items():
+            print(f"  {name:24} {seconds * 1000:8.1f} ms", file=file)
@@ -0,0 +1,286 @@
+import threading, heapq, itertools, traceback, time
+from collections.abc import Callable
+from urllib.parse import urlparse
+
+def host_of(url: str) -> str:
+    """
+    the host name of the URL, the key used for per-host limits
+    """
+    try:
+        return urlparse(url).hostname or ""
+    except ValueError:
+        return ""
+
+
+class SingleFlight:
+    """
+    Coalescing of the work of the same key in flight: the first caller of a key leads
+    and does the work, the later callers are attached to it as followers until the
+    leader is done with the key, and are handed its result by the leader.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> list of followers
+        self._flights = dict()
+
+    def join(self, key, follower) -> bool:
+        """
+        True if the caller leads the work of the key, False if the follower is attached
+        to the leader already in flight
+        """
+        with self._lock:
+            followers = self._flights.get(key)
+            if followers is None:
+                self._flights[key] = list()
+                return True
+            followers.append(follower)
+            return False
+
+    def done(self, key) -> list:
+        """
+        end the flight of the key led by the caller, returns the followers attached to it
+        """
+        with self._lock:
+            return self._flights.pop(key, [])
+
+
+class RetryLater(Exception):
+    """
+    Raised from the run() of a task to be queued again and run after the delay in seconds,
+    e.g. after a transient error. The worker slot is free in the meantime.
+    """
+    def __init__(self, delay: float):
+        super().__init__(delay)
+        self.delay = delay
+
+
+class _Entry:
+    """
+    A queued task, ordered by priority (higher first) and then by arrival (FIFO)
+    """
+    __slots__ = ("task", "priority", "seq", "host", "on_start", "ready_at", "preempted")
+
+    def __init__(self, task, priority: int, seq: int, host: str,
+                 on_start: Callable[[], None] | None, ready_at: float = 0.0):
+        self.task = task
+        self.priority = priority
+        self.seq = seq
+        self.host = host
+        self.on_start = on_start
+        # monotonic time before which the task is not started
+        self.ready_at = ready_at
+        # the running task has been asked to yield its slot
+        self.preempted = False
+
+    def __lt__(self, other):
+        return (-self.priority, self.seq) < (-other.priority, other.seq)
+
+
+class TaskScheduler:
+    """
+    A bounded scheduler for the threading tasks.
+    Submitted tasks wait in a priority queue and are run by a small set of worker
+    threads, so that no more than `limit` tasks are running at the same time, and
+    no more than `host_limit` of them target the same host (0 means no per-host limit).
+    The optional `gate` of hosts returns the seconds a new task of a host has to wait,
+    e.g. while the host is throttling.
+    A task of a higher priority preempts the running task of the lowest priority if all
+    slots are taken, provided the task has an interrupt("preempted") method, which is
+    expected to make its run() raise RetryLater soon, to be queued again.
+    The task objects are executed by calling their run() method in a worker thread,
+    they are never start()-ed as threads of their own.
+    """
+    def __init__(self, limit: int, host_limit: int = 0, name: str = "pygyt-worker",
+                 gate: Callable[[str], float] | None = None):
+        self.name = name
+        self._limit = max(1, int(limit))
+        self._host_limit = max(0, int(host_limit))
+        self._gate = gate
+        self._cond = threading.Condition()
+        # heap of _Entry
+        self._queue = []
+        self._seq = itertools.count()
+        # number of running tasks per host
+        self._hosts = dict()
+        self._running = 0
+        # entries of the running tasks
+        self._active = set()
+        self._workers = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def host_limit(self) -> int:
+        return self._host_limit
+
+    def set_limits(self, limit: int | None = None, host_limit: int | None = None):
+        """
+        change the concurrency limits, running tasks are never interrupted,
+        the new limits take effect when the next task is picked up
+        """
+        with self._cond:
+            if limit is not None:
+                self._limit = max(1, int(limit))
+            if host_limit is not None:
+                self._host_limit = max(0, int(host_limit))
+            self._spawn_workers()
+            self._cond.notify_all()
+
+    def submit(self, task, priority: int = 0, host: str = "",
+               on_start: Callable[[], None] | None = None, delay: float = 0):
+        """
+        Queue a task object with run() method, to be started no sooner than the delay in seconds.
+        The optional on_start callback is invoked from the worker thread right before
+        the task is run, use GLib.idle_add() in it if the GUI has to be updated.
+        """
+        ready_at = time.monotonic() + delay if delay > 0 else 0.0
+        entry = _Entry(task, priority, next(self._seq), host, on_start, ready_at)
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            self._spawn_workers()
+            self._preempt(entry)
+            self._cond.notify()
+
+    def remove(self, task) -> bool:
+        """
+        Remove a task from the queue before it is started (or while it waits for a retry),
+        False if it is not queued, e.g. already running.
+        """
+        with self._cond:
+            for i, entry in enumerate(self._queue):
+                if entry.task is task:
+                    self._queue[i] = self._queue[-1]
+                    self._queue.pop()
+                    heapq.heapify(self._queue)
+                    return True
+        return False
+
+    def reprioritize(self, task, priority: int) -> bool:
+        """
+        Change the priority of a queued task in place, it keeps what is left of its delay
+        (e.g. a retry backoff), and is still gated. False if it is not queued, e.g. running.
+        """
+        with self._cond:
+            for entry in self._queue:
+                if entry.task is task:
+                    entry.priority = priority
+                    heapq.heapify(self._queue)
+                    self._preempt(entry)
+                    self._cond.notify()
+                    return True
+        return False
+
+    def _preempt(self, entry: _Entry):
+        """
+        Ask the running task of the lowest priority to yield its slot to the new entry,
+        if all slots are taken by tasks of a lower priority, must be called with the lock held.
+        The most recently started of them is asked, it has the least progress to lose.
+        An entry waiting for its delay preempts nothing.
+        """
+        if self._running < self._limit or entry.ready_at > time.monotonic():
+            # a slot is free, or the entry could not take one yet
+            return
+        victims = [r for r in self._active
+                   if not r.preempted and r.priority < entry.priority and hasattr(r.task, "interrupt")
+                   # the slot is of use to the new entry only if its host allows it
+                   and (self._host_limit == 0 or r.host == entry.host
+                        or self._hosts.get(entry.host, 0) < self._host_limit)]
+        if not victims:
+            return
+        victim = min(victims, key=lambda r: (r.priority, -r.seq))
+        victim.preempted = True
+        victim.task.interrupt("preempted")
+
+    def pending(self) -> int:
+        """
+        number of tasks waiting in the queue
+        """
+        with self._cond:
+            return len(self._queue)
+
+    def running(self) -> int:
+        """
+        number of tasks being run by the workers
+        """
+        with self._cond:
+            return self._running
+
+    def _spawn_workers(self):
+        """
+        start more worker threads up to the limit, must be called with the lock held
+        """
+        while self._workers < min(self._limit, self._running + len(self._queue)):
+            self._workers += 1
+            threading.Thread(target=self._work, name=f"{self.name}-{self._workers}",
+                             daemon=True).start()
+
+    def _pop_eligible(self) -> tuple:
+        """
+        Pop the first entry in priority order which is ready, and whose host still has
+        a free slot and is open by the gate, must be called with the lock held.
+        Returns the entry or None, and the seconds until a skipped entry gets ready
+        (None if no entry is waiting for the time).
+        """
+        skipped = []
+        entry = None
+        wake_in = None
+        now = time.monotonic()
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if (self._host_limit == 0 or
+                self._hosts.get(candidate.host, 0) < self._host_limit):
+                wait = candidate.ready_at - now
+                # the gate is asked last, a host may let a single task through
+                if wait <= 0 and self._gate is not None:
+                    wait = self._gate(candidate.host)
+                if wait <= 0:
+                    entry = candidate
+                    break
+                wake_in = wait if wake_in is None else min(wake_in, wait)
+            skipped.append(candidate)
+        for s in skipped:
+            heapq.heappush(self._queue, s)
+        return entry, wake_in
+
+    def _work(self):
+        """
+        The loop of worker threads
+        """
+        with self._cond:
+            while True:
+                if self._workers > self._limit:
+                    # limit was lowered, retire this worker
+                    self._workers -= 1
+                    return
+                entry, wake_in = self._pop_eligible() if self._running < self._limit else (None, None)
+                if entry is None:
+                    self._cond.wait(wake_in)
+                    continue
+                self._running += 1
+                self._hosts[entry.host] = self._hosts.get(entry.host, 0) + 1
+                self._active.add(entry)
+                retry = None
+                self._cond.release()
+                try:
+                    if entry.on_start is not None:
+                        entry.on_start()
+                    entry.task.run()
+                except RetryLater as err:
+                    retry = err
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    self._cond.acquire()
+                    self._active.discard(entry)
+                    self._running -= 1
+                    self._hosts[entry.host] -= 1
+                    if 0 == self._hosts[entry.host]:
+                        del self._hosts[entry.host]
+                    if retry is not None:
+                        # back in its place of the queue, once the delay has passed
+                        entry.preempted = False
+                        entry.ready_at = time.monotonic() + retry.delay
+                        heapq.heappush(self._queue, entry)
+                    self._cond.notify_all()
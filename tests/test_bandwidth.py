@@ -0,0 +1,104 @@
+"""
+Rates, time-of-day schedules and the shares of the bandwidth manager.
+
+    $ python3 -m pytest tests
+"""
+import sys, time
+from pathlib import Path
+import pytest
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bandwidth
+from bandwidth import BandwidthManager, parse_rate, parse_schedule
+
+
+def at_minute(monkeypatch, hour: int, minute: int):
+    """
+    make the manager see the local time of the day
+    """
+    local = time.struct_time((2026, 1, 1, hour, minute, 0, 3, 1, 0))
+    monkeypatch.setattr(bandwidth.time, "localtime", lambda *args: local)
+
+@pytest.mark.parametrize("text, rate", [
+    ("0", 0), ("1024", 1024), ("500K", 500 * 1024), ("500k", 500 * 1024), ("500KiB", 500 * 1024),
+    ("1.5M", 1.5 * 1024 ** 2), ("2G", 2 * 1024 ** 3), (" 2MB ", 2 * 1024 ** 2),
+])
+def test_parse_rate(text, rate):
+    assert rate == parse_rate(text)
+
+@pytest.mark.parametrize("text", ["", "fast", "5T", "-1K", "1.K"])
+def test_parse_rate_invalid(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+def test_parse_schedule():
+    assert [(8 * 60, 18 * 60, 500 * 1024), (22 * 60 + 30, 6 * 60, 0)] == \
+        parse_schedule("08:00-18:00=500K, 22:30-6=0")
+    assert [] == parse_schedule("")
+
+@pytest.mark.parametrize("text", [
+    "25:00-26:00=1M", "08:75-09:00=1M", "24:00-06:00=1M", "08:00-09:60=1M",
+    "08:00=1M", "ab-cd=1M", "08:00-09:00", "08:00-09:00=fast", "8:5-9=1M",
+])
+def test_parse_schedule_invalid(text):
+    with pytest.raises(ValueError):
+        parse_schedule(text)
+
+def test_schedule_replaces_rate_within_periods(monkeypatch):
+    manager = BandwidthManager(rate=100, schedule=parse_schedule("08:00-18:00=500,22:00-06:00=0"))
+    for hour, minute, rate in ((7, 59, 100), (8, 0, 500), (17, 59, 500), (18, 0, 100),
+                               # over midnight
+                               (22, 0, 0), (23, 59, 0), (0, 0, 0), (5, 59, 0), (6, 0, 100)):
+        at_minute(monkeypatch, hour, minute)
+        assert rate == manager.current_rate(), f"{hour:02d}:{minute:02d}"
+
+def test_share_by_weight_of_active_leases():
+    manager = BandwidthManager(rate=900)
+    heavy, light = manager.lease(2.0), manager.lease(1.0)
+    idle = manager.lease(1.0)
+    heavy.last_active = light.last_active = time.monotonic()
+    # the idle lease has not consumed within ACTIVE_WINDOW, it takes no share
+    assert 600 == manager.share(heavy)
+    assert 300 == manager.share(light)
+    light.release()
+    assert 900 == manager.share(heavy)
+    idle.release()
+
+def test_no_limit():
+    manager = BandwidthManager()
+    lease = manager.lease()
+    params = dict()
+    lease.bind(params)
+    lease.consume(1 << 30)
+    assert 0 == manager.share(lease)
+    assert "ratelimit" not in params
+
+def test_consume_sleeps_off_the_debt(monkeypatch):
+    slept = list()
+    monkeypatch.setattr(bandwidth.time, "sleep", slept.append)
+    manager = BandwidthManager(rate=1000)
+    lease = manager.lease()
+    lease.consume(500)
+    assert 1 == len(slept) and 0.45 < slept[0] <= 0.5
+    # the bucket never holds more than BURST_SECONDS of the share
+    lease.tokens = 0
+    lease.refilled -= 60
+    slept.clear()
+    lease.consume(1000)
+    assert [] == slept
+    assert lease.tokens <= 0
+
+def test_ratelimit_follows_share_and_is_restored():
+    manager = BandwidthManager(rate=1000)
+    first, second = manager.lease(), manager.lease()
+    params = {"ratelimit": 800}
+    first.bind(params)
+    second.last_active = time.monotonic()
+    first.consume(0)
+    # the smaller of the share and the user's own ratelimit
+    assert 500 == params["ratelimit"]
+    second.release()
+    first.consume(0)
+    assert 800 == params["ratelimit"]
+    first.release()
+    assert {"ratelimit": 800} == params
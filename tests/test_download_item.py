@@ -0,0 +1,34 @@
+"""
+DownloadItem without a window, the schedulers are never run.
+
+    $ python3 -m pytest tests
+"""
+import sys
+from pathlib import Path
+import pytest
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("gi")
+
+from pygyt_config import default_config
+from task_scheduler import TaskScheduler
+from DownloadItem import DownloadItem
+
+
+def restored_item(tmp_path, state: str) -> DownloadItem:
+    config = default_config()
+    config["download-folder"] = str(tmp_path)
+    item = DownloadItem(config, "https://example.com/watch?v=paused",
+                        TaskScheduler(1), TaskScheduler(1))
+    item.restore({"audio_only": 1, "aformat": "wav", "resolution": "best",
+                  "vformat": "best", "state": state})
+    return item
+
+def test_cancel_restored_paused_item_without_metadata(tmp_path):
+    item = restored_item(tmp_path, "paused")
+    assert item.meta is None and "file_name" not in item.config
+
+    item.cancel()
+
+    assert "cancelled" == item.state
+    assert not item.download_requested
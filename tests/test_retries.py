@@ -0,0 +1,112 @@
+"""
+Transient errors, backoff delays and the circuit breaker of the hosts.
+
+    $ python3 -m pytest tests
+"""
+import sys
+from pathlib import Path
+import pytest
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import retries
+from retries import HostBreaker, transient_error, backoff_delay, fragment_backoff
+
+
+class Clock:
+    """
+    the monotonic time of the breaker, moved on by the test
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(retries.time, "monotonic", clock)
+    return clock
+
+@pytest.mark.parametrize("strerr", [
+    "ERROR: unable to download video data: HTTP Error 429: Too Many Requests",
+    "HTTP Error 503: Service Unavailable", "HTTP Error 408: Request Timeout",
+    "The read operation timed out", "[Errno 104] Connection reset by peer",
+    "giving up after 10 retries",
+])
+def test_transient_error(strerr):
+    assert transient_error(strerr)
+
+@pytest.mark.parametrize("strerr", [
+    "HTTP Error 403: Forbidden", "HTTP Error 404: Not Found",
+    "Private video. Sign in if you've been granted access", "Unsupported URL", "",
+])
+def test_permanent_error(strerr):
+    assert not transient_error(strerr)
+
+def test_backoff_delay():
+    for attempt in range(10):
+        delay = min(120.0, 2.0 * 2 ** attempt)
+        for _ in range(20):
+            assert delay / 2 <= backoff_delay(attempt) <= delay
+    assert 60 <= backoff_delay(100) <= 120
+    assert 4 <= fragment_backoff(100) <= 8
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = HostBreaker(threshold=3, cooldown=30)
+    for _ in range(2):
+        breaker.record("host", True)
+        assert 0 == breaker.delay("host")
+    # a success in between starts the count again
+    breaker.record("host", False)
+    breaker.record("host", True)
+    breaker.record("host", True)
+    assert 0 == breaker.delay("host")
+    breaker.record("host", True)
+    assert 30 == breaker.delay("host")
+    assert 0 == breaker.delay("other")
+    clock.now += 10
+    assert 20 == breaker.delay("host")
+
+def test_breaker_lets_a_single_probe_through(clock):
+    breaker = HostBreaker(threshold=1, cooldown=30)
+    breaker.record("host", True)
+    clock.now += 30
+    assert 0 == breaker.delay("host")
+    # the others wait for the outcome of the probe
+    assert retries.PROBE_RECHECK == breaker.delay("host")
+    breaker.record("host", False)
+    assert 0 == breaker.delay("host")
+    assert 0 == breaker.delay("host")
+
+def test_breaker_gives_up_a_silent_probe(clock):
+    breaker = HostBreaker(threshold=1, cooldown=30)
+    breaker.record("host", True)
+    clock.now += 30
+    assert 0 == breaker.delay("host")
+    clock.now += retries.PROBE_TIMEOUT - 0.5
+    assert 0.5 == breaker.delay("host")
+    clock.now += 0.5
+    # the next task probes
+    assert 0 == breaker.delay("host")
+    assert retries.PROBE_RECHECK == breaker.delay("host")
+
+def test_failed_probe_doubles_cooldown(clock):
+    breaker = HostBreaker(threshold=1, cooldown=30, max_cooldown=100)
+    breaker.record("host", True)
+    for cooldown in (60, 100, 100):
+        clock.now += breaker.delay("host")
+        assert 0 == breaker.delay("host")
+        breaker.record("host", True)
+        assert cooldown == breaker.delay("host")
+    # a task started before the breaker opened does not open it again
+    breaker.record("host", True)
+    assert 100 == breaker.delay("host")
+
+def test_on_record():
+    breaker = HostBreaker()
+    recorded = list()
+    breaker.on_record = lambda *args: recorded.append(args)
+    breaker.record("a", True)
+    breaker.record("b", False)
+    assert [("a", True), ("b", False)] == recorded
@@ -0,0 +1,91 @@
+"""
+--stream-audio of an item whose extracted info is handed over from the metadata phase,
+with the formats selected by its default "bv*+ba/b" left in it. The audio is served by
+a local HTTP server, no network is needed.
+
+    $ python3 -m pytest tests
+"""
+import sys, shutil, subprocess, threading, functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+import pytest
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("gi")
+pytest.importorskip("yt_dlp")
+if shutil.which("ffmpeg") is None:
+    pytest.skip("ffmpeg is needed", allow_module_level=True)
+
+from pygyt_config import default_config
+import ytdlp_tasks
+
+
+class _RecordingHandler(SimpleHTTPRequestHandler):
+    requested = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        super().do_GET()
+
+
+@pytest.fixture
+def media(tmp_path):
+    """
+    a folder served over HTTP with a short wav audio, and the paths requested from it
+    """
+    served = tmp_path / "served"
+    served.mkdir()
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+                    "-i", "sine=frequency=440:duration=1", "-c:a", "pcm_s16le", str(served / "audio.wav")],
+                   check=True)
+    (served / "video.mp4").write_bytes(b"\0" * 1024)
+    handler = type("Handler", (_RecordingHandler,), {"requested": list()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=str(served)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", handler.requested
+    server.shutdown()
+    server.server_close()
+
+def handed_over_info(base: str) -> dict:
+    """
+    the info as the metadata phase leaves it, after its default format selection
+    """
+    video = {"format_id": "video", "url": f"{base}/video.mp4", "ext": "mp4",
+             "vcodec": "avc1.64001f", "acodec": "none", "protocol": "http"}
+    audio = {"format_id": "audio", "url": f"{base}/audio.wav", "ext": "wav",
+             "vcodec": "none", "acodec": "pcm_s16le", "protocol": "http"}
+    return {
+        "id": "stream", "title": "stream", "extractor": "generic", "extractor_key": "Generic",
+        "webpage_url": f"{base}/page", "original_url": f"{base}/page",
+        "formats": [dict(video), dict(audio)],
+        "requested_formats": [dict(video), dict(audio)],
+        "format_id": "video+audio", "_filename": "stream.mp4", "__postprocessors": [],
+    }
+
+def test_handed_over_audio_only_item_streams(tmp_path, media):
+    base, requested = media
+    config = default_config()
+    config.update({
+        "download-folder": str(tmp_path),
+        "cache-folder": str(tmp_path / "cache"),
+        "file_name": "stream",
+        "meta-cache-ttl": 0,
+        "download-archive": "",
+        "postprocess-stage": False,
+        "stream-audio": True,
+        "additional-options": ytdlp_tasks.format_options(True, "wav"),
+    })
+    results = list()
+    task = ytdlp_tasks.TaskGetFile(config, f"{base}/page", lambda *args: results.append(args),
+                                   dispatch=lambda callback, *args: callback(*args),
+                                   info=handed_over_info(base))
+    task.run()
+
+    assert [(0, "")] == results
+    assert (tmp_path / "stream.wav").stat().st_size > 0
+    # streamed: only the audio is fetched, and neither the video nor a partial file is left
+    assert ["/audio.wav"] == requested
+    assert ["stream.wav"] == sorted(p.name for p in tmp_path.iterdir() if p.is_file())
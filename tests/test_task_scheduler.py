@@ -0,0 +1,224 @@
+"""
+Limits, priorities, preemption and retries of the task scheduler.
+
+    $ python3 -m pytest tests
+"""
+import sys, threading, time
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from task_scheduler import TaskScheduler, RetryLater, SingleFlight
+
+TIMEOUT = 5.0
+
+
+def wait_until(condition) -> bool:
+    """
+    poll the condition until it is true or the time is out
+    """
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class Task:
+    """
+    A task recording its starts in the log, which runs until it is released
+    """
+    def __init__(self, name: str, log: list, blocking: bool = True):
+        self.name = name
+        self.log = log
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.done = threading.Event()
+        self.starts = list()
+        if not blocking:
+            self.released.set()
+
+    def run(self):
+        self.starts.append(time.monotonic())
+        self.log.append(self.name)
+        self.started.set()
+        self.released.wait(TIMEOUT)
+        self.done.set()
+
+
+class InterruptibleTask(Task):
+    """
+    A task giving up its slot when it is interrupted, to be run again
+    """
+    def __init__(self, name: str, log: list):
+        super().__init__(name, log)
+        self.reasons = list()
+
+    def interrupt(self, reason: str):
+        self.reasons.append(reason)
+        self.released.set()
+
+    def run(self):
+        super().run()
+        if self.reasons and 1 == len(self.starts):
+            self.done.clear()
+            raise RetryLater(0)
+
+
+def test_limit():
+    scheduler = TaskScheduler(2)
+    log = list()
+    tasks = [Task(str(i), log) for i in range(3)]
+    for task in tasks:
+        scheduler.submit(task)
+    assert wait_until(lambda: 2 == scheduler.running())
+    time.sleep(0.05)
+    assert ["0", "1"] == log
+    assert 1 == scheduler.pending()
+    tasks[0].released.set()
+    assert tasks[2].started.wait(TIMEOUT)
+    for task in tasks:
+        task.released.set()
+    assert wait_until(lambda: 0 == scheduler.running() + scheduler.pending())
+
+def test_host_limit():
+    scheduler = TaskScheduler(3, host_limit=1)
+    log = list()
+    first, second, other = Task("a1", log), Task("a2", log), Task("b", log)
+    scheduler.submit(first, host="a")
+    scheduler.submit(second, host="a")
+    scheduler.submit(other, host="b")
+    assert first.started.wait(TIMEOUT) and other.started.wait(TIMEOUT)
+    time.sleep(0.05)
+    # a slot is free, but not for the host
+    assert not second.started.is_set()
+    first.released.set()
+    assert second.started.wait(TIMEOUT)
+    second.released.set()
+    other.released.set()
+
+def test_priority_then_arrival_order():
+    scheduler = TaskScheduler(1)
+    log = list()
+    blocker = Task("blocker", log)
+    scheduler.submit(blocker)
+    assert blocker.started.wait(TIMEOUT)
+    tasks = [Task("low", log, False), Task("high", log, False),
+             Task("mid1", log, False), Task("mid2", log, False)]
+    for task, priority in zip(tasks, (0, 2, 1, 1)):
+        scheduler.submit(task, priority=priority)
+    blocker.released.set()
+    assert all(task.done.wait(TIMEOUT) for task in tasks)
+    assert ["blocker", "high", "mid1", "mid2", "low"] == log
+
+def test_preemption():
+    scheduler = TaskScheduler(1)
+    log = list()
+    low = InterruptibleTask("low", log)
+    scheduler.submit(low)
+    assert low.started.wait(TIMEOUT)
+    # of the same priority, nothing is preempted
+    same = Task("same", log, False)
+    scheduler.submit(same)
+    time.sleep(0.05)
+    assert [] == low.reasons
+    high = Task("high", log)
+    scheduler.submit(high, priority=1)
+    assert high.started.wait(TIMEOUT)
+    assert ["preempted"] == low.reasons
+    high.released.set()
+    assert low.done.wait(TIMEOUT) and same.done.wait(TIMEOUT)
+    # the preempted task is queued again in its place, ahead of the later one
+    assert ["low", "high", "low", "same"] == log
+
+def test_delayed_entry_preempts_nothing():
+    scheduler = TaskScheduler(1)
+    log = list()
+    low = InterruptibleTask("low", log)
+    scheduler.submit(low)
+    assert low.started.wait(TIMEOUT)
+    high = Task("high", log, False)
+    scheduler.submit(high, priority=1, delay=TIMEOUT)
+    time.sleep(0.05)
+    assert [] == low.reasons
+    assert scheduler.remove(high)
+    low.released.set()
+
+def test_retry_later_requeues_after_delay():
+    class Flaky(Task):
+        def run(self):
+            super().run()
+            if 1 == len(self.starts):
+                raise RetryLater(0.2)
+
+    scheduler = TaskScheduler(1)
+    log = list()
+    flaky, other = Flaky("flaky", log, False), Task("other", log, False)
+    scheduler.submit(flaky)
+    assert flaky.started.wait(TIMEOUT)
+    scheduler.submit(other)
+    # the slot is free for others in the meantime
+    assert other.done.wait(TIMEOUT)
+    assert wait_until(lambda: 2 == len(flaky.starts))
+    assert flaky.starts[1] - flaky.starts[0] >= 0.2
+    assert ["flaky", "other", "flaky"] == log
+
+def test_remove():
+    scheduler = TaskScheduler(1)
+    log = list()
+    running, queued = Task("running", log), Task("queued", log, False)
+    scheduler.submit(running)
+    assert running.started.wait(TIMEOUT)
+    scheduler.submit(queued)
+    assert not scheduler.remove(running)
+    assert scheduler.remove(queued)
+    assert not scheduler.remove(queued)
+    running.released.set()
+    assert wait_until(lambda: 0 == scheduler.running())
+    assert ["running"] == log
+
+def test_reprioritize():
+    scheduler = TaskScheduler(1)
+    log = list()
+    blocker = Task("blocker", log)
+    scheduler.submit(blocker)
+    assert blocker.started.wait(TIMEOUT)
+    first, second = Task("first", log, False), Task("second", log, False)
+    scheduler.submit(first)
+    scheduler.submit(second)
+    assert scheduler.reprioritize(second, 1)
+    assert not scheduler.reprioritize(blocker, 1)
+    blocker.released.set()
+    assert first.done.wait(TIMEOUT) and second.done.wait(TIMEOUT)
+    assert ["blocker", "second", "first"] == log
+
+def test_reprioritize_keeps_delay():
+    scheduler = TaskScheduler(1)
+    log = list()
+    submitted = time.monotonic()
+    delayed = Task("delayed", log, False)
+    scheduler.submit(delayed, delay=0.2)
+    assert scheduler.reprioritize(delayed, 1)
+    assert delayed.done.wait(TIMEOUT)
+    assert delayed.starts[0] - submitted >= 0.2
+
+def test_gate():
+    opens_at = time.monotonic() + 0.2
+    scheduler = TaskScheduler(2, gate=lambda host: opens_at - time.monotonic() if "slow" == host else 0)
+    log = list()
+    slow, fast = Task("slow", log, False), Task("fast", log, False)
+    scheduler.submit(slow, priority=1, host="slow")
+    scheduler.submit(fast, host="fast")
+    assert fast.done.wait(TIMEOUT) and slow.done.wait(TIMEOUT)
+    assert ["fast", "slow"] == log
+    assert slow.starts[0] >= opens_at
+
+def test_single_flight():
+    flights = SingleFlight()
+    assert flights.join("key", "leader")
+    assert not flights.join("key", "a")
+    assert not flights.join("key", "b")
+    assert flights.join("other", "leader")
+    assert ["a", "b"] == flights.done("key")
+    assert [] == flights.done("key")
+    assert flights.join("key", "leader")
@@ -0,0 +1,166 @@
+import gi
+gi.require_version("Gdk", "4.0")
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import Gdk, GdkPixbuf, GLib
+from collections import OrderedDict
+from pathlib import Path
+import threading, hashlib, os
+
+# the thumbnail is shown as a small icon of the row, decoded at twice the
+# size of the row picture to stay sharp on HiDPI screens
+THUMBNAIL_WIDTH = 192
+THUMBNAIL_HEIGHT = 108
+
+_loadable = None
+
+def loadable_extensions() -> set:
+    """
+    image file extensions gdk-pixbuf is able to decode (webp needs an extra loader)
+    """
+    global _loadable
+    if _loadable is None:
+        _loadable = {ext for fmt in GdkPixbuf.Pixbuf.get_formats() for ext in fmt.get_extensions()}
+    return _loadable
+
+def pick_thumbnail(info: dict) -> str | None:
+    """
+    The URL of the smallest decodable thumbnail that is still not smaller than the
+    row size, or the largest one otherwise. None if the info has no usable thumbnail.
+    """
+    candidates = list()
+    for t in info.get("thumbnails") or []:
+        url = t.get("url")
+        if not url:
+            continue
+        ext = url.split("?")[0].rsplit(".", 1)[-1].lower()
+        if ext not in loadable_extensions():
+            continue
+        candidates.append((t.get("width") or 0, t.get("preference") or 0, url))
+    if not candidates:
+        url = info.get("thumbnail")
+        return url if url and not url.split("?")[0].lower().endswith(".webp") else None
+    large_enough = [c for c in candidates if c[0] >= THUMBNAIL_WIDTH]
+    if large_enough:
+        return min(large_enough, key=lambda c: (c[0], -c[1]))[2]
+    return max(candidates, key=lambda c: (c[0], c[1]))[2]
+
+def decode_scaled(data: bytes) -> GdkPixbuf.Pixbuf:
+    """
+    Decode the image downscaled to fit the thumbnail size, the loader scales while
+    decoding, so the full size image is never held in memory.
+    """
+    def on_size_prepared(loader, width, height):
+        scale = min(THUMBNAIL_WIDTH / width, THUMBNAIL_HEIGHT / height, 1.0)
+        loader.set_size(max(1, int(width * scale)), max(1, int(height * scale)))
+
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect("size-prepared", on_size_prepared)
+    try:
+        loader.write(data)
+    finally:
+        loader.close()
+    return loader.get_pixbuf()
+
+def texture_from_file(path: str) -> Gdk.Texture:
+    """
+    a thumbnail size texture of an image file
+    """
+    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, True)
+    return Gdk.Texture.new_for_pixbuf(pixbuf)
+
+
+class ThumbnailCache:
+    """
+    A bounded LRU cache of thumbnail textures, keyed by the archive key of the video.
+    With a folder given, the downscaled thumbnails are also saved there as small png
+    files, and at most `max_files` of the most recently used ones are kept.
+    """
+    def __init__(self, max_items: int, folder: str | None = None, max_files: int = 10000):
+        self.max_items = max_items
+        self.folder = Path(folder) if folder is not None else None
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._textures = OrderedDict()
+        self._files = None
+
+    def _path(self, key: str) -> Path:
+        return self.folder.joinpath(f"{hashlib.sha1(key.encode()).hexdigest()}.png")
+
+    def get(self, key: str) -> Gdk.Texture | None:
+        """
+        the texture from memory, or from the disk cache, None if not cached
+        """
+        with self._lock:
+            texture = self._textures.get(key)
+            if texture is not None:
+                self._textures.move_to_end(key)
+                return texture
+        if self.folder is None:
+            return None
+        path = self._path(key)
+        try:
+            texture = Gdk.Texture.new_from_filename(str(path))
+            os.utime(path)
+        except (GLib.Error, OSError):
+            return None
+        self._remember(key, texture)
+        return texture
+
+    def put(self, key: str, pixbuf: GdkPixbuf.Pixbuf) -> Gdk.Texture:
+        """
+        cache the downscaled image and return its texture
+        """
+        texture = Gdk.Texture.new_for_pixbuf(pixbuf)
+        self._remember(key, texture)
+        if self.folder is not None:
+            try:
+                self.folder.mkdir(parents=True, exist_ok=True)
+                pixbuf.savev(str(self._path(key)), "png", [], [])
+            except (GLib.Error, OSError):
+                pass
+            else:
+                self._prune()
+        return texture
+
+    def _remember(self, key: str, texture: Gdk.Texture):
+        with self._lock:
+            self._textures[key] = texture
+            self._textures.move_to_end(key)
+            while len(self._textures) > self.max_items:
+                self._textures.popitem(last=False)
+
+    def _prune(self):
+        """
+        keep the number of files in the disk cache bounded
+        """
+        with self._lock:
+            if self._files is None:
+                self._files = len(list(self.folder.glob("*.png")))
+            else:
+                self._files += 1
+            if self._files <= self.max_files:
+                return
+            files = sorted(self.folder.glob("*.png"), key=lambda p: p.stat().st_mtime)
+            # remove a tenth more than needed, not to rescan the folder on every put
+            excess = len(files) - self.max_files + self.max_files // 10
+            for p in files[:max(0, excess)]:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            self._files = len(files) - max(0, excess)
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+def shared_cache(max_items: int, folder: str | None) -> ThumbnailCache:
+    """
+    the process-wide thumbnail cache, shared by all tasks
+    """
+    with _caches_lock:
+        cache = _caches.get(folder)
+        if cache is None:
+            cache = _caches[folder] = ThumbnailCache(max_items, folder)
+        cache.max_items = max_items
+        return cache
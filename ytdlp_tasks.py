@@ -1,20 +1,70 @@
+from __future__ import annotations
 import gi
 gi.require_version("Gtk", "4.0")
-from gi.repository import GLib
+from gi.repository import GLib, Gdk
 from typing import List
 from collections.abc import Callable
 from pathlib import Path
 
-import yt_dlp
-import yt_dlp.options
-import threading, json, time
+import threading, json, time, functools, copy, contextlib, importlib, glob, re, subprocess, tempfile, traceback
+from collections import OrderedDict
+from meta_cache import MetaCache, shared_cache, formats_expired
+import thumbnails
+import bandwidth, retries
+from metrics import Timings, shared_metrics
+from task_scheduler import TaskScheduler, SingleFlight, RetryLater, host_of
+from compact_meta import CompactMeta
+from download_archive import DownloadArchive, shared_archive
+from fragment_tuning import shared_tuning
+import os
 
-create_parser = yt_dlp.options.create_parser
+# yt_dlp is imported on first use, loading the extractor registry takes a good part
+# of a second, and is not needed before the window shows up
+yt_dlp = None
+create_parser = None
+_import_lock = threading.Lock()
+
+def import_ytdlp():
+    """
+    the yt_dlp package, imported by the first caller
+    """
+    global yt_dlp, create_parser
+    if yt_dlp is not None:
+        return yt_dlp
+    with _import_lock:
+        if yt_dlp is None:
+            import yt_dlp.options as options
+            create_parser = options.create_parser
+            yt_dlp = importlib.import_module("yt_dlp")
+    return yt_dlp
+
+def warm_up() -> dict:
+    """
+    Import yt_dlp, parse the default options, and compile the URL patterns of the
+    extractors ahead of the first task, meant to run in a background thread once the
+    window is presented. Returns the seconds spent in each step.
+    """
+    steps = dict()
+    start = time.perf_counter()
+    import_ytdlp()
+    steps["import yt_dlp"] = time.perf_counter() - start
+    start = time.perf_counter()
+    _default_options()
+    steps["default options"] = time.perf_counter() - start
+    start = time.perf_counter()
+    # no extractor but the generic one matches, so every pattern is compiled
+    url_archive_key("pygyt:warm-up")
+    steps["extractor patterns"] = time.perf_counter() - start
+    return steps
+
+# parse_patched_options() temporarily replaces yt-dlp's module-level parser factory
+_parse_lock = threading.Lock()
 
 def parse_patched_options(opts):
     """
     from yt-dlp/devscripts/cli_to_api.py
     """
+    import_ytdlp()
     patched_parser = create_parser()
     patched_parser.defaults.update({
         "ignoreerrors": False,
@@ -23,18 +73,29 @@ def parse_patched_options(opts):
         "extract_flat": False,
         "concat_playlist": "never",
     })
-    yt_dlp.options.create_parser = lambda: patched_parser
-    try:
-        return yt_dlp.parse_options(opts)
-    finally:
-        yt_dlp.options.create_parser = create_parser
+    with _parse_lock:
+        yt_dlp.options.create_parser = lambda: patched_parser
+        try:
+            return yt_dlp.parse_options(opts)
+        finally:
+            yt_dlp.options.create_parser = create_parser
 
-def ytdl_parse_options(ydl_argv: List[str]):
+@functools.lru_cache(maxsize=None)
+def _default_options() -> dict:
+    """
+    the default options never change, parse them once per process
+    (the returned dict is shared and must not be modified)
+    """
+    return parse_patched_options([]).ydl_opts
+
+@functools.lru_cache(maxsize=64)
+def _options_diff(ydl_argv: tuple) -> dict:
     """
-    let yt_dlp parse and convert arguments to options object
+    options differing from the defaults, memoized by the argv tuple
+    (the returned dict is shared and must not be modified)
     """
-    default_opts = parse_patched_options([]).ydl_opts
-    opts = parse_patched_options(ydl_argv).ydl_opts
+    default_opts = _default_options()
+    opts = parse_patched_options(list(ydl_argv)).ydl_opts
 
     diff = {k: v for k, v in opts.items() if default_opts[k] != v}
     if "postprocessors" in diff:
@@ -42,124 +103,1061 @@ def ytdl_parse_options(ydl_argv: List[str]):
                                   if pp not in default_opts["postprocessors"]]
     return diff
 
+def ytdl_parse_options(ydl_argv: List[str]):
+    """
+    let yt_dlp parse and convert arguments to options object,
+    the result is a private copy the caller is free to modify
+    """
+    # the diff is small, a deep copy of it is cheap compared to parsing
+    return copy.deepcopy(_options_diff(tuple(ydl_argv)))
+
+
+def format_options(audio_only: bool, audio_format: str,
+                   resolution: str = "best", video_ext: str = "best") -> List[str]:
+    """
+    yt-dlp arguments of the audio/video choices of an item
+    """
+    if audio_only:
+        # Audio only options
+        return ["--extract-audio", "--audio-quality=0", f"--audio-format={audio_format}"]
+    # Video preference options
+    format_sort = list()
+    if "best" != resolution:
+        format_sort.append(f"res:{resolution.rsplit(sep='x')[-1]}")
+    if "best" != video_ext:
+        format_sort.append(f"ext:{video_ext}")
+    if len(format_sort) > 0:
+        return [f"--format-sort={','.join(format_sort)}"]
+    # otherwise, use the default -f "bv*+ba/b"
+    return []
+
+# the audio formats of --audio-format that can be streamed into ffmpeg, as
+# (encoder, file extension, quality arguments, codec of a source copied as is)
+STREAM_CODECS = {
+    "mp3": ("libmp3lame", "mp3", ["-q:a", "0"], "mp3"),
+    "aac": ("aac", "m4a", ["-b:a", "256k"], "mp4a"),
+    "m4a": ("aac", "m4a", ["-b:a", "256k"], "mp4a"),
+    "opus": ("libopus", "opus", ["-b:a", "192k"], "opus"),
+    "vorbis": ("libvorbis", "ogg", ["-q:a", "10"], "vorbis"),
+    "flac": ("flac", "flac", [], "flac"),
+    "alac": ("alac", "m4a", [], "alac"),
+    "wav": ("pcm_s16le", "wav", [], None),
+}
+# protocols of a single file over one connection, the fragmented ones are downloaded as usual
+STREAM_PROTOCOLS = ("http", "https")
+# bytes read from the connection and written to ffmpeg at a time
+STREAM_BLOCK = 64 * 1024
+
+@functools.lru_cache(maxsize=1024)
+def url_archive_key(url: str) -> str | None:
+    """
+    The archive key "<extractor> <video id>" of the URL as yt-dlp's download archive does,
+    found by matching the URL against the extractors without any network access.
+    None if no extractor but the generic one is suitable.
+    """
+    import_ytdlp()
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.suitable(url):
+            temp_id = ie.get_temp_id(url)
+            return yt_dlp.utils.make_archive_id(ie, temp_id) if temp_id else None
+    return None
+
+def info_archive_key(info: dict) -> str | None:
+    """
+    the archive key of the extracted info
+    """
+    if info.get("extractor_key") is None or info.get("id") is None:
+        return None
+    import_ytdlp()
+    return yt_dlp.utils.make_archive_id(info["extractor_key"], info["id"])
+
+def get_meta_cache(config: dict) -> MetaCache | None:
+    """
+    the metadata cache configured for the tasks, None if it is disabled
+    """
+    if config.get("meta-cache-ttl", 0) <= 0:
+        return None
+    return shared_cache(f"{config['cache-folder']}/meta",
+                        config["meta-cache-ttl"], config["meta-cache-size"] * 1024 * 1024)
+
+def get_thumbnail_cache(config: dict) -> thumbnails.ThumbnailCache:
+    """
+    the thumbnail cache configured for the tasks,
+    small thumbnails are also kept on disk along with the metadata cache
+    """
+    folder = f"{config['cache-folder']}/thumbnails" if config.get("meta-cache-ttl", 0) > 0 else None
+    return thumbnails.shared_cache(config["thumbnail-cache-size"], folder)
+
+
+_postprocess_scheduler = None
+_postprocess_lock = threading.Lock()
+
+def get_postprocess_scheduler(config: dict) -> TaskScheduler:
+    """
+    The scheduler of the postprocessing stage shared by all downloads, sized to the
+    number of cores by default, independent of the download slots.
+    """
+    global _postprocess_scheduler
+    limit = config.get("max-postprocesses") or os.cpu_count() or 1
+    with _postprocess_lock:
+        if _postprocess_scheduler is None:
+            _postprocess_scheduler = TaskScheduler(limit=limit, name="pygyt-postprocess")
+        elif _postprocess_scheduler.limit != limit:
+            _postprocess_scheduler.set_limits(limit)
+        return _postprocess_scheduler
+
+
+class TaskPersist:
+    """
+    A write of metadata to disk, for persistence only, the info is handed over to the
+    download in memory. Run by a single writer thread, off the path of the tasks.
+    """
+    def __init__(self, write: Callable[..., None], *args):
+        self.write = write
+        self.args = args
+
+    def run(self):
+        try:
+            self.write(*self.args)
+        except OSError as err:
+            print(f"failed to persist metadata: {err}")
+
+_writer = TaskScheduler(limit=1, name="pygyt-writer")
+
+def persist(write: Callable[..., None], *args):
+    """
+    write in the background, in the order of the calls
+    """
+    _writer.submit(TaskPersist(write, *args))
+
+def write_info_json(path: Path, info: dict):
+    """
+    write the info json file, replaced atomically so that no partial file is ever read
+    """
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(info, f)
+    os.replace(tmp, path)
+
+# keys left in the info by the processing of the metadata phase (e.g. the formats selected
+# by its default format selection), as YoutubeDL.sanitize_info(remove_private_keys=True)
+# rejects them, keys starting with "__" and None values are rejected too
+_processed_keys = frozenset((
+    "requested_downloads", "requested_formats", "requested_subtitles", "requested_entries",
+    "entries", "filepath", "_filename", "filename", "infojson_filename", "original_url",
+    "playlist_autonumber"
+))
+
+def _unprocessed(d: dict) -> dict:
+    return {k: v for k, v in d.items()
+            if v is not None and not k.startswith("__") and k not in _processed_keys}
+
+def handoff_info(info: dict) -> dict:
+    """
+    A copy of the extracted info to download with, stripped of what the metadata phase
+    has processed, as download_with_info_file() does, so the formats are selected again
+    with the options of the download. yt-dlp modifies the info and the dicts of its
+    formats and thumbnails while processing them, only those are copied, the rest is
+    shared. Much cheaper than writing and parsing the info json file again.
+    """
+    copied = _unprocessed(info)
+    for key in ("formats", "thumbnails"):
+        if isinstance(copied.get(key), list):
+            copied[key] = [_unprocessed(d) if isinstance(d, dict) else d for d in copied[key]]
+    return copied
+
+def download_with_info(ytdl: yt_dlp.YoutubeDL, info: dict) -> int:
+    """
+    the counterpart of YoutubeDL.download_with_info_file() with the info in memory
+    """
+    try:
+        ytdl.process_ie_result(info, download=True)
+    except (yt_dlp.utils.DownloadError, yt_dlp.utils.EntryNotInPlaylist, yt_dlp.utils.ReExtractInfo) as err:
+        webpage_url = info.get("webpage_url")
+        if webpage_url is None:
+            raise
+        ytdl.report_warning(f"The info failed to download: {err}; trying with URL {webpage_url}")
+        ytdl.download([webpage_url])
+    except yt_dlp.utils.ExtractorError as err:
+        ytdl.report_error(err)
+    return ytdl._download_retcode
+
+
+@functools.lru_cache(maxsize=None)
+def staged_ytdl_class() -> type:
+    """
+    the StagedYoutubeDL class, defined once yt_dlp is imported
+    """
+    class StagedYoutubeDL(import_ytdlp().YoutubeDL):
+        """
+        A YoutubeDL whose postprocessing (merging formats, extracting audio, fixups) can be
+        deferred, to run it in the postprocessing stage after the transfer is done
+        """
+        # the arguments of the post_process() calls deferred, while it is a list
+        deferred = None
+
+        def post_process(self, filename, info, files_to_move=None):
+            if self.deferred is None:
+                return super().post_process(filename, info, files_to_move)
+            self.deferred.append((filename, info, files_to_move))
+            return info
+
+    return StagedYoutubeDL
+
+
+# options set differently by every task, rebound on a pooled YoutubeDL instance
+_per_task_options = ("outtmpl", "paths", "progress_hooks", "postprocessor_hooks", "logger")
+# the pool of YoutubeDL instances owned by each worker thread
+_ytdl_pool = threading.local()
+YTDL_POOL_SIZE = 4
+# the pools of all threads, to close their instances on shutdown, and the lock of all
+# pools, as close_pooled_ytdl() takes the instances out of the pools of other threads
+_ytdl_pools = list()
+_ytdl_pools_lock = threading.Lock()
+_ytdl_pools_closed = False
+
+@contextlib.contextmanager
+def pooled_ytdl(opts: dict):
+    """
+    Check out a YoutubeDL instance from the pool of the calling thread.
+    Instances are keyed by the options other than the per-task ones, so that extractors,
+    cookie jar and HTTP handlers (and their keep-alive connections) are set up once and
+    reused by later tasks run in the same worker thread.
+    """
+    pool = getattr(_ytdl_pool, "instances", None)
+    if pool is None:
+        pool = _ytdl_pool.instances = OrderedDict()
+        with _ytdl_pools_lock:
+            _ytdl_pools.append(pool)
+    key = repr(sorted(((k, v) for k, v in opts.items() if k not in _per_task_options),
+                      key=lambda kv: kv[0]))
+    # an instance is removed while being checked out, nested checkouts get their own
+    with _ytdl_pools_lock:
+        ytdl = pool.pop(key, None)
+    if ytdl is None:
+        # postprocessors take their own copies of the hooks when they are added, so a single
+        # forwarding hook is registered and the hooks of each task are swapped behind it
+        pp_hooks = list(opts.get("postprocessor_hooks", []))
+        def forward_pp_hook(pdict):
+            for hook in pp_hooks:
+                hook(pdict)
+        ytdl = staged_ytdl_class()({**opts, "postprocessor_hooks": [forward_pp_hook]})
+        ytdl._task_pp_hooks = pp_hooks
+    else:
+        for k in _per_task_options:
+            if k in opts:
+                ytdl.params[k] = opts[k]
+            else:
+                ytdl.params.pop(k, None)
+        # the output template is normalized once in the constructor
+        if hasattr(ytdl, "_parse_outtmpl"):
+            ytdl._parse_outtmpl()
+        ytdl._progress_hooks = []
+        for hook in opts.get("progress_hooks", []):
+            ytdl.add_progress_hook(hook)
+        ytdl._task_pp_hooks[:] = opts.get("postprocessor_hooks", [])
+        # the return code of download() is sticky over the life of an instance
+        ytdl._download_retcode = 0
+    try:
+        yield ytdl
+    finally:
+        evicted = list()
+        with _ytdl_pools_lock:
+            if _ytdl_pools_closed:
+                evicted.append(ytdl)
+            else:
+                pool[key] = ytdl
+                while len(pool) > YTDL_POOL_SIZE:
+                    evicted.append(pool.popitem(last=False)[1])
+        for instance in evicted:
+            # same as leaving a `with YoutubeDL(...)` block, saves cookies and closes handlers
+            instance.__exit__(None, None, None)
+
+def close_pooled_ytdl():
+    """
+    Close the pooled instances of all threads on shutdown, the cookie jars are saved and
+    the connections closed. Instances checked out at the time are closed when returned.
+    """
+    global _ytdl_pools_closed
+    with _ytdl_pools_lock:
+        _ytdl_pools_closed = True
+        instances = [ytdl for pool in _ytdl_pools for ytdl in pool.values()]
+        for pool in _ytdl_pools:
+            pool.clear()
+    for ytdl in instances:
+        try:
+            ytdl.__exit__(None, None, None)
+        except Exception as err:
+            print(f"failed to close a YoutubeDL instance: {err}")
+
+
+class TaskLogger:
+    """
+    The logger of yt-dlp for a task, messages are dropped as with the quiet option,
+    only the retries reported in the warnings are counted
+    """
+    def __init__(self):
+        self.retries = 0
+
+    def debug(self, msg: str):
+        pass
+
+    def info(self, msg: str):
+        pass
+
+    def warning(self, msg: str):
+        if "Retrying" in msg:
+            self.retries += 1
+
+    def error(self, msg: str):
+        pass
+
+
+# playlist entries are reported in batches of this size, or of what arrived in the interval
+ENTRIES_BATCH = 100
+ENTRIES_INTERVAL = 0.25
+# metadata tasks of the same video in flight, keyed by the archive key
+_meta_flights = SingleFlight()
 
 class TaskGetMeta(threading.Thread):
     """
-    A threading task for extracting info
+    A threading task for extracting info.
+    A playlist or channel URL is not extracted as a whole, its entries are streamed
+    to the entries callback in batches as the pages of the playlist arrive.
     """
     def __init__(self, config: dict, url: str,
-                 on_done_callback: Callable[[dict, str, str], bool]):
+                 on_done_callback: Callable[[CompactMeta, str, Gdk.Texture, str], bool],
+                 dispatch: Callable[..., object] = GLib.idle_add,
+                 on_entries_callback: Callable[[list, bool, str], bool] | None = None):
         super().__init__()
         self.config = config
+        # how the callback is invoked, the GUI runs it later in the main loop,
+        # the headless mode calls it directly in the worker thread
+        self.dispatch = dispatch
         # the target URL
         self.url = url
         # the callback function after meta is retrieved
         self.on_done_cb = on_done_callback
-        # yt_dlp options
-        if config["additional-options"] is not None:
-            self.opts = ytdl_parse_options(config["additional-options"])
+        # the callback function of playlist entries, playlists are not supported without it
+        self.on_entries_cb = on_entries_callback
+        # time spent in each phase of the task
+        self.timings = Timings(shared_metrics(), "meta")
+        # the archive keys this task leads in _meta_flights, the tasks of duplicates
+        # attached to them get the result of this task
+        self.flight_keys = list()
+        # set once this task is attached to the leader of another key of its video, the
+        # result of the leader is then passed on to the followers of this task by done()
+        self.following = False
+        # set once the result (or the end of the entries) is dispatched to the callbacks
+        self.reported = False
+
+    @functools.cached_property
+    def opts(self) -> dict:
+        """
+        yt_dlp options, built in the worker thread when the task runs,
+        parsing them would import yt_dlp in the main thread
+        """
+        if self.config["additional-options"] is not None:
+            opts = ytdl_parse_options(self.config["additional-options"])
         else:
-            self.opts = dict()
-        # temporary unique ID as the name before the title is known
-        self.idname = f"pygyt_{time.monotonic_ns():x}" 
+            opts = dict()
         # config download home
-        self.opts["paths"] = {"home": f"{config['download-folder']}/{self.idname}"}
-        # save with an unique name instead of "%(title)s.%(ext)s"
-        self.opts["outtmpl"] = {"thumbnail": f"{self.idname}.%(ext)s"}
-        # channel playlist not supported
-        self.opts["noplaylist"] = True
+        opts["paths"] = {"home": self.config['download-folder']}
+        # a video URL with a playlist in it is a video, playlist only URLs are expanded
+        opts["noplaylist"] = True
+        # entries of playlists are not resolved
+        opts["extract_flat"] = "in_playlist"
         # no yt-dlp built-in progress
-        self.opts["noprogress"] = True
+        opts["noprogress"] = True
         # no yt-dlp log messages
-        self.opts["quiet"] = True
-        # no video download, just metadata and thumbnail
-        self.opts["skip_download"] = True
-        # options to download the thumbnail
-        self.opts["writethumbnail"] = True
-        # png format is all we need
-        self.opts["postprocessors"] = [{
-            "format": "png",
-            "key": "FFmpegThumbnailsConvertor",
-            "when": "before_dl"
-        }]
+        opts["quiet"] = True
+        # no video download, just metadata,
+        # the thumbnail is fetched into memory and downscaled by the task itself
+        opts["skip_download"] = True
+        opts["logger"] = TaskLogger()
+        return opts
 
     def run(self):
         """
-        The activity method of the task
+        The activity method of the task, an unexpected error is reported as its result,
+        the item is never left waiting for it
+        """
+        try:
+            self.get_meta()
+        except Exception as err:
+            traceback.print_exc()
+            if not self.reported:
+                self.done(None, None, None, f"unexpected error: {err}")
+
+    def get_meta(self):
+        """
+        the metadata of the URL, from the download archive, a task of the same video,
+        the metadata cache or extracted
         """
-        with yt_dlp.YoutubeDL(self.opts) as ytdl:
+        meta_cache = get_meta_cache(self.config)
+        url_key = url_archive_key(self.url)
+        archive = shared_archive(self.config)
+        if archive is not None and url_key in archive:
+            # a finished download is skipped without any network access
+            entry = meta_cache.get(url_key) if meta_cache is not None else None
+            if entry is not None:
+                self.report_archived(entry["info"], entry["file_name"], url_key)
+            else:
+                self.report_archived({"original_url": self.url}, None, url_key)
+            return
+        # a duplicate of a URL being extracted gets the result of the first one
+        if url_key is not None:
+            if not _meta_flights.join(url_key, self):
+                return
+            self.flight_keys.append(url_key)
+        try:
+            self.extract(meta_cache, url_key, archive)
+        finally:
+            # the followers are never left waiting, e.g. on an unexpected error
+            if not self.following:
+                for follower in self.release_followers():
+                    follower.done(None, None, None, "the extraction of the same video failed")
+
+    def extract(self, meta_cache: MetaCache | None, url_key: str | None, archive: DownloadArchive | None):
+        """
+        extract the info, from the metadata cache if it has the URL
+        """
+        if meta_cache is not None and url_key is not None:
+            with self.timings.phase("cache"):
+                entry = meta_cache.get(url_key)
+            shared_metrics().inc("meta_cache_total", result="miss" if entry is None else "hit")
+            if entry is not None:
+                self.restore_cached(entry)
+                return
+
+        info = dict()
+        with pooled_ytdl(self.opts) as ytdl:
             try:
-                meta = ytdl.sanitize_info(ytdl.extract_info(self.url, download=True))
+                with self.timings.phase("extract"):
+                    # extract without processing first, to tell playlists from videos
+                    info = ytdl.extract_info(self.url, download=False, process=False)
+                    # follow redirections, e.g. a channel URL to its videos tab
+                    for _ in range(3):
+                        if info.get("_type") != "url":
+                            break
+                        info = ytdl.extract_info(info["url"], ie_key=info.get("ie_key"),
+                                                 download=False, process=False)
+                if info.get("_type") in ("playlist", "multi_video"):
+                    if self.on_entries_cb is None:
+                        raise yt_dlp.utils.DownloadError("playlist is not supported")
+                    with self.timings.phase("expand"):
+                        self.expand_entries(info)
+                    self.record(info, "playlist")
+                    for follower in self.release_followers():
+                        follower.expanded_elsewhere()
+                    return
+                # another URL of the same video, e.g. a short link, known only once extracted
+                info_key = info_archive_key(info)
+                if archive is not None and info_key in archive:
+                    self.report_archived(info, yt_dlp.utils.sanitize_filename(
+                        info.get("title") or info["id"]).strip(" ."), info_key)
+                    return
+                if info_key is not None and info_key != url_key:
+                    if not _meta_flights.join(info_key, self):
+                        self.following = True
+                        return
+                    self.flight_keys.append(info_key)
+                with self.timings.phase("process"):
+                    meta = ytdl.process_ie_result(info, download=True)
+                if meta is None:
+                    # the error has been ignored, e.g. with -i
+                    raise yt_dlp.utils.DownloadError("no metadata was extracted")
+                meta = ytdl.sanitize_info(meta)
             except Exception as err:
-                GLib.idle_add(self.on_done_cb, None, str(err))
+                retries.shared_breaker().record(host_of(self.url), retries.transient_error(str(err)))
+                self.record(info, "failed")
+                self.done(None, None, None, str(err))
             else:
+                retries.shared_breaker().record(host_of(self.url), False)
                 # gets title from meta and derives a safe file base name
                 file_name = yt_dlp.utils.sanitize_filename(meta['title']).strip(" .")
-                json_file = f"{self.opts['paths']['home']}/{file_name}.json"
-                # dump meta to info json file
-                with open(json_file, "w") as f:
-                    json.dump(meta, f)
+                home = Path(f"{self.config['download-folder']}/{file_name}")
                 try:
-                    # title is available now, rename the home folder name
-                    new_home = Path(self.opts["paths"]["home"]).rename(
-                        f"{self.config['download-folder']}/{file_name}")
-                    thumbnail_path = new_home.joinpath(f"{self.idname}.png")
-                    if (thumbnail_path.exists()):
-                        thumbnail_path.rename(new_home.joinpath(f"{file_name}.png"))
+                    with self.timings.phase("write_info"):
+                        home.mkdir(parents=True, exist_ok=True)
                 except OSError as oserr:
-                    GLib.idle_add(self.on_done_cb, None, None, str(oserr))
+                    self.record(meta, "failed")
+                    self.done(None, None, None, str(oserr))
                 else:
-                    GLib.idle_add(self.on_done_cb, meta, file_name, "")
+                    # the info goes to the download in memory, the files are for persistence only
+                    if self.config.get("write-info-json", True):
+                        persist(write_info_json, home.joinpath(f"{file_name}.json"), meta)
+                    if meta_cache is not None:
+                        persist(meta_cache.put, [url_key, info_archive_key(meta)], meta, file_name)
+                    thumbnail = self.fetch_thumbnail(ytdl, meta)
+                    self.record(meta, "done")
+                    self.done(self.compact(meta, file_name, home), file_name, thumbnail, "")
+
+    def done(self, meta: CompactMeta | None, file_name: str | None, thumbnail: Gdk.Texture | None, strerr: str):
+        """
+        report the result to the callback, and to the tasks of the duplicates attached to this task
+        """
+        followers = self.release_followers()
+        self.reported = True
+        self.dispatch(self.on_done_cb, meta, file_name, thumbnail, strerr)
+        for follower in followers:
+            follower.done(meta, file_name, thumbnail, strerr)
+
+    def release_followers(self) -> list:
+        """
+        end the flights led by this task, returns the tasks attached to them
+        """
+        followers = [f for key in self.flight_keys for f in _meta_flights.done(key)]
+        self.flight_keys = list()
+        return followers
+
+    def expanded_elsewhere(self):
+        """
+        the playlist is a duplicate of a playlist expanded by the task this task is attached to,
+        it ends without entries of its own
+        """
+        if self.on_entries_cb is None:
+            self.done(None, None, None, "playlist is not supported")
+            return
+        for follower in self.release_followers():
+            follower.expanded_elsewhere()
+        self.reported = True
+        self.dispatch(self.on_entries_cb, [], True, "")
+
+    def report_archived(self, meta: dict, file_name: str | None, key: str):
+        """
+        the video is in the download archive, the item is reported without downloading it again
+        """
+        thumbnail = self.fetch_thumbnail(None, meta)
+        self.record(meta, "archived")
+        self.done(CompactMeta(meta, file_name, key, None, archived=True), file_name, thumbnail, "")
+
+    def record(self, info: dict, result: str):
+        """
+        record the timings of the task into the shared metrics
+        """
+        self.timings.record(info.get("extractor_key") or info.get("ie_key"), result,
+                            retries=self.opts["logger"].retries)
+
+    def expand_entries(self, info: dict):
+        """
+        Stream the flat entries of a playlist to the entries callback, each entry is a dict
+        of "url", "title", "id" and "ie_key". The entries of most extractors are generated
+        page by page, so the first batch is reported long before the playlist is complete.
+        """
+        entries = info.get("entries") or []
+        # a PagedList is iterated page by page instead of fetching all of its pages at once
+        if hasattr(entries, "_getslice"):
+            entries = entries._getslice(0, None)
+        batch = list()
+        reported = time.monotonic()
+        try:
+            for entry in entries:
+                url = entry.get("url") or entry.get("webpage_url") if entry else None
+                if not url:
+                    continue
+                batch.append({"url": url, "title": entry.get("title"),
+                              "id": entry.get("id"), "ie_key": entry.get("ie_key")})
+                if len(batch) >= ENTRIES_BATCH or time.monotonic() - reported > ENTRIES_INTERVAL:
+                    self.dispatch(self.on_entries_cb, batch, False, "")
+                    batch = list()
+                    reported = time.monotonic()
+        except Exception as err:
+            self.reported = True
+            self.dispatch(self.on_entries_cb, batch, True, str(err))
+        else:
+            self.reported = True
+            self.dispatch(self.on_entries_cb, batch, True, "")
+
+    def fetch_thumbnail(self, ytdl: yt_dlp.YoutubeDL | None, meta: dict) -> Gdk.Texture | None:
+        """
+        The downscaled thumbnail texture from the cache, or fetched into memory and
+        decoded in this worker thread if not cached and a YoutubeDL instance is given.
+        None if no thumbnail is available.
+        """
+        if not self.config.get("thumbnails", True):
+            return None
+        cache = get_thumbnail_cache(self.config)
+        key = info_archive_key(meta) or self.url
+        texture = cache.get(key)
+        if texture is not None or ytdl is None:
+            return texture
+        url = thumbnails.pick_thumbnail(meta)
+        if url is None:
+            return None
+        try:
+            with self.timings.phase("thumbnail_fetch"):
+                response = ytdl.urlopen(url)
+                try:
+                    data = response.read()
+                finally:
+                    response.close()
+            with self.timings.phase("thumbnail_decode"):
+                return cache.put(key, thumbnails.decode_scaled(data))
+        except Exception:
+            # a missing thumbnail is not an error of the item
+            return None
+
+    def restore_cached(self, entry: dict):
+        """
+        Fill the item from a metadata cache hit, without any network access.
+        The info json file is written again only if it has been removed from the download folder.
+        """
+        meta, file_name = entry["info"], entry["file_name"]
+        home = Path(f"{self.config['download-folder']}/{file_name}")
+        json_file = home.joinpath(f"{file_name}.json")
+        try:
+            if not json_file.exists():
+                home.mkdir(parents=True, exist_ok=True)
+                if self.config.get("write-info-json", True):
+                    persist(write_info_json, json_file, meta)
+        except OSError as oserr:
+            self.record(meta, "failed")
+            self.done(None, None, None, str(oserr))
+        else:
+            # only a cached thumbnail, no network access on a cache hit
+            thumbnail = self.fetch_thumbnail(None, meta)
+            self.record(meta, "cached")
+            self.done(self.compact(meta, file_name, home), file_name, thumbnail, "")
+
+    def compact(self, meta: dict, file_name: str, home: Path) -> CompactMeta:
+        """
+        Reduce the info to what the item keeps, here in the worker thread.
+        The full info stays available from memory for a while, and from the info json file.
+        """
+        json_file = home.joinpath(f"{file_name}.json")
+        info_json = (str(json_file) if self.config.get("write-info-json", True) or json_file.exists()
+                     else None)
+        return CompactMeta(meta, file_name, info_archive_key(meta) or self.url, info_json)
+
+
+class TaskInterrupted(Exception):
+    """
+    raised from the progress hook to stop a download asked to be interrupted
+    """
+
+# the intermediate files of a download, e.g. "NAME.f137.mp4" before merging, the format id
+# starts with a digit not to take the subtitles of a language, e.g. "NAME.fr.vtt", for one
+_intermediate_file = re.compile(r"\.f\d[\w-]*\.\w+$")
+
+def remove_partial_files(folder: str, file_name: str):
+    """
+    remove the partial and intermediate files of a download, e.g. when it is cancelled
+    """
+    for path in Path(folder).glob(f"{glob.escape(file_name)}.*"):
+        rest = path.name[len(file_name):]
+        if ".part" in rest or rest.endswith(".ytdl") or _intermediate_file.match(rest):
+            try:
+                path.unlink()
+            except OSError:
+                pass
 
 
 class TaskGetFile(threading.Thread):
     """
-    A threading task for downloading audio/video file
+    A threading task for downloading audio/video file.
+    A running download can be interrupted cooperatively, it stops at its next progress:
+    "paused" keeps the partial files to resume from, "cancelled" removes them, and
+    "preempted" queues the task again to resume once a slot is free.
     """
     def __init__(self, config: dict, url: str,
-                 on_progress_callback: Callable[[str, float], None],
-                 on_done_callback: Callable[[int, str], bool]):
+                 on_done_callback: Callable[[int, str], bool],
+                 dispatch: Callable[..., object] = GLib.idle_add,
+                 info: CompactMeta | dict | None = None):
         super().__init__()
         self.config = config
+        # how the callback is invoked, see TaskGetMeta
+        self.dispatch = dispatch
         # the target URL
         self.url = url
-        # the callback function to update progress
-        self.on_progress_cb = on_progress_callback
+        # the info extracted by TaskGetMeta, handed over in memory,
+        # the info json file is read instead if not given
+        self.info = info
+        # the latest progress published by the hook, as a tuple of
+        # (status, downloaded_bytes, total_bytes, speed, eta), polled by the GUI
+        self.progress = None
         # the callback function after file is retrieved
         self.on_done_cb = on_done_callback
-        # yt_dlp options
-        if config["additional-options"] is not None:
-            self.opts = ytdl_parse_options(config["additional-options"])
+        # the share of the global bandwidth while downloading, and the downloaded
+        # bytes of the current file last taken out of it
+        self.bandwidth_lease = None
+        self.consumed_bytes = 0
+        # time spent in each phase of the task, the transfer of every file and each
+        # postprocessor (e.g. FFmpegMerger, FFmpegExtractAudio) are timed by the hooks
+        self.timings = Timings(shared_metrics(), "file")
+        self.transfer_started = None
+        self.pp_started = dict()
+        self.downloaded_bytes = 0
+        self.extractor = None
+        # the key recorded in the download archive once the download is done
+        self.archive_key = None
+        # retries of the download after transient errors so far
+        self.attempt = 0
+        # "paused", "cancelled" or "preempted" once asked to be interrupted
+        self.interrupted = None
+        # the concurrent fragment downloads chosen for the next fragmented file, None unless
+        # tuned, and the measurement of the file being downloaded as
+        # [start time, start bytes, start fragment index, retries at start, last fragment index]
+        self.fragment_concurrency = None
+        self.fragment_window = None
+        self.ytdl_params = None
+        # set once the result is dispatched to the callback
+        self.reported = False
+
+    @functools.cached_property
+    def opts(self) -> dict:
+        """
+        yt_dlp options, built when the task runs, see TaskGetMeta
+        """
+        if self.config["additional-options"] is not None:
+            opts = ytdl_parse_options(self.config["additional-options"])
         else:
-            self.opts = dict()
+            opts = dict()
         # config download home
-        self.opts["paths"] = {"home": config['download-folder']}
-        self.opts["outtmpl"] = {"default": f"{self.config['file_name']}.%(ext)s"}
+        opts["paths"] = {"home": self.config['download-folder']}
+        opts["outtmpl"] = {"default": f"{self.config['file_name']}.%(ext)s"}
         # channel playlist not supported
-        self.opts["noplaylist"] = True
+        opts["noplaylist"] = True
         # no yt-dlp built-in progress
-        self.opts["noprogress"] = True
+        opts["noprogress"] = True
         # no yt-dlp log messages
-        self.opts["quiet"] = True
-        # no color code, we interpret the progress in regular string
-        self.opts["color"] = {"stderr": "no_color", "stdout": "no_color"}
+        opts["quiet"] = True
+        # no color code in the messages of yt-dlp
+        opts["color"] = {"stderr": "no_color", "stdout": "no_color"}
+        # fragments are retried in place by yt-dlp with a short backoff, the download
+        # as a whole is retried by the scheduler, resuming from the partial files
+        opts.setdefault("fragment_retries", self.config.get("fragment-retries", 3))
+        opts.setdefault("retry_sleep_functions", {"fragment": retries.fragment_backoff})
+        opts["continuedl"] = True
         # set downloading progress hook
-        self.opts["progress_hooks"] = [self.progress_hook]
+        opts["progress_hooks"] = [self.progress_hook]
+        opts["postprocessor_hooks"] = [self.postprocessor_hook]
+        opts["logger"] = TaskLogger()
+        return opts
+
+    def interrupt(self, reason: str):
+        """
+        ask the download to stop at its next progress, called from any thread
+        """
+        self.interrupted = reason
 
     def run(self):
         """
-        The activity method of the task
+        The activity method of the task, an unexpected error is reported as its result,
+        the item is never left waiting for it
+        """
+        try:
+            self.download()
+        except RetryLater:
+            raise
+        except Exception as err:
+            traceback.print_exc()
+            if self.bandwidth_lease is not None:
+                self.bandwidth_lease.release()
+            if not self.reported:
+                self.finish(-1, f"unexpected error: {err}")
+
+    def download(self):
+        """
+        download the file, and hand its postprocessing over to the postprocessing stage
         """
-        with yt_dlp.YoutubeDL(self.opts) as ytdl:
+        if "preempted" == self.interrupted:
+            # preempted before it started, the slot is its own now
+            self.interrupted = None
+        if self.interrupted is not None:
+            self.finish(-1, self.interrupted)
+            return
+        self.bandwidth_lease = bandwidth.shared_manager().lease(self.config.get("bandwidth-weight", 1.0))
+        with pooled_ytdl(self.opts) as ytdl:
+            self.bandwidth_lease.bind(ytdl.params)
+            # postprocessing is handed over to its own stage, not to hold the download slot
+            ytdl.deferred = list() if self.config.get("postprocess-stage", True) else None
             try:
-                if "info_json" in self.config:
-                    error_code = ytdl.download_with_info_file(self.config["info_json"])
+                with self.timings.phase("check_info"):
+                    info = self.load_info()
+                # the compact metadata still tells the extractor if the info has expired
+                self.tune_fragments(ytdl, (info or {}).get("extractor_key")
+                                    or getattr(self.info, "extractor_key", None))
+                if info is None and self.stream_target() is not None:
+                    # re-extracted without downloading, the audio is streamed below
+                    info = self.extract_again(ytdl, download=False)
+                if info is not None:
+                    self.archive_key = info_archive_key(info)
+                    error_code = self.stream_audio(ytdl, info) if self.stream_target() is not None else None
+                    if error_code is None:
+                        error_code = download_with_info(ytdl, info)
                 else:
-                    error_code = ytdl.download(self.url)
+                    # format URLs of cached metadata expire, re-extract right before downloading
+                    self.extract_again(ytdl, download=True)
+                    error_code = 0
             except Exception as err:
-                GLib.idle_add(self.on_done_cb, -1, str(err))
+                error_code, strerr = -1, str(err)
             else:
-                GLib.idle_add(self.on_done_cb, error_code, "")
+                strerr = ""
+            finally:
+                # restore the ratelimit of the pooled instance before it is reused
+                self.bandwidth_lease.release()
+                jobs, ytdl.deferred = ytdl.deferred, None
+        if 0 != error_code and self.interrupted is not None:
+            self.stop(error_code)
+            return
+        if 0 != error_code:
+            self.retry_later(strerr)
+        else:
+            retries.shared_breaker().record(host_of(self.url), False)
+        if 0 == error_code and jobs:
+            _, downloaded, total, _, _ = self.progress or (None, 0, None, None, None)
+            self.progress = ("postprocessing", downloaded, total, None, None)
+            get_postprocess_scheduler(self.config).submit(TaskPostProcess(self, jobs))
+        else:
+            self.finish(error_code, strerr)
+
+    def extract_again(self, ytdl: yt_dlp.YoutubeDL, download: bool) -> dict:
+        """
+        extract the info of the URL again, e.g. once the format URLs have expired,
+        and cache it for later tasks
+        """
+        meta = ytdl.sanitize_info(ytdl.extract_info(self.url, download=download))
+        self.archive_key = info_archive_key(meta)
+        meta_cache = get_meta_cache(self.config)
+        if meta_cache is not None:
+            meta_cache.put([url_archive_key(self.url), info_archive_key(meta)],
+                           meta, self.config["file_name"])
+        return meta
+
+    def stream_target(self) -> str | None:
+        """
+        the audio format to stream into ffmpeg, None unless streaming is enabled and
+        the audio is extracted in a format it can encode
+        """
+        if not self.config.get("stream-audio"):
+            return None
+        for pp in self.opts.get("postprocessors") or []:
+            if "FFmpegExtractAudio" == pp.get("key") and pp.get("preferredcodec") in STREAM_CODECS:
+                return pp["preferredcodec"]
+        return None
+
+    def stream_audio(self, ytdl: yt_dlp.YoutubeDL, info: dict) -> int | None:
+        """
+        Download the selected audio straight into the stdin of ffmpeg, which encodes it
+        while it arrives, so only the final audio file is written and the transcoding
+        is done along with the transfer instead of after it.
+        The bytes go through the progress hook as those of yt-dlp do, for the bandwidth,
+        the progress and the interruptions. A stream can not be resumed, a retried or
+        preempted one starts over.
+        None if the format can not be streamed (fragmented, no ffmpeg, or ffmpeg failed
+        before writing any output), to be downloaded and extracted by yt-dlp as usual.
+        """
+        ffmpeg = yt_dlp.postprocessor.FFmpegPostProcessor(ytdl)
+        if not ffmpeg.available:
+            return None
+        # selects the format without downloading, on a copy as download_with_info() may follow
+        selected = ytdl.process_ie_result(handoff_info(info), download=False)
+        if selected.get("requested_formats") or selected.get("protocol") not in STREAM_PROTOCOLS:
+            return None
+        encoder, ext, quality, source_codec = STREAM_CODECS[self.stream_target()]
+        if source_codec is not None and (selected.get("acodec") or "").startswith(source_codec):
+            # already in the format, only the container is written
+            codec_args = ["-c:a", "copy"]
+        else:
+            codec_args = ["-c:a", encoder, *quality]
+        folder = Path(self.config["download-folder"])
+        final = folder.joinpath(f"{self.config['file_name']}.{ext}")
+        # named as a partial file, removed along with the others if cancelled
+        partial = folder.joinpath(f"{self.config['file_name']}.part.{ext}")
+        with tempfile.TemporaryFile() as errors:
+            # the messages go to a file, a pipe not read while writing stdin could fill up
+            process = subprocess.Popen(
+                [ffmpeg.executable, "-y", "-hide_banner", "-nostdin", "-loglevel", "error",
+                 "-i", "pipe:0", "-vn", *codec_args, str(partial)],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors)
+            try:
+                downloaded = self.stream_into(ytdl, selected, process.stdin)
+                with self.timings.phase("transcode_tail"):
+                    with contextlib.suppress(BrokenPipeError):
+                        process.stdin.close()
+                    returncode = process.wait()
+            except BaseException:
+                process.kill()
+                process.wait()
+                partial.unlink(missing_ok=True)
+                raise
+            if 0 != returncode and (not partial.exists() or 0 == partial.stat().st_size):
+                # ffmpeg could not read the stream at all, e.g. an mp4 with its index (moov)
+                # at the end, which needs a seekable input
+                partial.unlink(missing_ok=True)
+                shared_metrics().inc("stream_fallback_total", extractor=self.extractor or "unknown")
+                # the download as usual counts its bytes from 0
+                self.consumed_bytes = 0
+                return None
+            if 0 != returncode:
+                partial.unlink(missing_ok=True)
+                errors.seek(0)
+                message = errors.read().decode(errors="replace").strip().splitlines()
+                raise yt_dlp.utils.PostProcessingError(
+                    f"ffmpeg: {message[-1] if message else f'exit status {returncode}'}")
+        os.replace(partial, final)
+        self.progress_hook({"status": "finished", "downloaded_bytes": downloaded,
+                            "total_bytes": downloaded, "info_dict": selected})
+        shared_metrics().inc("streamed_audio_total", extractor=self.extractor or "unknown")
+        return 0
+
+    def stream_into(self, ytdl: yt_dlp.YoutubeDL, selected: dict, pipe) -> int:
+        """
+        Write the bytes of the selected format into the pipe, in ranges of its http chunk
+        size if the extractor asks for one (e.g. YouTube throttles whole-file requests).
+        Returns the bytes downloaded, stops early if ffmpeg exits.
+        """
+        chunk_size = (selected.get("downloader_options") or {}).get("http_chunk_size")
+        total = selected.get("filesize")
+        downloaded = 0
+        started = time.monotonic()
+        while True:
+            headers = dict(selected.get("http_headers") or {})
+            if chunk_size:
+                headers["Range"] = f"bytes={downloaded}-{downloaded + chunk_size - 1}"
+            response = ytdl.urlopen(yt_dlp.networking.Request(selected["url"], headers=headers))
+            try:
+                if total is None:
+                    content_range = re.search(r"/(\d+)$", response.headers.get("Content-Range") or "")
+                    length = response.headers.get("Content-Length")
+                    total = (int(content_range.group(1)) if content_range is not None
+                             else int(length) if length and not chunk_size else None)
+                received = 0
+                while block := response.read(STREAM_BLOCK):
+                    try:
+                        pipe.write(block)
+                    except BrokenPipeError:
+                        # ffmpeg failed, its exit status tells why
+                        return downloaded
+                    received += len(block)
+                    downloaded += len(block)
+                    elapsed = time.monotonic() - started
+                    speed = downloaded / elapsed if elapsed > 0 else None
+                    self.progress_hook({
+                        "status": "downloading",
+                        "downloaded_bytes": downloaded,
+                        "total_bytes": total,
+                        "speed": speed,
+                        "eta": (total - downloaded) / speed if total and speed else None,
+                        "info_dict": selected
+                    })
+            finally:
+                response.close()
+            if not chunk_size or received < chunk_size or (total is not None and downloaded >= total):
+                return downloaded
+
+    def stop(self, error_code: int):
+        """
+        end the download interrupted by the progress hook
+        """
+        self.fragment_window = None
+        if self.transfer_started is not None:
+            self.timings.add("transfer", time.monotonic() - self.transfer_started)
+            self.transfer_started = None
+        _, downloaded, total, _, _ = self.progress or (None, 0, None, None, None)
+        self.progress = (self.interrupted, downloaded, total, None, None)
+        if "preempted" == self.interrupted:
+            # back to the queue with its priority, resumed from the partial files
+            self.interrupted = None
+            raise RetryLater(0)
+        if "cancelled" == self.interrupted:
+            remove_partial_files(self.config["download-folder"], self.config["file_name"])
+        self.finish(error_code, self.interrupted)
+
+    def tune_fragments(self, ytdl: yt_dlp.YoutubeDL, extractor: str | None):
+        """
+        Set the concurrent fragment downloads learned for the extractor, unless given by
+        the user. yt-dlp reads it when a file starts, so a change made by the progress
+        hook applies from the next file of the download, e.g. the audio after the video.
+        """
+        if "concurrent_fragment_downloads" in self.opts:
+            return
+        self.fragment_concurrency = shared_tuning(self.config).choose(extractor)
+        self.ytdl_params = ytdl.params
+        self.ytdl_params["concurrent_fragment_downloads"] = self.fragment_concurrency
+
+    def measure_fragments(self, pdict: dict):
+        """
+        Measure the throughput and the latency of the fragments of a file from the progress,
+        and record them for the extractor once the file is finished. Throttling (fragments
+        retried) halves the concurrency of the next file.
+        """
+        if pdict.get("fragment_index") is None and self.fragment_window is None:
+            return
+        now = time.monotonic()
+        downloaded = pdict.get("downloaded_bytes") or 0
+        if self.fragment_window is None:
+            self.fragment_window = [now, downloaded, pdict["fragment_index"], self.opts["logger"].retries,
+                                    pdict["fragment_index"]]
+            return
+        if "downloading" == pdict["status"]:
+            self.fragment_window[4] = pdict.get("fragment_index") or self.fragment_window[4]
+            return
+        started, start_bytes, start_index, start_retries, last_index = self.fragment_window
+        self.fragment_window = None
+        if "finished" != pdict["status"]:
+            return
+        fragments = last_index - start_index
+        seconds = now - started
+        if fragments < 4 or seconds <= 0:
+            return
+        throttled = self.opts["logger"].retries > start_retries
+        shared_tuning(self.config).record(self.extractor, self.fragment_concurrency,
+                                          (downloaded - start_bytes) / seconds, throttled)
+        # each fragment takes this long on one of the concurrent connections
+        shared_metrics().observe("fragment_seconds", seconds * self.fragment_concurrency / fragments,
+                                 extractor=self.extractor or "unknown")
+        if throttled and self.fragment_concurrency > 1:
+            self.fragment_concurrency = max(shared_tuning(self.config).low, self.fragment_concurrency // 2)
+            self.ytdl_params["concurrent_fragment_downloads"] = self.fragment_concurrency
+
+    def retry_later(self, strerr: str):
+        """
+        Raise RetryLater to be queued again after a backoff, if the error is transient and
+        retries are left. The download resumes from its .part file, or from the fragments
+        downloaded so far. A transient error also counts against the breaker of the host.
+        """
+        transient = retries.transient_error(strerr)
+        retries.shared_breaker().record(host_of(self.url), transient)
+        if not transient or self.attempt >= self.config.get("retries", 5):
+            return
+        delay = retries.backoff_delay(self.attempt)
+        self.attempt += 1
+        self.fragment_window = None
+        if self.transfer_started is not None:
+            self.timings.add("transfer", time.monotonic() - self.transfer_started)
+            self.transfer_started = None
+        _, downloaded, total, _, _ = self.progress or (None, 0, None, None, None)
+        self.progress = (f"retrying in {delay:.0f}s", downloaded, total, None, None)
+        raise RetryLater(delay)
+
+    def finish(self, error_code: int, strerr: str):
+        """
+        record the timings and report the result, after the postprocessing if any
+        """
+        self.timings.record(self.extractor, "done" if 0 == error_code else self.interrupted or "failed",
+                            self.downloaded_bytes, self.opts["logger"].retries + self.attempt)
+        archive = shared_archive(self.config)
+        if 0 == error_code and archive is not None:
+            archive.add(self.archive_key or url_archive_key(self.url))
+        self.reported = True
+        self.dispatch(self.on_done_cb, error_code, strerr)
+
+    def load_info(self) -> dict | None:
+        """
+        The info to download with, from memory or from the info json file.
+        None if it is not available or its format URLs have expired.
+        """
+        info = self.info.full_info() if isinstance(self.info, CompactMeta) else self.info
+        if info is not None:
+            return None if formats_expired(info) else handoff_info(info)
+        try:
+            with open(self.config["info_json"]) as f:
+                info = json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+        return None if formats_expired(info) else handoff_info(info)
 
     def progress_hook(self, pdict: dict):
         """
@@ -176,11 +1174,79 @@ class TaskGetFile(threading.Thread):
             'downloaded_bytes': 1047552,
             'elapsed': 0.38120484352111816,
             'eta': 1,
+            'speed': 2957639.6,
+            'total_bytes': 4005376,
+        Every call replaces the progress slot with a new tuple, the assignment is atomic,
+        so the GUI never waits for the hook and intermediate values are simply overwritten.
+        The newly downloaded bytes are taken out of the bandwidth lease, which may sleep
+        here to hold the download at its share of the global rate.
         """
-        if "downloading" == pdict["status"]:
-            percent_float = float(str.strip(pdict["_percent_str"], " %")) / 100.0
-            GLib.idle_add(self.on_progress_cb, pdict["status"], percent_float)
-        elif "finished" == pdict["status"]:
-            GLib.idle_add(self.on_progress_cb, pdict["status"], 1.0)
-        elif "error" == pdict['status']:
-            GLib.idle_add(self.on_progress_cb, pdict["status"], 0.0)
+        if self.interrupted is not None:
+            raise TaskInterrupted(self.interrupted)
+        status = pdict["status"]
+        downloaded = pdict.get("downloaded_bytes") or 0
+        total = pdict.get("total_bytes") or pdict.get("total_bytes_estimate")
+        if self.extractor is None:
+            self.extractor = (pdict.get("info_dict") or {}).get("extractor_key")
+        if self.fragment_concurrency is not None:
+            self.measure_fragments(pdict)
+        if "downloading" == status:
+            self.progress = (status, downloaded, total, pdict.get("speed"), pdict.get("eta"))
+            if self.transfer_started is None:
+                self.transfer_started = time.monotonic()
+            # the count starts over for every file of a download, e.g. video and audio
+            if downloaded > self.consumed_bytes and self.bandwidth_lease is not None:
+                self.bandwidth_lease.consume(downloaded - self.consumed_bytes)
+            self.consumed_bytes = downloaded
+        elif "finished" == status:
+            self.consumed_bytes = 0
+            self.downloaded_bytes += downloaded
+            if self.transfer_started is not None:
+                self.timings.add("transfer", time.monotonic() - self.transfer_started)
+                self.transfer_started = None
+            self.progress = (status, downloaded, total or downloaded, None, None)
+        elif "error" == status:
+            self.progress = (status, 0, total, None, None)
+
+    def postprocessor_hook(self, pdict: dict):
+        """
+        postprocessing callback by yt-dlp, to time each postprocessor as a phase
+        """
+        name = pdict.get("postprocessor")
+        if "started" == pdict.get("status"):
+            self.pp_started[name] = time.monotonic()
+        elif "finished" == pdict.get("status") and name in self.pp_started:
+            self.timings.add(name, time.monotonic() - self.pp_started.pop(name))
+
+
+class TaskPostProcess:
+    """
+    The postprocessing deferred by a TaskGetFile, run by the postprocessing scheduler
+    once the transfer is done and its download slot has been released
+    """
+    def __init__(self, task_get_file: TaskGetFile, jobs: list):
+        self.task_get_file = task_get_file
+        # the arguments of the deferred post_process() calls
+        self.jobs = jobs
+
+    def run(self):
+        task = self.task_get_file
+        if "cancelled" == task.interrupted:
+            # cancelled while waiting for the stage, the downloaded files are not worth the work
+            remove_partial_files(task.config["download-folder"], task.config["file_name"])
+            task.finish(-1, task.interrupted)
+            return
+        try:
+            with pooled_ytdl(task.opts) as ytdl, task.timings.phase("postprocess"):
+                for filename, info, files_to_move in self.jobs:
+                    # postprocessors added for the item (e.g. the merger) are bound to the
+                    # instance of the download thread, which is used by other tasks by now
+                    for pp in info.get("__postprocessors") or []:
+                        pp._progress_hooks = []
+                        pp.set_downloader(ytdl)
+                    ytdl.post_process(filename, info, files_to_move)
+        except Exception as err:
+            error_code, strerr = -1, f"Postprocessing: {err}"
+        else:
+            error_code, strerr = 0, ""
+        task.finish(error_code, strerr)